@@ -1,5 +1,7 @@
 import logging
+import os
 
+from lakesuperior.dictionaries.namespaces import ns_mgr as nsm
 from lakesuperior.env import env
 from lakesuperior.store.ldp_rs.lmdb_store import TxnManager
 
@@ -25,3 +27,113 @@ def stats():
 
     return repo_stats
 
+
+
+def migrate_term_format():
+    '''
+    Convert the terms of a legacy graph store to the compact serialization.
+
+    The repository must not be in use by any other process.
+
+    @return int Number of converted terms.
+    '''
+    return env.app_globals.rdf_store.migrate_term_format(
+            namespaces=[ns for pfx, ns in nsm.namespaces()])
+
+
+def rehash_terms(hash_algo):
+    '''
+    Rebuild the term hash index of the graph store with a different hashing
+    algorithm.
+
+    The repository must not be in use by any other process.
+
+    @param hash_algo (string) Hashing algorithm.
+
+    @return int Number of hashed terms.
+    '''
+    return env.app_globals.rdf_store.rehash_terms(hash_algo)
+
+
+def rebuild_index(indices=None, online=False, workers=None, progress=None):
+    '''
+    Rebuild the graph store indices from the main data.
+
+    @param indices (iterable(string)) Indices to rebuild. By default, all
+    indices are rebuilt.
+    @param online (bool) Whether to keep the store readable during the
+    rebuild. If False, the repository must not be in use by any other
+    process.
+    @param workers (int) Maximum number of indices built in parallel.
+    @param progress (callable) Progress callback. See
+    `LmdbStore.rebuild_indices`.
+
+    @return dict Number of entries written, keyed by index.
+    '''
+    return env.app_globals.rdf_store.rebuild_indices(
+            indices, online=online, workers=workers, progress=progress)
+
+
+def cleanup(batch_size=1000, limit=None, progress=None):
+    '''
+    Delete orphan terms from the graph store.
+
+    This can run while the repository is in use.
+
+    @param batch_size (int) Number of terms scanned per transaction.
+    @param limit (int) Maximum number of terms scanned. The next run resumes
+    where this one stopped.
+    @param progress (callable) Progress callback. See
+    `LmdbStore.purge_orphan_terms`.
+
+    @return dict Cleanup report.
+    '''
+    return env.app_globals.rdf_store.purge_orphan_terms(
+            batch_size=batch_size, limit=limit, progress=progress)
+
+
+def backup(dest, progress=None):
+    '''
+    Copy the graph store and the binary store to a backup location.
+
+    This can run while the repository is in use. The graph store is copied
+    first, from a consistent snapshot, and the binary store afterwards, so
+    that all the binaries that the graph store copy refers to are included.
+
+    The graph store is copied to the `ldprs_store` subdirectory of the
+    destination and the binary store to the `ldpnr_store` subdirectory.
+    These can be used as the store locations of a restored repository.
+
+    @param dest (string) Destination directory. It must not contain a
+    backup.
+    @param progress (callable) Function called with the name of each store
+    part (`main`, `index` or `binaries`) and its report as each is copied.
+    For binaries, it is also called periodically while they are copied.
+    See `LmdbStore.backup` and `DefaultLayout.snapshot`.
+
+    @return dict Copy reports keyed by store part.
+    '''
+    ret = env.app_globals.rdf_store.backup(
+            os.path.join(dest, 'ldprs_store'), progress=progress)
+
+    def nr_progress(ct, size):
+        progress('binaries', {'files': ct, 'bytes': size})
+
+    ret['binaries'] = env.app_globals.nonrdfly.snapshot(
+            os.path.join(dest, 'ldpnr_store'),
+            progress=nr_progress if progress else None)
+
+    return ret
+
+
+def set_durability(profile):
+    '''
+    Switch the graph store of the current process to a different durability
+    profile.
+
+    No transaction may be open while this runs.
+
+    @param profile (string) Durability profile. See
+    `LmdbStore.DURABILITY_PROFILES`.
+    '''
+    env.app_globals.rdf_store.set_durability(profile)
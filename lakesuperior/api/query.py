@@ -30,3 +30,32 @@ def sparql_query(qry_str, fmt):
         out_stream = BytesIO(qres.serialize(format=fmt))
 
     return out_stream
+
+
+def term_query(pred, cmp, term, limit=None, offset=0):
+    '''
+    Find the resources with a property matching a term.
+
+    See `RsrcCentricLayout.term_search` for the parameters.
+
+    @return list(string) UIDs of the matching resources.
+    '''
+    with TxnManager(rdf_store) as txn:
+        return [
+                rdfly.uri_to_uid(uri)
+                for uri in rdfly.term_search(pred, cmp, term, limit, offset)]
+
+
+def fulltext_query(text, pred=None, limit=None, offset=0):
+    '''
+    Find the resources with string literals containing the words of a text.
+
+    See `RsrcCentricLayout.fulltext_search` for the parameters.
+
+    @return list(string) UIDs of the matching resources, most relevant
+    first.
+    '''
+    with TxnManager(rdf_store) as txn:
+        return [
+                rdfly.uri_to_uid(uri)
+                for uri in rdfly.fulltext_search(text, pred, limit, offset)]
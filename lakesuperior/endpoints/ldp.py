@@ -4,6 +4,7 @@ import pdb
 from collections import defaultdict
 from io import BytesIO
 from pprint import pformat
+from urllib.parse import urlencode
 from uuid import uuid4
 
 import arrow
@@ -19,7 +20,7 @@ from lakesuperior.dictionaries.namespaces import ns_collection as nsc
 from lakesuperior.dictionaries.namespaces import ns_mgr as nsm
 from lakesuperior.exceptions import (ResourceNotExistsError, TombstoneError,
         ServerManagedTermError, InvalidResourceError, SingleSubjectError,
-        ResourceExistsError, IncompatibleLdpTypeError)
+        ResourceExistsError, IncompatibleLdpTypeError, InvalidPageError)
 from lakesuperior.globals import RES_CREATED
 from lakesuperior.model.ldp_factory import LdpFactory
 from lakesuperior.model.ldp_nr import LdpNr
@@ -122,13 +123,27 @@ def get_resource(uid, force_rdf=False):
     `*/fcr:metadata` endpoint. The default is False.
     '''
     logger.info('UID: {}'.format(uid))
-    out_headers = std_headers
+    out_headers = dict(std_headers)
     repr_options = defaultdict(dict)
+    page_size = request.args.get('page_size')
     if 'prefer' in request.headers:
         prefer = g.tbox.parse_rfc7240(request.headers['prefer'])
         logger.debug('Parsed Prefer header: {}'.format(pformat(prefer)))
         if 'return' in prefer:
             repr_options = parse_repr_options(prefer['return'])
+            # LDP Paging hint. The query string takes precedence.
+            if page_size is None:
+                page_size = prefer['return'].get('parameters', {}).get(
+                        'max-member-count')
+    if page_size is not None:
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            return 'Page size must be a positive integer.', 400
+        repr_options['page_size'] = page_size
+        repr_options['page'] = request.args.get('page')
 
     try:
         rsrc = rsrc_api.get(uid, repr_options)
@@ -136,9 +151,14 @@ def get_resource(uid, force_rdf=False):
         return str(e), 404
     except TombstoneError as e:
         return _tombstone_response(e, uid)
+    except InvalidPageError as e:
+        return str(e), 400
     else:
         out_headers.update(_headers_from_metadata(rsrc))
         uri = g.tbox.uid_to_uri(uid)
+        if page_size is not None:
+            out_headers['Link'] = out_headers.get('Link', []) + _page_links(
+                    uri, page_size, rsrc.next_page)
         if (
                 isinstance(rsrc, LdpRs)
                 or is_accept_hdr_rdf_parsable()
@@ -591,6 +611,31 @@ def parse_repr_options(retr_opts):
     return imr_options
 
 
+def _page_links(uri, page_size, next_page=None):
+    '''
+    Create the LDP Paging link headers for a page of a resource.
+
+    See https://www.w3.org/TR/ldp-paging/
+
+    @param uri (string) URI of the paged resource.
+    @param page_size (int) Page size.
+    @param next_page (string | None) Token of the next page, if any.
+
+    @return list(string)
+    '''
+    first = '{}?{}'.format(uri, urlencode({'page_size': page_size}))
+    links = [
+        '{};rel="type"'.format(nsc['ldp'].Page.n3()),
+        '<{}>;rel="canonical"'.format(uri),
+        '<{}>;rel="first"'.format(first),
+    ]
+    if next_page:
+        links.append('<{}&{}>;rel="next"'.format(
+            first, urlencode({'page': next_page})))
+
+    return links
+
+
 def _headers_from_metadata(rsrc):
     '''
     Create a dict of headers from a metadata graph.
@@ -1,7 +1,9 @@
 import logging
 
 from flask import Blueprint, current_app, request, render_template, send_file
+from rdflib import BNode, Literal, URIRef
 from rdflib.plugin import PluginException
+from rdflib.util import from_n3
 
 from lakesuperior.env import env
 from lakesuperior.dictionaries.namespaces import ns_mgr as nsm
@@ -22,6 +24,17 @@ query = Blueprint('query', __name__)
 def term_search():
     '''
     Search by entering a search term and optional property and comparison term.
+
+    The term and property are in N3 notation, e.g. `dcterms:date` or
+    `"2018-01-01"^^xsd:date`, with the prefixes registered in the
+    repository. A term that is not valid N3 is searched as a plain literal.
+    `>` and `<`, and value comparisons of numbers and dates with `=` and
+    `<>`, require the range index of the store.
+
+    The `~` operator searches the words of the term, as plain text, in the
+    string literals of the property, or of any property if none is given.
+    Results are ranked by relevance. This requires the full-text index of the
+    store.
     '''
     valid_operands = (
         ('=', 'Equals'),
@@ -29,13 +42,39 @@ def term_search():
         ('<', 'Less Than'),
         ('<>', 'Not Equal'),
         ('a', 'RDF Type'),
+        ('~', 'Contains Words'),
     )
 
     term = request.args.get('term')
-    prop = request.args.get('prop', default=1)
+    prop = request.args.get('prop', default='')
     cmp = request.args.get('cmp', default='=')
+    limit = request.args.get('limit', default=50, type=int)
+    offset = request.args.get('offset', default=0, type=int)
+
+    uids = None
+    if term:
+        try:
+            pred = from_n3(prop, nsm=nsm) if prop else None
+            qterm = term if cmp == '~' else from_n3(term, nsm=nsm)
+        except (KeyError, ValueError) as e:
+            return 'Invalid term or property: {}'.format(e), 400
+        # `from_n3` takes unquoted strings for blank node IDs.
+        if isinstance(qterm, BNode):
+            qterm = Literal(term)
+        if pred is not None and not isinstance(pred, URIRef) or (
+                pred is None and cmp not in ('a', '~')):
+            return 'A property URI or prefixed name is required.', 400
+        try:
+            if cmp == '~':
+                uids = query_api.fulltext_query(qterm, pred, limit, offset)
+            else:
+                uids = query_api.term_query(pred, cmp, qterm, limit, offset)
+        except (RuntimeError, ValueError) as e:
+            return str(e), 400
 
-    return render_template('term_search.html')
+    return render_template(
+            'term_search.html', operands=valid_operands, term=term,
+            prop=prop, cmp=cmp, limit=limit, offset=offset, uids=uids)
 
 
 @query.route('/sparql', methods=['GET', 'POST'])
@@ -19,7 +19,36 @@ This is automated in non-test environments by importing
 `lakesuperior.env_setup`.
 '''
 class Env:
-    pass
+    '''
+    Environment container.
+
+    The attributes listed in `thread_local_attrs` hold values that are bound
+    to a single request, e.g. the timestamp of the current transaction. They
+    are kept separately for each thread (or greenlet, if gevent has patched
+    the `threading` module), so that concurrent requests served by the same
+    process do not overwrite each other's values. All other attributes are
+    shared by the whole process.
+    '''
+    thread_local_attrs = {'timestamp', 'timestamp_term'}
+
+    def __init__(self):
+        object.__setattr__(self, '_local', threading.local())
+
+    def __getattr__(self, name):
+        if name in self.thread_local_attrs:
+            return getattr(self._local, name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.thread_local_attrs:
+            setattr(self._local, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if name in self.thread_local_attrs:
+            delattr(self._local, name)
+        else:
+            object.__delattr__(self, name)
 
 env = Env()
-#env = threading.local()
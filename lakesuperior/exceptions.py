@@ -163,3 +163,18 @@ class TombstoneError(RuntimeError):
             'To resurrect this resource, send a POST request to its tombstone.'
             .format(self.uid, self.ts)
         )
+
+
+
+class InvalidPageError(RuntimeError):
+    '''
+    Raised when a page token does not correspond to a page of the requested
+    resource.
+
+    This usually surfaces at the HTTP level as a 400.
+    '''
+    def __init__(self, page):
+        self.page = page
+
+    def __str__(self):
+        return 'Invalid page token: {}'.format(self.page)
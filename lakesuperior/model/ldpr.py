@@ -144,6 +144,11 @@ class Ldpr(metaclass=ABCMeta):
         If the resource is not stored (yet), a `ResourceNotExistsError` is
         raised.
 
+        If the `page_size` IMR option is set, only one page of the children
+        is included: the first one, or the one whose token is given in the
+        `page` option. The token of the next page is then set in
+        `next_page`.
+
         @return rdflib.resource.Resource
         '''
         if not hasattr(self, '_imr'):
@@ -156,7 +161,19 @@ class Ldpr(metaclass=ABCMeta):
             else:
                 imr_options = {}
             options = dict(imr_options, strict=True)
-            self._imr = rdfly.extract_imr(self.uid, **options)
+            page_size = options.pop('page_size', None)
+            page = options.pop('page', None)
+            self.next_page = None
+            if page_size and options.get('incl_children', True):
+                options['incl_children'] = False
+                self._imr = rdfly.extract_imr(self.uid, **options)
+                trps, self.next_page = rdfly.get_struct_page(
+                        self.uid, page_size, page)
+                gr = self._imr.graph
+                for t in trps:
+                    gr.add(t)
+            else:
+                self._imr = rdfly.extract_imr(self.uid, **options)
 
         return self._imr
 
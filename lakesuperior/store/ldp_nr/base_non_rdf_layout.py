@@ -41,6 +41,15 @@ class BaseNonRdfLayout(metaclass=ABCMeta):
         pass
 
 
+    @abstractmethod
+    def snapshot(self, dest, progress=None):
+        '''
+        Copy all the stored files to another location while the store is in
+        use.
+        '''
+        pass
+
+
     @abstractmethod
     def local_path(self, uuid):
         '''
@@ -1,6 +1,7 @@
 import logging
 import os
 import shutil
+import time
 
 from hashlib import sha1
 from uuid import uuid4
@@ -87,6 +88,66 @@ class DefaultLayout(BaseNonRdfLayout):
         os.unlink(self.local_path(uuid))
 
 
+    def snapshot(self, dest, progress=None, batch_size=1000):
+        '''
+        See BaseNonRdfLayout.snapshot.
+
+        Files are never changed once stored, since their paths are derived
+        from their checksums, so they can be copied one by one while the
+        store is written to. A graph store snapshot taken before this runs
+        only references files that are included in the copy. Files already
+        in the destination are skipped, so an interrupted copy can be
+        resumed. Temporary files, and files deleted before they are copied,
+        are not copied.
+
+        @param dest (string) Destination directory.
+        @param progress (callable) Function called every `batch_size` files
+        and at the end with the number of files and bytes copied so far.
+        @param batch_size (int) Number of files between progress calls.
+
+        @return dict Number of `files` and `bytes` copied, and `time` taken
+        in seconds.
+        '''
+        start = time.perf_counter()
+        ct = size = 0
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(os.path.join(dest, 'tmp'), exist_ok=True)
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == tmp_dir:
+                dirnames[:] = []
+                continue
+            dest_dir = os.path.join(
+                    dest, os.path.relpath(dirpath, self.root))
+            os.makedirs(dest_dir, exist_ok=True)
+            for fname in filenames:
+                dst = os.path.join(dest_dir, fname)
+                if os.path.exists(dst):
+                    continue
+                # Copy to a temp file first, so that a partial copy is never
+                # taken for a complete one when resuming.
+                tmp_file = '{}/tmp/{}'.format(dest, uuid4())
+                try:
+                    shutil.copy2(os.path.join(dirpath, fname), tmp_file)
+                except FileNotFoundError:
+                    # The file was deleted after it was listed, e.g. because
+                    # the metadata of a new binary could not be stored.
+                    logger.info('File {} was deleted while being copied. '
+                            'Skipping.'.format(fname))
+                    if os.path.exists(tmp_file):
+                        os.unlink(tmp_file)
+                    continue
+                os.rename(tmp_file, dst)
+                ct += 1
+                size += os.path.getsize(dst)
+                if progress and ct % batch_size == 0:
+                    progress(ct, size)
+        if progress:
+            progress(ct, size)
+
+        return {'files': ct, 'bytes': size,
+                'time': time.perf_counter() - start}
+
+
     ## PROTECTED METHODS ##
 
     def local_path(self, uuid):
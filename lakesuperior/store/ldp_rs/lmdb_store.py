@@ -1,17 +1,32 @@
 import hashlib
+import heapq
 import logging
+import math
 import os
-
+import re
+import struct
+import threading
+import unicodedata
+import zlib
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import ContextDecorator, ExitStack
+from datetime import date, datetime, time, timezone
+from functools import partial
+from itertools import chain, groupby, islice
 from os import makedirs
-from os.path import exists, abspath
+from os.path import exists, abspath, getsize
 from shutil import rmtree
+from tempfile import TemporaryDirectory, mkstemp
+from time import perf_counter
 from urllib.request import pathname2url
 
 import lmdb
 
-from rdflib import Graph, Namespace, URIRef, Variable
+from rdflib import BNode, Graph, Literal, Namespace, URIRef, Variable
 from rdflib.graph import DATASET_DEFAULT_GRAPH_ID as RDFLIB_DEFAULT_GRAPH_URI
+from rdflib.namespace import XSD
 from rdflib.store import Store, VALID_STORE, NO_STORE
 
 
@@ -32,6 +47,161 @@ def b2s(u, enc='UTF-8'):
     return bytes(u).decode(enc)
 
 
+def _enc(s):
+    '''
+    Encode a term string, letting invalid surrogates through.
+    '''
+    return s.encode('UTF-8', 'surrogatepass')
+
+
+def _dec(b):
+    '''
+    Decode a term string encoded with `_enc`.
+    '''
+    return b.decode('UTF-8', 'surrogatepass')
+
+
+def _write_run(records, tmp_dir, framed=False):
+    '''
+    Write a sorted run of records to a temporary file.
+
+    @param records (list(bytes)) Sorted records.
+    @param tmp_dir (string) Directory to create the file in.
+    @param framed (bool) Whether each record is prefixed with its length,
+    so that records can have different lengths, up to 64Kb.
+
+    @return string File path.
+    '''
+    fd, fpath = mkstemp(dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as fh:
+        if framed:
+            for rec in records:
+                fh.write(len(rec).to_bytes(2, 'big'))
+                fh.write(rec)
+        else:
+            fh.writelines(records)
+
+    return fpath
+
+
+def _read_run(fpath, rec_len=None):
+    '''
+    Read back the records written by `_write_run`.
+
+    @param fpath (string) File path.
+    @param rec_len (int | None) Length of each record, or None if the records
+    were written with a length prefix.
+    '''
+    with open(fpath, 'rb', buffering=1024 ** 2) as fh:
+        if rec_len is None:
+            pfx = fh.read(2)
+            while pfx:
+                yield fh.read(int.from_bytes(pfx, 'big'))
+                pfx = fh.read(2)
+            return
+
+        rec = fh.read(rec_len)
+        while rec:
+            yield rec
+            rec = fh.read(rec_len)
+
+
+'''
+Datatypes of the literals that can be compared by value, grouped by value
+type. Literals of different groups are never compared.
+'''
+NUMERIC_TYPES = {
+    XSD.byte, XSD.decimal, XSD.double, XSD.float, XSD.int, XSD.integer,
+    XSD.long, XSD.negativeInteger, XSD.nonNegativeInteger,
+    XSD.nonPositiveInteger, XSD.positiveInteger, XSD.short,
+    XSD.unsignedByte, XSD.unsignedInt, XSD.unsignedLong, XSD.unsignedShort,
+}
+TEMPORAL_TYPES = {XSD.date, XSD.dateTime}
+
+
+def sortable_value(term):
+    '''
+    Encode the value of a numeric or temporal literal so that the encoded
+    values of each value type sort in the same order as the values.
+
+    The encoding is a one-byte value type tag (`\\x01` for numbers, `\\x02`
+    for dates and timestamps) followed by the value as a 8-byte IEEE 754
+    double with the sign bit flipped, and all the other bits also flipped if
+    the value is negative. Timestamps are converted to seconds since the
+    epoch; dates and timestamps without a time zone are taken as UTC.
+
+    Values are only as precise as a double, e.g. integers above 2^53 that
+    differ by less than their precision have the same encoding.
+
+    @param term (rdflib.term.Identifier) Term to encode.
+
+    @return bytes | None 9 bytes, or None if the term is not a literal of one
+    of `NUMERIC_TYPES` or `TEMPORAL_TYPES`, or its lexical value is not
+    valid for its datatype.
+    '''
+    if not isinstance(term, Literal) or term.datatype is None:
+        return None
+    val = term.value
+    try:
+        if term.datatype in NUMERIC_TYPES:
+            tag = b'\x01'
+            if isinstance(val, bool) or val is None:
+                return None
+            num = float(val)
+        elif term.datatype in TEMPORAL_TYPES:
+            tag = b'\x02'
+            if not isinstance(val, datetime):
+                if not isinstance(val, date):
+                    return None
+                val = datetime.combine(val, time())
+            if val.tzinfo is None:
+                val = val.replace(tzinfo=timezone.utc)
+            num = val.timestamp()
+        else:
+            return None
+    except (ArithmeticError, TypeError, ValueError):
+        return None
+    # Exclude NaN and fold -0.0 into 0.0.
+    if num != num:
+        return None
+    num += 0.0
+
+    data = struct.pack('>d', num)
+    if data[0] & 0x80:
+        data = bytes(b ^ 0xff for b in data)
+    else:
+        data = bytes((data[0] | 0x80,)) + data[1:]
+
+    return tag + data
+
+
+'''
+Maximum length in bytes of a token in the full-text index. Longer tokens are
+not indexed.
+'''
+MAX_TOKEN_LENGTH = 128
+
+_token_re = re.compile(r'\w+')
+
+
+def tokenize(text):
+    '''
+    Split a text into the tokens of the full-text index.
+
+    Tokens are sequences of letters, digits and underscores, normalized to
+    Unicode NFKC and case-folded.
+
+    @param text (str) Text to tokenize.
+
+    @return set(str)
+    '''
+    text = unicodedata.normalize('NFKC', text).casefold()
+
+    return {
+            tk for tk in _token_re.findall(text)
+            if len(s2b(tk)) <= MAX_TOKEN_LENGTH}
+
+
 class TxnManager(ContextDecorator):
     '''
     Handle ACID transactions with an LmdbStore.
@@ -43,6 +213,11 @@ class TxnManager(ContextDecorator):
     >>>
 
     The transaction will be opened and handled automatically.
+
+    Transactions are bound to the calling thread (or greenlet, if gevent has
+    patched the `threading` module). If a suitable transaction is already
+    open in the current thread, it is reused and left for the outer manager
+    to commit or roll back.
     '''
     def __init__(self, store, write=False):
         '''
@@ -54,13 +229,20 @@ class TxnManager(ContextDecorator):
         '''
         self.store = store
         self.write = write
+        self._nested = False
 
     def __enter__(self):
-        # Only open a R/W transaction if one is not already open.
-        if not self.write or not self.store.is_txn_rw:
+        # Reuse a transaction already open in this thread, unless a R/W
+        # transaction is requested and the open one is read-only.
+        if self.store.is_txn_open and (
+                self.store.is_txn_rw or not self.write):
+            self._nested = True
+        else:
             self.store.begin(write=self.write)
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self._nested:
+            return
         if exc_type:
             self.store.rollback()
         else:
@@ -86,6 +268,11 @@ class LexicalSequence:
         '''
         self.start = start
         self.length = max_len
+        self.base = 256 - start
+        # Byte strings for all the possible values of the last byte.
+        self._digits = [bytes((b,)) for b in range(start, 256)]
+        # Last prefix built by `range()`, as a (position, bytes) tuple.
+        self._prefix = (None, None)
 
 
     def first(self):
@@ -135,6 +322,472 @@ class LexicalSequence:
                 return bytes(n)
 
 
+    def to_int(self, n):
+        '''
+        Position of a byte sequence in the sequence. The position of
+        `first()` is 0.
+
+        @param n (bytes | memoryview) Byte sequence.
+
+        @return int
+        '''
+        pos = 0
+        for b in n:
+            pos = pos * self.base + b - self.start
+
+        return pos
+
+
+    def from_int(self, pos, length=None):
+        '''
+        Byte sequence at a position of the sequence.
+
+        @param pos (int) Position.
+        @param length (int) Length of the sequence. If None, `max_len` is
+        used.
+
+        @return bytes
+        '''
+        if length is None:
+            length = self.length
+        n = bytearray(length)
+        for i in range(length - 1, -1, -1):
+            pos, digit = divmod(pos, self.base)
+            n[i] = digit + self.start
+        if pos:
+            raise RuntimeError('BAD DAY: Sequence exhausted. No more '
+                    'combinations are possible.')
+
+        return bytes(n)
+
+
+    def range(self, start, count):
+        '''
+        Consecutive byte sequences.
+
+        Sequences are built in runs that share all but the last byte, so
+        that only one byte string is created for each sequence.
+
+        @param start (int) Position of the first sequence.
+        @param count (int) Number of sequences.
+
+        @return list(bytes)
+        '''
+        end = start + count
+        if end > self.base ** self.length:
+            raise RuntimeError('BAD DAY: Sequence exhausted. No more '
+                    'combinations are possible.')
+        seqs = []
+        while start < end:
+            prefix_pos, first = divmod(start, self.base)
+            last = min(self.base, first + end - start)
+            cached_pos, prefix = self._prefix
+            if cached_pos != prefix_pos:
+                prefix = self.from_int(prefix_pos, self.length - 1)
+                self._prefix = (prefix_pos, prefix)
+            seqs.extend([prefix + d for d in self._digits[first:last]])
+            start += last - first
+
+        return seqs
+
+
+
+class TermCache:
+    '''
+    Bounded, transaction-aware LRU cache.
+
+    Entries cached while a read/write transaction is open are kept in a
+    separate overlay which is merged into the main cache when the transaction
+    is committed and discarded when it is rolled back. This way, a key
+    allocated by a transaction that is eventually rolled back never outlives
+    that transaction.
+
+    The least recently used entries are evicted when the cache grows beyond
+    its maximum size.
+
+    The cache is shared by all threads, while pending entries belong to the
+    thread whose transaction they depend on.
+
+    The cache has an epoch, which is changed when the cache is cleared
+    because the cached data were invalidated. Entries read from data of an
+    earlier epoch are not added.
+
+    Hits and misses are counted for statistical purposes.
+    '''
+    def __init__(self, max_size=1024):
+        '''
+        @param max_size (int) Maximum number of entries. 0 disables the cache.
+        '''
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    @property
+    def _pending(self):
+        '''
+        Pending entries of the current thread.
+        '''
+        try:
+            return self._local.pending
+        except AttributeError:
+            self._local.pending = {}
+            return self._local.pending
+
+
+    def get(self, k):
+        '''
+        Get a cached value.
+
+        @param k (Object) Key to look up. It must be hashable.
+
+        @return Object | None Cached value, or None if the key is not cached.
+        '''
+        with self._lock:
+            v = self._data.get(k)
+            if v is None:
+                v = self._pending.get(k)
+            else:
+                self._data.move_to_end(k)
+            if v is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return v
+
+
+    def put(self, k, v, pending=False, epoch=None):
+        '''
+        Add an entry to the cache.
+
+        @param k (Object) Hashable key.
+        @param v (Object) Value.
+        @param pending (bool) Whether the entry depends on an uncommitted
+        transaction. If True, the entry is only merged into the cache on
+        `commit()`.
+        @param epoch (int) Epoch of the data that the value was read from. If
+        this is not the current epoch of the cache, the entry is discarded.
+        If None, the entry is always added.
+        '''
+        if not self.max_size:
+            return
+        if pending:
+            self._pending[k] = v
+        else:
+            with self._lock:
+                if epoch is None or epoch == self.epoch:
+                    self._put(k, v)
+
+
+    def _put(self, k, v):
+        '''
+        Add an entry to the cache. The caller must hold the lock.
+        '''
+        self._data[k] = v
+        self._data.move_to_end(k)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+    def commit(self):
+        '''
+        Merge the pending entries of the current thread into the cache.
+        '''
+        pending, self._local.pending = self._pending, {}
+        if pending and self.max_size:
+            with self._lock:
+                for k, v in pending.items():
+                    self._put(k, v)
+
+
+    def rollback(self):
+        '''
+        Discard the pending entries of the current thread.
+        '''
+        self._local.pending = {}
+
+
+    def clear(self, epoch=0):
+        '''
+        Empty the cache and the pending entries of the current thread.
+
+        @param epoch (int) New epoch of the cache.
+        '''
+        with self._lock:
+            self._data.clear()
+            self.epoch = epoch
+        self._local.pending = {}
+
+
+    def stats(self):
+        '''
+        Cache statistics.
+
+        @return dict
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'max_size': self.max_size,
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0,
+        }
+
+
+
+class TermSerializer:
+    '''
+    Compact binary serialization of RDF terms.
+
+    A serialized term starts with a one-byte type tag followed by a UTF-8
+    payload:
+
+    - URI: the full URI.
+    - Compressed URI: a 2-byte namespace ID followed by the local name.
+    - BNode: the node ID.
+    - Plain literal: the lexical value.
+    - Language-tagged literal: 1 byte for the length of the language tag, the
+      language tag and the lexical value.
+    - Typed literal: 2 bytes for the length of the serialized datatype URI,
+      the datatype URI (serialized as a URI, therefore also compressed), and
+      the lexical value.
+
+    Anything else is pickled.
+
+    The store replaces large serialized terms with a stub made of the
+    `LARGE` tag and the type tag of the term, and keeps the term elsewhere
+    (see `LmdbStore.LARGE_TERM_SIZE`). Stubs cannot be deserialized.
+
+    Namespaces are looked up in a table of ID: namespace associations which
+    is managed by the store. The same term serialized without namespace
+    compression is its canonical form, which does not change as new
+    namespaces are registered. The canonical form is used to calculate term
+    hashes.
+    '''
+    URI = 1
+    NS_URI = 2
+    BNODE = 3
+    LITERAL = 4
+    LANG_LITERAL = 5
+    DT_LITERAL = 6
+    LARGE = 7
+    PICKLE = 255
+
+    '''Maximum number of namespaces that can be registered.'''
+    MAX_NS = 2 ** 16
+
+    def __init__(self, pickler):
+        '''
+        @param pickler (rdflib.store.NodePickler) Pickler used for terms
+        that have no dedicated serialization.
+        '''
+        self._pickler = pickler
+        self.ns_by_id = {}
+        # Longest namespaces first, so that the most specific one matches.
+        self._ns_list = []
+
+
+    def load_namespaces(self, ns_ids):
+        '''
+        Replace the namespace table.
+
+        @param ns_ids (iterable) Pairs of (int, str) namespace IDs and
+        namespace URIs.
+        '''
+        self.ns_by_id = dict(ns_ids)
+        self._ns_list = sorted(
+                ((ns, nsid) for nsid, ns in self.ns_by_id.items()),
+                key=lambda x: len(x[0]), reverse=True)
+
+
+    def add_namespace(self, nsid, ns):
+        '''
+        Add a namespace to the table.
+
+        @param nsid (int) Namespace ID.
+        @param ns (str) Namespace URI.
+        '''
+        self.ns_by_id[nsid] = ns
+        self.load_namespaces(self.ns_by_id.items())
+
+
+    def dumps(self, term, compress=True):
+        '''
+        Serialize a term.
+
+        @param term (rdflib.term.Identifier) Term to serialize.
+        @param compress (bool) Whether to compress URIs with the registered
+        namespaces. If False, the canonical form is returned.
+
+        @return bytes
+        '''
+        if isinstance(term, URIRef):
+            if compress:
+                for ns, nsid in self._ns_list:
+                    if term.startswith(ns) and len(term) > len(ns):
+                        return (
+                            bytes((self.NS_URI,)) + nsid.to_bytes(2, 'big')
+                            + _enc(term[len(ns):]))
+            return bytes((self.URI,)) + _enc(term)
+
+        if isinstance(term, Literal):
+            if term.language and not term.datatype:
+                lang = _enc(term.language)
+                if len(lang) < 256:
+                    return (
+                        bytes((self.LANG_LITERAL, len(lang)))
+                        + lang + _enc(term))
+            elif term.datatype and not term.language:
+                dt = self.dumps(term.datatype, compress)
+                if len(dt) < 2 ** 16:
+                    return (
+                        bytes((self.DT_LITERAL,)) + len(dt).to_bytes(2, 'big')
+                        + dt + _enc(term))
+            elif not term.language and not term.datatype:
+                return bytes((self.LITERAL,)) + _enc(term)
+
+        elif isinstance(term, BNode):
+            return bytes((self.BNODE,)) + _enc(term)
+
+        return bytes((self.PICKLE,)) + self._pickler.dumps(term)
+
+
+    def loads(self, data):
+        '''
+        Deserialize a term.
+
+        @param data (bytes | memoryview) Serialized term.
+
+        @return rdflib.term.Identifier
+
+        @raise KeyError if the term references an unknown namespace ID.
+        '''
+        data = bytes(data)
+        tag = data[0]
+        if tag == self.URI:
+            return URIRef(_dec(data[1:]))
+        if tag == self.NS_URI:
+            return URIRef(
+                    self.ns_by_id[int.from_bytes(data[1:3], 'big')]
+                    + _dec(data[3:]))
+        if tag == self.LITERAL:
+            return Literal(_dec(data[1:]))
+        if tag == self.LANG_LITERAL:
+            llen = data[1] + 2
+            return Literal(_dec(data[llen:]), lang=_dec(data[2:llen]))
+        if tag == self.DT_LITERAL:
+            dlen = int.from_bytes(data[1:3], 'big') + 3
+            return Literal(
+                    _dec(data[dlen:]), datatype=self.loads(data[3:dlen]))
+        if tag == self.BNODE:
+            return BNode(_dec(data[1:]))
+        if tag == self.PICKLE:
+            return self._pickler.loads(data[1:])
+        raise ValueError('Unknown term type tag: {}'.format(tag))
+
+
+    def canonical(self, term):
+        '''
+        Canonical serialization of a term, used for hashing.
+
+        @param term (rdflib.term.Identifier) Term to serialize.
+
+        @return bytes
+        '''
+        return self.dumps(term, compress=False)
+
+
+    def expand(self, data):
+        '''
+        Convert a serialized term to its canonical form.
+
+        This is equivalent to `canonical(loads(data))` but only terms that
+        are pickled are deserialized.
+
+        @param data (bytes | memoryview) Serialized term.
+
+        @return bytes
+
+        @raise KeyError if the term references an unknown namespace ID.
+        '''
+        data = bytes(data)
+        tag = data[0]
+        if tag == self.NS_URI:
+            return (
+                bytes((self.URI,))
+                + _enc(self.ns_by_id[int.from_bytes(data[1:3], 'big')])
+                + data[3:])
+        if tag == self.DT_LITERAL:
+            dlen = int.from_bytes(data[1:3], 'big') + 3
+            dt = self.expand(data[3:dlen])
+            if len(dt) < 2 ** 16:
+                return (
+                    bytes((self.DT_LITERAL,)) + len(dt).to_bytes(2, 'big')
+                    + dt + data[dlen:])
+        elif tag != self.PICKLE:
+            return data
+
+        return self.canonical(self.loads(data))
+
+
+
+class TripleContexts:
+    '''
+    Contexts of a triple returned by `LmdbStore.triples()`.
+
+    The contexts are only looked up when the object is iterated, and only
+    turned into `Graph` instances by iterating it; most callers, such as
+    `Graph.triples()`, discard them altogether. The object can be iterated
+    more than once, as long as the transaction that returned it is open.
+    '''
+    __slots__ = ('_store', '_spok', '_uris')
+
+    def __init__(self, store, spok=None, uris=None):
+        '''
+        @param store (LmdbStore) Store that the triple was read from.
+        @param spok (bytes) Triple key. The contexts are looked up in the
+        store by this key.
+        @param uris (tuple(rdflib.URIRef)) Context URIs, if already known.
+        In this case `spok` is ignored.
+        '''
+        self._store = store
+        self._spok = spok
+        self._uris = uris
+
+
+    def __iter__(self):
+        return (self._store._ctx_graph(uri) for uri in self.uris())
+
+
+    def uris(self):
+        '''
+        Context URIs, without creating any `Graph`.
+
+        @return tuple(rdflib.URIRef)
+        '''
+        if self._uris is None:
+            store = self._store
+            with store.cur('spo:c') as cur:
+                if cur.set_key(self._spok):
+                    self._uris = tuple(
+                        store._from_key(ck)[0]
+                        for ck in cur.iternext_dup())
+                else:
+                    self._uris = ()
+
+        return self._uris
+
+
 
 class LmdbStore(Store):
     '''
@@ -148,14 +801,24 @@ class LmdbStore(Store):
 
     This store class uses two LMDB environments (i.e. two files): one for the
     main (preservation-worthy) data and the other for the index data which
-    can be rebuilt from the main database.
+    can be rebuilt from the main database (see `rebuild_indices()`).
 
-    There are 4 main data sets (preservation worthy data):
+    There are 7 main data sets (preservation worthy data):
 
     - t:st (term key: serialized term; 1:1)
+    - t:zst (term key: compressed serialized term, for large terms; 1:1)
     - spo:c (joined S, P, O keys: context key; dupsort, dupfixed)
     - c: (context keys only, values are the empty bytestring; 1:1)
     - pfx:ns (prefix: pickled namespace; 1:1)
+    - ni:ns (namespace ID: namespace, used to compress URIs in t:st; 1:1)
+    - md:data (metadata key: value; 1:1)
+
+    Terms are serialized with `TermSerializer`. Stores created before the
+    compact serialization was introduced use pickled terms until they are
+    converted with `migrate_term_format()`. In the compact format, terms
+    larger than `large_term_size` are compressed and stored in `t:zst`, and
+    `t:st` only holds a stub for them, so that they do not fill up the pages
+    of `t:st` that small terms are looked up in.
 
     And 6 indices to optimize lookup for all possible bound/unbound term
     combination in a triple:
@@ -166,6 +829,50 @@ class LmdbStore(Store):
     - o:sp (O key: joined S, P keys; dupsort, dupfixed)
     - c:spo (context → triple association; dupsort, dupfixed)
     - ns:pfx (pickled namespace: prefix; 1:1)
+
+    Plus a counter index to count triples without scanning them:
+
+    - cp:n (joined context, P keys: number of triples, 8-byte unsigned
+      big-endian integer; 1:1)
+
+    And a reverse reference index of the triples with a URI object, by
+    context, to look up the references to a resource. Contexts can be left
+    out of it with `ref_context_filter`:
+
+    - o:cps (O key: joined context, P, S keys; dupsort, dupfixed)
+
+    Optionally, 3 composite indices can be enabled to look up triples with
+    two bound terms directly, without scanning and filtering the values of a
+    single-term index:
+
+    - sp:o (joined S, P keys: O key; dupsort, dupfixed)
+    - po:s (joined P, O keys: S key; dupsort, dupfixed)
+    - so:p (joined S, O keys: P key; dupsort, dupfixed)
+
+    Another optional index orders the numeric and temporal literals of each
+    predicate by value, to look up value ranges:
+
+    - pv:so (joined P key and sortable value of the object, see
+      `sortable_value`: joined S, O keys; dupsort, dupfixed)
+
+    And an optional full-text index of the words in string literals (see
+    `tokenize`):
+
+    - tk:spo (token: joined S, P, O keys; dupsort, dupfixed)
+
+    If a `closure_predicate` is set, the transitive closure of that predicate
+    is kept in both directions, so that all the terms reachable from a term,
+    or leading to it, are read in a single range. The predicate must form a
+    tree, e.g. a containment hierarchy. Only the contexts accepted by
+    `ref_context_filter` are considered:
+
+    - a:d (ancestor key: descendant keys; dupsort, dupfixed)
+    - d:a (descendant key: ancestor keys; dupsort, dupfixed)
+
+    Finally, the index environment holds some information about the indices
+    themselves:
+
+    - md:idx (metadata key: value; 1:1)
     '''
 
     context_aware = True
@@ -181,11 +888,31 @@ class LmdbStore(Store):
     MAP_SIZE = 1024 ** 4 # 1Tb
 
     '''
-    Key hashing algorithm. If you are paranoid, use SHA1. Otherwise, MD5 is
-    faster and takes up less space (16 bytes vs. 20 bytes). This may make a
-    visible difference because keys are generated and parsed very often.
+    Term hashing algorithms. Values are hashlib constructors.
+
+    Terms are hashed on every add and lookup, so a fast algorithm may make a
+    visible difference. The 128-bit BLAKE2 variants are faster than SHA1 and
+    take up less space (16 bytes vs. 20 bytes). BLAKE2s is the fastest for
+    short strings such as most terms.
+    '''
+    HASH_ALGOS = {
+        'sha1': hashlib.sha1,
+        'md5': hashlib.md5,
+        'blake2b-128': partial(hashlib.blake2b, digest_size=16),
+        'blake2s-128': partial(hashlib.blake2s, digest_size=16),
+    }
+
+    '''
+    Default key hashing algorithm for new stores. The algorithm is recorded in
+    the store and cannot be changed without rebuilding the term index (see
+    `rehash_terms`).
+    '''
+    KEY_HASH_ALGO = 'blake2s-128'
+
+    '''
+    Algorithm of stores created before the algorithm was recorded.
     '''
-    KEY_HASH_ALGO = 'sha1'
+    LEGACY_HASH_ALGO = 'sha1'
 
     '''Separator byte. Used to join and split individual term keys.'''
     SEP_BYTE = b'\x00'
@@ -193,15 +920,53 @@ class LmdbStore(Store):
     KEY_LENGTH = 5 # Max key length for terms. That allows for A LOT of terms.
     KEY_START = 2 # \x00 is reserved as a separator. \x01 is spare.
 
+    '''
+    Term serialization formats. `compact` is used for new stores; `pickle` is
+    the legacy format.
+    '''
+    TERM_FORMAT_COMPACT = 'compact'
+    TERM_FORMAT_PICKLE = 'pickle'
+
+    '''
+    Default maximum number of term-to-key mappings kept in memory. Term keys
+    never change once committed, so the cache survives across transactions.
+    '''
+    KEY_CACHE_SIZE = 4096
+
+    '''
+    Default maximum number of decoded terms kept in memory, indexed by term
+    key.
+    '''
+    TERM_CACHE_SIZE = 16384
+
+    '''
+    Maximum number of context `Graph` instances kept in memory for the
+    results of `triples()` and `contexts()`.
+    '''
+    CTX_CACHE_SIZE = 1024
+
+    '''
+    Default size in bytes above which serialized terms are stored out of
+    line, compressed, in `t:zst`. Terms are then only decompressed when they
+    are decoded. 0 stores all terms in `t:st`.
+    '''
+    LARGE_TERM_SIZE = 2048
+
     data_keys = (
         # Term key to serialized term content: 1:1
         't:st',
+        # Term key to compressed large term: 1:1
+        't:zst',
         # Joined triple keys to context key: 1:m, fixed-length values
         'spo:c',
         # This has empty values and is used to keep track of empty contexts.
         'c:',
         # Prefix to namespace: 1:1
         'pfx:ns',
+        # Namespace ID to namespace, for URI compression: 1:1
+        'ni:ns',
+        # Data metadata: 1:1
+        'md:data',
     )
     idx_keys = (
         # Namespace to prefix: 1:1
@@ -210,15 +975,44 @@ class LmdbStore(Store):
         'th:t',
         # Lookups: 1:m, fixed-length values
         's:po', 'p:so', 'o:sp', 'c:spo',
+        # Number of triples by context and predicate: 1:1
+        'cp:n',
+        # URI object to context and referencing triple: 1:m, fixed-length
+        # values
+        'o:cps',
+        # Index metadata: 1:1
+        'md:idx',
     )
+    '''
+    Optional composite indices for two-bound lookups. 1:m, fixed-length
+    values.
+    '''
+    composite_idx_keys = ('sp:o', 'po:s', 'so:p')
+    '''
+    Optional index of literal values for range lookups. 1:m, fixed-length
+    values.
+    '''
+    range_idx_keys = ('pv:so',)
+    '''
+    Optional full-text index. 1:m, fixed-length values.
+    '''
+    fulltext_idx_keys = ('tk:spo',)
+    '''
+    Optional transitive closure index. 1:m, fixed-length values.
+    '''
+    closure_idx_keys = ('a:d', 'd:a')
 
     '''
-    Order in which keys are looked up if two terms are bound.
-    The indices with the smallest average number of values per key should be
-    looked up first.
+    Databases opened with the `dupsort` and `dupfixed` flags.
+    '''
+    _dupfixed_keys = {
+        'spo:c', 's:po', 'p:so', 'o:sp', 'c:spo', 'o:cps', 'sp:o', 'po:s',
+        'so:p', 'pv:so', 'tk:spo', 'a:d', 'd:a'}
 
-    If we want to get fancy, this can be rebalanced from time to time by
-    looking up the number of keys in (s:spo, p:spo, o:spo).
+    '''
+    Order in which keys are looked up if two terms are bound and have the
+    same number of entries in their indices. Otherwise, the term with fewer
+    entries is looked up (see `_lookup_2bound`).
     '''
     _lookup_rank = ('s', 'o', 'p')
 
@@ -229,45 +1023,171 @@ class LmdbStore(Store):
         's:po': (0, 1, 2),
         'p:so': (1, 0, 2),
         'o:sp': (2, 0, 1),
+        'sp:o': (0, 1, 2),
+        'po:s': (1, 2, 0),
+        'so:p': (0, 2, 1),
+    }
+
+    '''
+    Composite index used for each combination of two bound terms.
+    '''
+    _composite_lookup = {
+        ('s', 'p'): 'sp:o',
+        ('p', 'o'): 'po:s',
+        ('s', 'o'): 'so:p',
     }
 
+    '''
+    Whether composite indices are maintained by default.
+    '''
+    COMPOSITE_INDICES = False
 
-    data_env = None
-    idx_env = None
-    db = None
-    dbs = {}
-    data_txn = None
-    idx_txn = None
-    is_txn_rw = None
+    '''
+    Whether the range index is maintained by default.
+    '''
+    RANGE_INDEX = False
 
     '''
-    List of actions to be performed when a transaction is committed.
+    Whether the full-text index is maintained by default.
+    '''
+    FULLTEXT_INDEX = False
 
-    Each element is a tuple of (action name, database index, key, value).
     '''
-    _data_queue = []
+    Durability profiles. Each profile sets the flush options of the `main`
+    and `index` LMDB environments.
+
+    - `safe`: every commit is flushed to disk in both environments. Neither
+      an application crash nor a system crash or power loss can lose a
+      committed transaction or corrupt the databases.
+    - `fast-index`: the main environment is flushed on every commit, while
+      flushing the index environment is left to the operating system. An
+      application crash loses nothing. A system crash or power loss never
+      loses main data, but may lose the latest index updates or corrupt the
+      index file, which must then be rebuilt from the main data.
+    - `bulk-load`: neither environment is flushed on commit. An application
+      crash loses nothing. A system crash or power loss may lose all the
+      transactions since the last flush and corrupt both files. Only use
+      this for loads that can be started over, and switch back to another
+      profile, which flushes everything to disk, when done.
     '''
-    Set of indices to update. A set has been preferred to a list since the
-    index update don't need to be sequential and there may be duplicate entries
-    that can be eliminated.
+    DURABILITY_PROFILES = {
+        'safe': {
+            'main': {'sync': True, 'metasync': True},
+            'index': {'sync': True, 'metasync': True},
+        },
+        'fast-index': {
+            'main': {'sync': True, 'metasync': True},
+            'index': {'sync': False},
+        },
+        'bulk-load': {
+            'main': {'sync': False},
+            'index': {'sync': False},
+        },
+    }
 
-    Each element is a tuple of (triple key, pickled context, pre-pickled triple
-    ). The third value can be None, and in that case, it is calculated from
-    the triple key.
     '''
-    _idx_queue = []
+    Default durability profile.
+    '''
+    DURABILITY = 'safe'
+
+
+    data_env = None
+    idx_env = None
 
 
-    def __init__(self, path, identifier=None):
+    def __init__(
+            self, path, identifier=None, key_cache_size=None,
+            term_cache_size=None, composite_indices=None, hash_algo=None,
+            durability=None, range_index=None, fulltext_index=None,
+            large_term_size=None, ref_context_filter=None,
+            closure_predicate=None):
+        '''
+        @param path (string) Path of the folder containing the database(s).
+        @param identifier (rdflib.URIRef) Store identifier. If not provided,
+        it is derived from the path.
+        @param key_cache_size (int) Maximum number of entries in the
+        term-to-key cache. If None, `KEY_CACHE_SIZE` is used. 0 disables the
+        cache.
+        @param term_cache_size (int) Maximum number of entries in the
+        key-to-term cache. If None, `TERM_CACHE_SIZE` is used. 0 disables the
+        cache.
+        @param composite_indices (bool) Whether to maintain the composite
+        indices for two-bound lookups. If None, `COMPOSITE_INDICES` is used.
+        If this value changes for an existing store, the indices are built or
+        dropped when the store is opened.
+        @param hash_algo (string) Term hashing algorithm. One of the keys of
+        `HASH_ALGOS`. If None, new stores use `KEY_HASH_ALGO` and existing
+        stores use the algorithm they were created with. If this differs from
+        the algorithm of an existing store, the store is not opened.
+        @param durability (string) Durability profile. One of the keys of
+        `DURABILITY_PROFILES`. If None, `DURABILITY` is used.
+        @param range_index (bool) Whether to maintain the index of literal
+        values for range lookups. If None, `RANGE_INDEX` is used. If this
+        value changes for an existing store, the index is built or dropped
+        when the store is opened.
+        @param fulltext_index (bool) Whether to maintain the full-text index
+        of string literals. If None, `FULLTEXT_INDEX` is used. If this value
+        changes for an existing store, the index is built or dropped when the
+        store is opened.
+        @param large_term_size (int) Size in bytes above which new terms are
+        compressed and stored out of line. If None, `LARGE_TERM_SIZE` is
+        used. 0 disables. Terms already stored are not moved.
+        @param ref_context_filter (callable) Function that takes a context
+        URI and returns whether the references from that context are kept in
+        the `o:cps` index. If None, all contexts are indexed. If this changes
+        for an existing store, `o:cps` must be rebuilt.
+        @param closure_predicate (rdflib.URIRef) Predicate whose transitive
+        closure is kept in the `a:d` and `d:a` indices. If None, the closure
+        is not kept. For an existing store, the indices must be built with
+        `rebuild_indices` before they are used; see `closure_ready`.
+        '''
+        if hash_algo is not None and hash_algo not in self.HASH_ALGOS:
+            raise ValueError(
+                    'Hash algorithm `{}` is not supported.'.format(hash_algo))
+        durability = durability or self.DURABILITY
+        if durability not in self.DURABILITY_PROFILES:
+            raise ValueError(
+                    'Durability profile `{}` does not exist.'.format(
+                        durability))
+        self.durability = durability
         self.path = path
+        self.dbs = {}
+        # Transactions are bound to the thread that opens them.
+        self._local = threading.local()
+        # Held for the whole duration of a R/W transaction. LMDB allows only
+        # one writer at a time; waiting on this lock rather than on the LMDB
+        # mutex also lets other greenlets of the same thread run.
+        self._write_lock = threading.Lock()
+        self._hash_algo_conf = hash_algo
         self.__open = False
+        self.composite_indices = (
+                self.COMPOSITE_INDICES if composite_indices is None
+                else composite_indices)
+        self.range_index = (
+                self.RANGE_INDEX if range_index is None else range_index)
+        self.fulltext_index = (
+                self.FULLTEXT_INDEX if fulltext_index is None
+                else fulltext_index)
+        self.large_term_size = (
+                self.LARGE_TERM_SIZE if large_term_size is None
+                else large_term_size)
+        self.ref_context_filter = ref_context_filter
+        self.closure_predicate = closure_predicate
+
+        self._key_cache = TermCache(
+                self.KEY_CACHE_SIZE if key_cache_size is None
+                else key_cache_size)
+        self._term_cache = TermCache(
+                self.TERM_CACHE_SIZE if term_cache_size is None
+                else term_cache_size)
+        self._ctx_cache = TermCache(self.CTX_CACHE_SIZE)
+        self._ns_dirty = False
+        # Number of times each index was chosen for a two-bound lookup.
+        self._lookup_stats = {'s:po': 0, 'p:so': 0, 'o:sp': 0}
 
         self.identifier = identifier or URIRef(pathname2url(abspath(path)))
         super().__init__(path)
 
-        self._pickle = self.node_pickler.dumps
-        self._unpickle = self.node_pickler.loads
-
         self._key_seq = LexicalSequence(self.KEY_START, self.KEY_LENGTH)
 
 
@@ -281,22 +1201,482 @@ class LmdbStore(Store):
         context = self._normalize_context(context)
 
         if context is not None:
-            #dataset = self.triples((None, None, None), context)
-            with self.cur('c:spo') as cur:
-                if cur.set_key(self._to_key(context)):
-                    dataset = set(cur.iternext_dup())
-                    return len(dataset)
-                else:
-                    return 0
+            return self.count_context(context)
         else:
             return self.data_txn.stat(self.dbs['spo:c'])['entries']
 
 
+    def count_context(self, context, predicate=None):
+        '''
+        Count the triples in a context, optionally with a given predicate.
+
+        No triples are scanned: the number of triples in a context is kept
+        by LMDB for the `c:spo` index, and the number of triples for each
+        context and predicate is kept in the `cp:n` index.
+
+        @param context (rdflib.URIRef | rdflib.Graph) Context.
+        @param predicate (rdflib.URIRef) Predicate.
+
+        @return int
+        '''
+        context = self._normalize_context(context)
+        if predicate is None:
+            ck = self._to_key(context)
+            if ck is None:
+                return 0
+            with self.cur('c:spo') as cur:
+                return cur.count() if cur.set_key(ck) else 0
+
+        cpk = self._to_key((context, predicate))
+        if cpk is None:
+            return 0
+        ct = self.idx_txn.get(cpk, db=self.dbs['cp:n'])
+
+        return int.from_bytes(ct, 'big') if ct else 0
+
+
+    ## KEY-LEVEL API ##
+
+    # The following methods work on term keys rather than on RDFLib terms, so
+    # that intermediate results of a query need not be deserialized. Term keys
+    # are only valid within the store that issued them and may be reassigned
+    # after the terms are purged; they should not be kept across transactions.
+
+    def to_key(self, obj):
+        '''
+        Convert a term, or a tuple of terms, into a key.
+
+        @param obj (rdflib.term.Identifier | tuple) Term or terms.
+
+        @return bytes | None Key, or None if any of the terms is not in the
+        store.
+        '''
+        return self._to_key(obj)
+
+
+    def from_key(self, key):
+        '''
+        Convert a key into a tuple of terms.
+
+        @param key (bytes) Term key, or several keys joined by `SEP_BYTE`,
+        e.g. a triple key.
+
+        @return tuple(rdflib.term.Identifier)
+        '''
+        return self._from_key(key)
+
+
+    def from_triple_keys(self, keys):
+        '''
+        Generator over the triples of a sequence of triple keys.
+
+        This is meant to decode many triples at once, e.g. a whole context.
+        Each distinct term is decoded only once per call, and terms that
+        repeat across triples, such as the subject and predicates of a
+        resource, are not looked up in the shared term cache again.
+
+        @param keys (iterable(bytes)) Triple keys, e.g. from `triple_keys`.
+
+        @return generator(tuple(rdflib.term.Identifier))
+        '''
+        kl = self.KEY_LENGTH
+        p_start = kl + 1
+        o_start = 2 * kl + 2
+        terms = {}
+        cache = self._term_cache
+        cur = None
+        try:
+            for spok in keys:
+                spok = bytes(spok)
+                triple = []
+                for k in (
+                        spok[:kl], spok[p_start:p_start + kl],
+                        spok[o_start:]):
+                    term = terms.get(k)
+                    if term is None:
+                        term = cache.get(k)
+                        if term is None:
+                            if cur is None:
+                                cur = self.cur('t:st')
+                            term = self._load_term(
+                                    self._term_data(k, cur.get(k)))
+                            cache.put(k, term, pending=bool(self.is_txn_rw))
+                        terms[k] = term
+                    triple.append(term)
+                yield tuple(triple)
+        finally:
+            if cur is not None:
+                cur.close()
+
+
+    def to_key_pattern(self, triple_pattern):
+        '''
+        Convert a triple pattern into a pattern of keys.
+
+        @param triple_pattern (tuple) 3 RDFLib terms, or None for unbound
+        terms.
+
+        @return list(bytes | None) | None Term keys, or None for unbound
+        terms. If any of the bound terms is not in the store, None is
+        returned, since no triple can match the pattern.
+        '''
+        key_pattern = []
+        for term in triple_pattern:
+            if term is None:
+                key_pattern.append(None)
+            else:
+                k = self._to_key(term)
+                if not k:
+                    return None
+                key_pattern.append(k)
+
+        return key_pattern
+
+
+    def triple_keys(self, key_pattern, ck=None):
+        '''
+        Generator over the keys of the triples matching a pattern of keys.
+
+        @param key_pattern (tuple) Three term keys, or None for unbound
+        terms.
+        @param ck (bytes | None) Context key. If None, all contexts are
+        searched.
+
+        @return generator(bytes) Triple keys. The subject, predicate and object
+        keys can be obtained by splitting them by `SEP_BYTE`.
+        '''
+        if ck is None:
+            yield from self._lookup(key_pattern)
+            return
+
+        with self.cur('c:spo') as cur:
+            if not cur.set_key(ck):
+                return
+            # s p o c
+            if all(key_pattern):
+                spok = self.SEP_BYTE.join(key_pattern)
+                if cur.set_key_dup(ck, spok):
+                    yield spok
+            # ? ? ? c
+            elif not any(key_pattern):
+                yield from cur.iternext_dup()
+            # Regular lookup.
+            else:
+                yield from (
+                        spok for spok in self._lookup(key_pattern)
+                        if cur.set_key_dup(ck, spok))
+
+
+    def context_triple_keys(self, ck, start=None):
+        '''
+        Generator over the keys of the triples of a context, in key order.
+
+        The keys are read from the `c:spo` index, which keeps the triples of
+        each context sorted, so a range of them can be read by resuming from
+        the last key of a previous range, without scanning the keys before
+        it.
+
+        @param ck (bytes) Context key.
+        @param start (bytes | None) Triple key to start after. If None, the
+        keys are read from the first one.
+
+        @return generator(bytes) Triple keys.
+        '''
+        with self.cur('c:spo') as cur:
+            if start is None:
+                found = cur.set_key(ck)
+            else:
+                found = cur.set_range_dup(ck, start)
+                if found and cur.value() == start:
+                    found = cur.next_dup()
+            if found:
+                yield from cur.iternext_dup()
+
+
+    def ref_keys(self, ok):
+        '''
+        Generator over the triples that reference a URI, with their contexts.
+
+        This is a single range read of the `o:cps` index, which holds an
+        entry for each context of each triple with a URI object, except for
+        the contexts excluded by `ref_context_filter`.
+
+        @param ok (bytes) Object key.
+
+        @return generator(tuple(bytes)) Context key and triple key pairs, in
+        context key order. A triple in several contexts is yielded once for
+        each of them.
+        '''
+        sep = self.SEP_BYTE
+        with self.cur('o:cps') as cur:
+            if cur.set_key(ok):
+                for cpsk in cur.iternext_dup():
+                    ck, pk, sk = cpsk.split(sep)
+                    yield ck, sep.join((sk, pk, ok))
+
+
+    def closure_keys(self, k):
+        '''
+        Generator over the keys of the terms reachable from a term through
+        the closure predicate, e.g. all the descendants of a resource.
+
+        This is a single range read of the `a:d` index.
+
+        @param k (bytes) Term key.
+
+        @return generator(bytes) Term keys, in key order.
+        '''
+        with self.cur('a:d') as cur:
+            if cur.set_key(k):
+                yield from cur.iternext_dup()
+
+
+    def count_closure(self, k):
+        '''
+        Number of terms reachable from a term through the closure predicate.
+
+        The count is kept by LMDB and no entries are scanned.
+
+        @param k (bytes) Term key.
+
+        @return int
+        '''
+        with self.cur('a:d') as cur:
+            return cur.count() if cur.set_key(k) else 0
+
+
+    def exists(self, key_pattern, ck=None):
+        '''
+        Whether any triple matches a pattern of keys.
+
+        @param key_pattern (tuple) Three term keys, or None for unbound
+        terms.
+        @param ck (bytes | None) Context key.
+
+        @return bool
+        '''
+        for spok in self.triple_keys(key_pattern, ck):
+            return True
+
+        return False
+
+
+    def count(self, key_pattern, ck=None):
+        '''
+        Count the triples matching a pattern of keys.
+
+        Patterns with one bound term and no context, and patterns with no
+        bound terms, are counted without scanning the matches.
+
+        @param key_pattern (tuple) Three term keys, or None for unbound
+        terms.
+        @param ck (bytes | None) Context key.
+
+        @return int
+        '''
+        bound = [
+                (label, k) for label, k in zip('spo', key_pattern)
+                if k is not None]
+        if not bound:
+            if ck is None:
+                return self.data_txn.stat(self.dbs['spo:c'])['entries']
+            with self.cur('c:spo') as cur:
+                return cur.count() if cur.set_key(ck) else 0
+        if len(bound) == 1 and ck is None:
+            label, k = bound[0]
+            with self.cur('{}:{}'.format(
+                    label, 'spo'.replace(label, ''))) as cur:
+                return cur.count() if cur.set_key(k) else 0
+
+        return sum(1 for _ in self.triple_keys(key_pattern, ck))
+
+
+    def intersect(self, keys, key_pattern, pos, ck=None):
+        '''
+        Filter term keys by their occurrence in triples matching a pattern.
+
+        Each key is set in the unbound position `pos` of the pattern and is
+        kept if any triple matches the resulting pattern. This is efficient
+        when the keys are fewer than the triples matching the pattern.
+
+        @param keys (iterable(bytes)) Term keys to filter.
+        @param key_pattern (tuple) Three term keys, or None for unbound
+        terms. The term at `pos` is ignored.
+        @param pos (int) Position of the keys in the pattern: 0 for
+        subject, 1 for predicate, 2 for object.
+        @param ck (bytes | None) Context key.
+
+        @return generator(bytes) Keys found in the matching triples, in the
+        order they were given.
+        '''
+        pattern = list(key_pattern)
+        for k in keys:
+            pattern[pos] = k
+            if self.exists(pattern, ck):
+                yield k
+
+
+    def range_triple_keys(
+            self, pk, start=None, end=None, incl_start=True, incl_end=True):
+        '''
+        Generator over the keys of the triples with a predicate and an object
+        value within a range.
+
+        This reads the `pv:so` index, which must be enabled. Only the
+        literals with a datatype in `NUMERIC_TYPES` or `TEMPORAL_TYPES` are
+        indexed; values of different value types are not compared, e.g. a
+        numeric range never matches dates. Values are compared with the
+        precision of `sortable_value`.
+
+        @param pk (bytes) Predicate key.
+        @param start (rdflib.Literal | None) Lower bound. If None, the range
+        has no lower bound.
+        @param end (rdflib.Literal | None) Upper bound. If None, the range
+        has no upper bound.
+        @param incl_start (bool) Whether the lower bound is included.
+        @param incl_end (bool) Whether the upper bound is included.
+
+        @return generator(bytes) Triple keys in order of object value.
+
+        @raise RuntimeError If the range index is not enabled.
+        @raise ValueError If no bound is given, a bound cannot be compared
+        by value, or the bounds are of different value types.
+        '''
+        if not self.range_index:
+            raise RuntimeError('The range index is not enabled.')
+        bounds = []
+        for bound in (start, end):
+            if bound is None:
+                bounds.append(None)
+                continue
+            val = sortable_value(bound)
+            if val is None:
+                raise ValueError(
+                        'Term {} cannot be compared by value.'.format(bound))
+            bounds.append(val)
+        tags = {val[:1] for val in bounds if val}
+        if not tags:
+            raise ValueError('At least one range bound is required.')
+        if len(tags) > 1:
+            raise ValueError('Range bounds are of different value types.')
+
+        sep = self.SEP_BYTE
+        prefix = pk + sep + tags.pop()
+        lower = pk + sep + bounds[0] if bounds[0] else prefix
+        upper = pk + sep + bounds[1] if bounds[1] else None
+        with self.cur('pv:so') as cur:
+            if not cur.set_range(lower):
+                return
+            if bounds[0] and not incl_start and cur.key() == lower:
+                if not cur.next_nodup():
+                    return
+            for k, sok in cur.iternext():
+                if not k.startswith(prefix) or upper is not None and (
+                        k > upper or k == upper and not incl_end):
+                    break
+                sk, ok = sok.split(sep)
+                yield sep.join((sk, pk, ok))
+
+
+    def fulltext_search(self, text, pk=None):
+        '''
+        Rank the subjects of the string literals containing the words of a
+        text.
+
+        This reads the `tk:spo` index, which must be enabled. Each subject
+        scores the sum of the weights of the distinct words of the text found
+        in its literals. Words are weighted by their inverse frequency in the
+        index, so that rare words count more than common ones.
+
+        @param text (str) Search text. It is split into words with
+        `tokenize`.
+        @param pk (bytes | None) Predicate key. If given, only the literals
+        of this predicate are searched.
+
+        @return list(tuple(bytes, float)) Subject keys and scores, highest
+        score first. Subjects with the same score are ordered by key.
+
+        @raise RuntimeError If the full-text index is not enabled.
+        '''
+        if not self.fulltext_index:
+            raise RuntimeError('The full-text index is not enabled.')
+        sep = self.SEP_BYTE
+        total = self.idx_txn.stat(self.dbs['tk:spo'])['entries']
+        scores = {}
+        with self.cur('tk:spo') as cur:
+            for tk in tokenize(text):
+                if not cur.set_key(s2b(tk)):
+                    continue
+                weight = math.log(1 + total / cur.count())
+                matches = set()
+                for spok in cur.iternext_dup():
+                    sk, tpk, ok = spok.split(sep)
+                    if pk is None or tpk == pk:
+                        matches.add(sk)
+                for sk in matches:
+                    scores[sk] = scores.get(sk, 0) + weight
+
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+
     @property
     def is_open(self):
         return self.__open
 
 
+    @property
+    def data_txn(self):
+        '''
+        Main data transaction of the current thread.
+        '''
+        return getattr(self._local, 'data_txn', None)
+
+
+    @data_txn.setter
+    def data_txn(self, txn):
+        self._local.data_txn = txn
+
+
+    @property
+    def idx_txn(self):
+        '''
+        Index transaction of the current thread.
+        '''
+        return getattr(self._local, 'idx_txn', None)
+
+
+    @idx_txn.setter
+    def idx_txn(self, txn):
+        self._local.idx_txn = txn
+
+
+    @property
+    def is_txn_rw(self):
+        '''
+        Whether the transaction of the current thread is read/write. None if
+        no transaction is open.
+        '''
+        return getattr(self._local, 'is_txn_rw', None)
+
+
+    @is_txn_rw.setter
+    def is_txn_rw(self, rw):
+        self._local.is_txn_rw = rw
+
+
+    @property
+    def closure_ready(self):
+        '''
+        Whether the closure index is kept and complete. See `_init_closure`.
+
+        @return bool
+        '''
+        if self.closure_predicate is None:
+            return False
+        with self.idx_env.begin() as txn:
+            return txn.get(b'closure', db=self.dbs['md:idx']) == b'1'
+
+
     def open(self, configuration=None, create=True):
         '''
         Open the database.
@@ -312,6 +1692,9 @@ class LmdbStore(Store):
         self._init_db_environments(create)
         if self.data_env == NO_STORE:
             return NO_STORE
+        # Keys from a previous environment may not be valid anymore.
+        self._key_cache.clear()
+        self._term_cache.clear()
         self.__open = True
 
         return VALID_STORE
@@ -319,17 +1702,41 @@ class LmdbStore(Store):
 
     def begin(self, write=False):
         '''
-        Begin the main write transaction and create cursors.
+        Begin the main transaction of the current thread.
+
+        Only one R/W transaction can be open at a time. A thread beginning a
+        R/W transaction waits until any other thread has committed or rolled
+        back its own.
         '''
         if not self.is_open:
             raise RuntimeError('Store must be opened first.')
+        if write and self.is_txn_rw:
+            raise RuntimeError(
+                    'A read/write transaction is already open in this '
+                    'thread.')
         logger.debug('Beginning a {} transaction.'.format(
             'read/write' if write else 'read-only'))
 
-        self.data_txn = self.data_env.begin(buffers=True, write=write)
-        self.idx_txn = self.idx_env.begin(buffers=False, write=write)
+        if write:
+            self._write_lock.acquire()
+        try:
+            self.data_txn = self.data_env.begin(buffers=True, write=write)
+            self.idx_txn = self.idx_env.begin(buffers=False, write=write)
+        except:
+            if write:
+                self._write_lock.release()
+            raise
 
         self.is_txn_rw = write
+        # Position of the last term key, once looked up by a R/W transaction.
+        self._local.term_key_pos = None
+
+        # Orphan terms may have been purged since the last transaction,
+        # possibly by another process. Their keys must not be used anymore.
+        epoch = self.data_txn.get(b'gc_epoch', db=self.dbs['md:data'])
+        self._local.gc_epoch = int(bytes(epoch)) if epoch else 0
+        if self._local.gc_epoch > self._key_cache.epoch:
+            self._key_cache.clear(self._local.gc_epoch)
 
 
     def stats(self):
@@ -343,11 +1750,26 @@ class LmdbStore(Store):
 
             'idx_db_stats': {
                 db_label: self.idx_txn.stat(self.dbs[db_label])
-                for db_label in self.idx_keys},
+                for db_label in self.idx_keys + (
+                    self.composite_idx_keys if self.composite_indices
+                    else ()) + (
+                    self.range_idx_keys if self.range_index else ()) + (
+                    self.fulltext_idx_keys if self.fulltext_index else ()) + (
+                    self.closure_idx_keys if self.closure_predicate
+                    else ())},
 
             'data_db_size': os.stat(self.data_env.path()).st_size,
             'idx_db_size': os.stat(self.idx_env.path()).st_size,
             'num_triples': len(self),
+            'term_format': self.term_format,
+            'hash_algo': self.hash_algo,
+            'durability': self.durability,
+            'cache_stats': {
+                'key_cache': self._key_cache.stats(),
+                'term_cache': self._term_cache.stats(),
+                'ctx_cache': self._ctx_cache.stats(),
+            },
+            'lookup_stats': dict(self._lookup_stats),
         }
 
         return stats
@@ -373,14 +1795,12 @@ class LmdbStore(Store):
         '''
         Return a new cursor by its index.
         '''
-        if index in self.idx_keys:
-            txn = self.idx_txn
-            src = self.idx_keys
-        elif index in self.data_keys:
+        if index in self.data_keys:
             txn = self.data_txn
-            src = self.data_keys
+        elif index in self.dbs:
+            txn = self.idx_txn
         else:
-            return ValueError('Cursor key not found.')
+            raise ValueError('Cursor key not found.')
 
         return txn.cursor(self.dbs[index])
 
@@ -430,10 +1850,48 @@ class LmdbStore(Store):
             else:
                 self.rollback()
 
+        if self.durability != 'safe':
+            self.sync()
         self.data_env.close()
         self.idx_env.close()
 
 
+    def sync(self):
+        '''
+        Flush both environments to disk.
+
+        This is only needed with a durability profile other than `safe`.
+        '''
+        self.data_env.sync(True)
+        self.idx_env.sync(True)
+
+
+    def set_durability(self, profile):
+        '''
+        Switch to a different durability profile.
+
+        The environments are flushed to disk and reopened with the options of
+        the new profile. No transaction may be open in the current thread,
+        and no other thread may be using the store.
+
+        The profile only applies to the current process.
+
+        @param profile (string) One of the keys of `DURABILITY_PROFILES`.
+        '''
+        if profile not in self.DURABILITY_PROFILES:
+            raise ValueError(
+                    'Durability profile `{}` does not exist.'.format(profile))
+        if self.is_txn_open:
+            raise RuntimeError(
+                    'Cannot change durability with an open transaction.')
+
+        logger.info('Switching to the `{}` durability profile.'.format(
+            profile))
+        self.close()
+        self.durability = profile
+        self.open()
+
+
     def destroy(self, path):
         '''
         Destroy the store.
@@ -444,6 +1902,8 @@ class LmdbStore(Store):
         '''
         if exists(path):
             rmtree(path)
+        self._key_cache.clear()
+        self._term_cache.clear()
 
 
     def add(self, triple, context=None, quoted=False):
@@ -455,50 +1915,122 @@ class LmdbStore(Store):
         'None' inserts in the default graph.
         @param quoted (bool) Not used.
         '''
-        #import pdb; pdb.set_trace()
-        context = self._normalize_context(context)
-        if context is None:
-            context = RDFLIB_DEFAULT_GRAPH_URI
+        self.addN(((*triple, context),))
 
-        Store.add(self, triple, context)
 
-        #logger.info('Adding triple: {}'.format(triple))
-        pk_trp = self._pickle(triple)
+    def addN(self, quads):
+        '''
+        Add triples in bulk.
 
-        pk_s, pk_p, pk_o = [self._pickle(t) for t in triple]
-        #logger.debug('Adding quad: {} {}'.format(triple, context))
-        pk_c = self._pickle(context)
+        This overrides the `rdflib.Store.addN` method which calls `add` for
+        each quad. Here, the keys for all the terms in the batch are resolved
+        in one pass, all new terms are appended at once, and each database
+        and index is written to once with a single sorted `putmulti` call.
 
+        @param quads (iterable) Quads in the format of (s, p, o, c). `c` can
+        be a Graph, a context identifier or None, which inserts in the
+        default graph.
+        '''
+        # Normalize quads and gather distinct terms.
+        quad_list = []
+        terms = {}
+        cache_key = self._cache_key
+        for s, p, o, c in quads:
+            c = self._normalize_context(c)
+            if c is None:
+                c = RDFLIB_DEFAULT_GRAPH_URI
+            Store.add(self, (s, p, o), c)
+            quad = (s, p, o, c)
+            quad_k = tuple(map(cache_key, quad))
+            quad_list.append(quad_k)
+            for cache_k, term in zip(quad_k, quad):
+                if cache_k not in terms:
+                    terms[cache_k] = term
+        if not quad_list:
+            return
+
+        #logger.debug('Adding {} quads.'.format(len(quad_list)))
         # Add new individual terms or gather keys for existing ones.
-        keys = [None, None, None, None]
-        with self.cur('th:t') as icur:
-            for i, pk_t in enumerate((pk_s, pk_p, pk_o, pk_c)):
-                thash = self._hash(pk_t)
-                if icur.set_key(thash):
-                    keys[i] = icur.value()
-                else:
-                    # Put new term.
-                    with self.cur('t:st') as dcur:
-                        keys[i] = self._append(dcur, (pk_t,))[0]
-                    # Index.
-                    icur.put(thash, keys[i])
-
-        # Add context in context DB.
-        ck = keys[3]
+        keys = self._resolve_keys(terms)
+
+        # Triple:context associations.
+        ctx_keys = set()
+        spoc_data = set()
+        ref_spoc = set()
+        ref_ctx = {}
+        for s, p, o, c in quad_list:
+            spok = self.SEP_BYTE.join((keys[s], keys[p], keys[o]))
+            ctx_keys.add(keys[c])
+            spoc_data.add((spok, keys[c]))
+            if isinstance(terms[o], URIRef):
+                if c not in ref_ctx:
+                    ref_ctx[c] = self._is_ref_context(terms[c])
+                if ref_ctx[c]:
+                    ref_spoc.add((spok, keys[c]))
+
+        # Add contexts in context DB.
         with self.cur('c:') as cur:
-            if not cur.set_key(ck):
-                cur.put(ck, b'')
+            cur.putmulti(
+                    [(ck, b'') for ck in sorted(ctx_keys)], overwrite=False)
+        # Add triple:context associations. Only new associations are
+        # counted.
+        new_spoc = []
+        with self.cur('spo:c') as cur:
+            for spok, ck in sorted(spoc_data):
+                if cur.put(spok, ck, dupdata=False):
+                    new_spoc.append((spok, ck))
+        if not new_spoc:
+            return
+        # Index spo:c associations.
+        with self.cur('c:spo') as cur:
+            cur.putmulti(sorted((ck, spok) for spok, ck in new_spoc))
+        self._update_counts(new_spoc, 1)
+        self._update_refs(
+                (spoc for spoc in new_spoc if spoc in ref_spoc), True)
+        self._update_closure(
+                (spoc for spoc in new_spoc if spoc in ref_spoc), True)
+
+        self._index_triples({spok for spok, ck in new_spoc})
 
-        # Add triple:context association.
-        spok = self.SEP_BYTE.join(keys[:3])
-        with self.cur('spo:c') as dcur:
-            if not dcur.set_key_dup(spok, ck):
-                dcur.put(spok, ck)
-        # Index spo:c association.
-        with self.cur('c:spo') as icur:
-            icur.put(ck, spok)
 
-        self._index_triple('add', spok)
+    def _resolve_keys(self, terms):
+        '''
+        Get the keys for a set of terms, adding the terms not yet stored.
+
+        This must be called within a read/write transaction.
+
+        @param terms (dict) Terms indexed by their cache key (see
+        `_cache_key`).
+
+        @return dict Term keys indexed by the same cache keys as the input.
+        '''
+        keys = {}
+        new_terms = []
+        with self.cur('th:t') as icur:
+            for cache_k, term in terms.items():
+                tk = self._key_cache.get(cache_k)
+                if tk is None:
+                    thash = self._term_hash(term)
+                    tk = icur.get(thash)
+                    if tk is None:
+                        new_terms.append((cache_k, term, thash))
+                        continue
+                    self._key_cache.put(cache_k, tk, pending=True)
+                keys[cache_k] = tk
+
+            if new_terms:
+                # Put new terms.
+                new_keys = self._put_terms(
+                        [self._dump_term(nt[1]) for nt in new_terms])
+                # Index.
+                hashes = []
+                for (cache_k, term, thash), tk in zip(new_terms, new_keys):
+                    keys[cache_k] = tk
+                    hashes.append((thash, tk))
+                    self._key_cache.put(cache_k, tk, pending=True)
+                icur.putmulti(sorted(hashes))
+
+        return keys
 
 
     def remove(self, triple_pattern, context=None):
@@ -517,6 +2049,8 @@ class LmdbStore(Store):
         else:
             ck = None
 
+        # Deleted triple:context associations, to be uncounted.
+        del_spoc = []
         for spok in set(self._triple_keys(triple_pattern, context)):
             # Delete context association.
             with self.cur('spo:c') as dcur:
@@ -524,21 +2058,32 @@ class LmdbStore(Store):
                     if ck:
                         if dcur.set_key_dup(spok, ck):
                             dcur.delete()
+                            del_spoc.append((bytes(spok), ck))
                             if icur.set_key_dup(ck, spok):
                                 icur.delete()
                     else:
                         # If no context is specified, remove all associations.
                         if dcur.set_key(spok):
-                            for ck in dcur.iternext_dup():
+                            for trp_ck in dcur.iternext_dup():
+                                trp_ck = bytes(trp_ck)
+                                del_spoc.append((bytes(spok), trp_ck))
                                 # Delete index first while we have the
                                 # context reference.
-                                if icur.set_key_dup(ck, spok):
+                                if icur.set_key_dup(trp_ck, spok):
                                     icur.delete()
                             # Then delete the main entry.
                             dcur.set_key(spok)
                             dcur.delete(dupdata=True)
 
-            self._index_triple('remove', spok)
+                    # Only remove the lookups if the triple is not left in
+                    # any other context.
+                    if not dcur.set_key(spok):
+                        self._index_triple('remove', spok)
+
+        if del_spoc:
+            self._update_counts(del_spoc, -1)
+            self._update_refs(del_spoc, False)
+            self._update_closure(del_spoc, False)
 
 
     def triples(self, triple_pattern, context=None):
@@ -550,9 +2095,9 @@ class LmdbStore(Store):
 
         @return Generator over triples and contexts in which each result has
         the following format:
-        > (s, p, o), generator(contexts)
-        Where the contexts generator lists all context that the triple appears
-        in.
+        > (s, p, o), TripleContexts
+        Where the `TripleContexts` object lists all contexts that the triple
+        appears in. The contexts are only looked up if it is iterated.
         '''
         #logger.debug('Getting triples for pattern: {} and context: {}'.format(
         #    triple_pattern, context))
@@ -562,39 +2107,50 @@ class LmdbStore(Store):
         if context == RDFLIB_DEFAULT_GRAPH_URI:
             context = None
 
-        with self.cur('spo:c') as cur:
+        if context is not None:
+            # The same object is returned for all triples.
+            contexts = TripleContexts(self, uris=(context,))
             for spok in self._triple_keys(triple_pattern, context):
-                if context is not None:
-                    contexts = (Graph(identifier=context),)
-                else:
-                    if cur.set_key(spok):
-                        contexts = (
-                            Graph(identifier=self._from_key(ck)[0], store=self)
-                            for ck in cur.iternext_dup())
-
-                #print('Found triples: {} In contexts: {}'.format(
-                #    self._from_key(spok), contexts))
                 yield self._from_key(spok), contexts
+        else:
+            for spok in self._triple_keys(triple_pattern):
+                spok = bytes(spok)
+                yield self._from_key(spok), TripleContexts(self, spok)
 
 
     def bind(self, prefix, namespace):
         '''
         Bind a prefix to a namespace.
+
+        With the compact term format, the namespace is also registered for
+        compressing URIs.
         '''
+        ns_str = str(namespace)
+        compact = self.term_format == self.TERM_FORMAT_COMPACT
         prefix = s2b(prefix)
         namespace = s2b(namespace)
         if self.is_txn_rw:
             with self.data_txn.cursor(self.dbs['pfx:ns']) as cur:
                 cur.put(prefix, namespace)
+            if compact:
+                with self.data_txn.cursor(self.dbs['ni:ns']) as cur:
+                    if self._add_namespace(cur, ns_str, self._serializer):
+                        # Discarded if the transaction is rolled back.
+                        self._ns_dirty = True
             with self.idx_txn.cursor(self.dbs['ns:pfx']) as cur:
                 cur.put(namespace, prefix)
         else:
-            with self.data_env.begin(write=True) as wtxn:
-                with wtxn.cursor(self.dbs['pfx:ns']) as cur:
-                    cur.put(prefix, namespace)
-            with self.idx_env.begin(write=True) as wtxn:
-                with wtxn.cursor(self.dbs['ns:pfx']) as cur:
-                    cur.put(namespace, prefix)
+            with self._write_lock:
+                with self.data_env.begin(write=True) as wtxn:
+                    with wtxn.cursor(self.dbs['pfx:ns']) as cur:
+                        cur.put(prefix, namespace)
+                    if compact:
+                        with wtxn.cursor(self.dbs['ni:ns']) as cur:
+                            self._add_namespace(
+                                    cur, ns_str, self._serializer)
+                with self.idx_env.begin(write=True) as wtxn:
+                    with wtxn.cursor(self.dbs['ns:pfx']) as cur:
+                        cur.put(namespace, prefix)
 
 
     def namespace(self, prefix):
@@ -637,13 +2193,11 @@ class LmdbStore(Store):
             with self.cur('spo:c') as cur:
                 if cur.set_key(self._to_key(triple)):
                     for ctx_uri in cur.iternext_dup():
-                        yield Graph(
-                            identifier=self._from_key(ctx_uri)[0], store=self)
+                        yield self._ctx_graph(self._from_key(ctx_uri)[0])
         else:
             with self.cur('c:') as cur:
                 for ctx_uri in cur.iternext(values=False):
-                    yield Graph(
-                            identifier=self._from_key(ctx_uri)[0], store=self)
+                    yield self._ctx_graph(self._from_key(ctx_uri)[0])
 
 
     def add_graph(self, graph):
@@ -664,22 +2218,29 @@ class LmdbStore(Store):
         #import pdb; pdb.set_trace()
         if isinstance(graph, Graph):
             graph = graph.identifier
-        pk_c = self._pickle(graph)
-        c_hash = self._hash(pk_c)
-        with self.cur('th:t') as cur:
-            c_exists = cur.set_key(c_hash)
-        if not c_exists:
-            # Insert context term if not existing.
-            if self.is_txn_rw:
-                # Use existing R/W transaction.
-                with self.cur('t:st') as cur:
-                    ck = self._append(cur, (pk_c,))[0]
-                with self.cur('th:t') as cur:
-                    cur.put(c_hash, ck)
-                with self.cur('c:') as cur:
-                    cur.put(ck, b'')
-            else:
-                # Open new R/W transactions.
+        if self._to_key(graph):
+            return
+        pk_c = self._dump_term(graph)
+        c_hash = self._term_hash(graph)
+        # Insert context term if not existing.
+        if self.is_txn_rw:
+            # Use existing R/W transaction.
+            with self.cur('t:st') as cur:
+                ck = self._append(cur, (pk_c,), main_txn=True)[0]
+            with self.cur('th:t') as cur:
+                cur.put(c_hash, ck)
+            with self.cur('c:') as cur:
+                cur.put(ck, b'')
+            self._key_cache.put(self._cache_key(graph), ck, pending=True)
+        else:
+            # Open new R/W transactions.
+            with self._write_lock:
+                # Another thread may have added the graph in the meantime.
+                with self.idx_env.begin() as rtxn:
+                    ck = rtxn.get(c_hash, db=self.dbs['th:t'])
+                if ck is not None:
+                    self._key_cache.put(self._cache_key(graph), ck)
+                    return
                 with self.data_env.begin(write=True) as wtxn:
                     with wtxn.cursor(self.dbs['t:st']) as cur:
                         ck = self._append(cur, (pk_c,))[0]
@@ -688,6 +2249,7 @@ class LmdbStore(Store):
                 with self.idx_env.begin(write=True) as wtxn:
                     with wtxn.cursor(self.dbs['th:t']) as cur:
                         cur.put(c_hash, ck)
+            self._key_cache.put(self._cache_key(graph), ck)
 
 
     def remove_graph(self, graph):
@@ -700,8 +2262,11 @@ class LmdbStore(Store):
             graph = graph.identifier
         self.remove((None, None, None), graph)
 
+        ck = self._to_key(graph)
+        if ck is None:
+            return
         with self.cur('c:') as cur:
-            if cur.set_key(self._to_key(graph)):
+            if cur.set_key(ck):
                 cur.delete()
 
 
@@ -718,7 +2283,10 @@ class LmdbStore(Store):
             self.idx_txn.commit()
         except (AttributeError, lmdb.Error):
             pass
-        self.is_txn_rw = None
+        self._key_cache.commit()
+        self._term_cache.commit()
+        self._ns_dirty = False
+        self._end_txn()
 
 
     def rollback(self):
@@ -734,11 +2302,443 @@ class LmdbStore(Store):
             self.idx_txn.abort()
         except (AttributeError, lmdb.Error):
             pass
-        self.is_txn_rw = None
+        self._key_cache.rollback()
+        self._term_cache.rollback()
+        if self._ns_dirty:
+            self._load_namespaces()
+        self._end_txn()
+
+
+    def rehash_terms(self, hash_algo):
+        '''
+        Rebuild the term hash index with a different hashing algorithm.
+
+        Term keys do not change, so no other index is affected. No other
+        process may use the store while this runs.
+
+        @param hash_algo (string) New hashing algorithm. One of the keys of
+        `HASH_ALGOS`.
+
+        @return int Number of hashed terms.
+        '''
+        if hash_algo not in self.HASH_ALGOS:
+            raise ValueError(
+                    'Hash algorithm `{}` is not supported.'.format(hash_algo))
+        if self.is_txn_open:
+            raise RuntimeError(
+                    'Cannot rehash terms with an open transaction.')
+
+        logger.info('Rehashing terms with `{}`.'.format(hash_algo))
+        self.hash_algo = hash_algo
+        self._hash_func = self.HASH_ALGOS[hash_algo]
+        self._hash_algo_conf = hash_algo
+        self._rebuild_term_hashes()
+
+        with self.data_env.begin() as txn:
+            return txn.stat(self.dbs['t:st'])['entries']
+
+
+    def migrate_term_format(self, namespaces=(), batch_size=100000):
+        '''
+        Convert a store with pickled terms to the compact term format.
+
+        The main database is copied to a new file with all the terms
+        converted, and the new file then replaces the original one. The
+        original file is not modified until the copy is complete, so an
+        interrupted migration can simply be run again. Term keys do not
+        change, therefore the only index affected is `th:t`, which is rebuilt
+        when the store is reopened.
+
+        No other process may use the store while this runs.
+
+        @param namespaces (iterable(str)) Namespaces to register for URI
+        compression, in addition to the ones bound in the store.
+        @param batch_size (int) Number of entries written per transaction.
+
+        @return int Number of converted terms.
+        '''
+        if self.term_format == self.TERM_FORMAT_COMPACT:
+            logger.info('Store terms are already in the compact format.')
+            return 0
+        if self.is_txn_open:
+            raise RuntimeError(
+                    'Cannot migrate the store with an open transaction.')
+
+        main_path = self.data_env.path()
+        tmp_path = main_path + '.migrate'
+        for fpath in (tmp_path, tmp_path + '-lock'):
+            if exists(fpath):
+                os.remove(fpath)
+
+        serializer = TermSerializer(self.node_pickler)
+        tmp_env = lmdb.open(tmp_path, subdir=False, map_size=self.MAP_SIZE,
+                max_dbs=len(self.data_keys), readahead=False)
+        tmp_dbs = {}
+        for db_key in self.data_keys:
+            dup = db_key in self._dupfixed_keys
+            tmp_dbs[db_key] = tmp_env.open_db(
+                    s2b(db_key), dupsort=dup, dupfixed=dup)
+
+        def copy(db_key, items):
+            ct = 0
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    ct += flush(db_key, batch)
+                    batch = []
+            return ct + flush(db_key, batch)
+
+        def flush(db_key, batch):
+            with tmp_env.begin(write=True) as wtxn:
+                with wtxn.cursor(tmp_dbs[db_key]) as cur:
+                    cur.putmulti(batch, append=True)
+            return len(batch)
+
+        try:
+            with self.data_env.begin() as rtxn:
+                with tmp_env.begin(write=True) as wtxn:
+                    with wtxn.cursor(tmp_dbs['ni:ns']) as cur:
+                        for ns in list(rtxn.cursor(
+                                self.dbs['pfx:ns']).iternext(keys=False)):
+                            self._add_namespace(cur, b2s(ns), serializer)
+                        for ns in namespaces:
+                            self._add_namespace(cur, str(ns), serializer)
+
+                # Terms keep their keys, so everything else is copied over.
+                for db_key in self.data_keys:
+                    if db_key in ('t:st', 't:zst', 'ni:ns'):
+                        continue
+                    with rtxn.cursor(self.dbs[db_key]) as cur:
+                        copy(db_key, iter(cur))
+
+                size = self.large_term_size
+                def convert(cur):
+                    for tk, data in cur:
+                        yield tk, serializer.dumps(self._unpickle(data))
+
+                with rtxn.cursor(self.dbs['t:st']) as cur:
+                    ct = copy('t:st', (
+                            (tk, bytes((TermSerializer.LARGE, data[0]))
+                                if size and len(data) > size else data)
+                            for tk, data in convert(cur)))
+                if size:
+                    # Large terms are converted again rather than held in
+                    # memory.
+                    with rtxn.cursor(self.dbs['t:st']) as cur:
+                        copy('t:zst', (
+                                (tk, zlib.compress(data))
+                                for tk, data in convert(cur)
+                                if len(data) > size))
+
+            with tmp_env.begin(write=True) as wtxn:
+                wtxn.put(
+                        b'term_format', s2b(self.TERM_FORMAT_COMPACT),
+                        db=tmp_dbs['md:data'])
+        finally:
+            tmp_env.close()
+
+        self.close()
+        os.replace(tmp_path, main_path)
+        if exists(tmp_path + '-lock'):
+            os.remove(tmp_path + '-lock')
+        logger.info('Converted {} terms. Rebuilding term hashes.'.format(ct))
+        self.open()
+
+        return ct
+
+
+    def rebuild_indices(
+            self, indices=None, online=False, workers=None,
+            chunk_size=1000000, progress=None):
+        '''
+        Rebuild indices from the main data.
+
+        Each index is built by a separate worker thread from a snapshot of
+        the main data, read in key order. Entries that do not come out in
+        the order of the index are sorted in chunks, which are spilled to
+        temporary files in the store directory and merged. All entries are
+        then appended to the empty index, which skips the B-tree lookups of
+        ordinary writes.
+
+        Writes to the main data are blocked while this runs, also in other
+        processes.
+
+        @param indices (iterable(string)) Indices to rebuild. If None, all
+        indices are rebuilt, including the composite, range and full-text
+        indices if enabled.
+        @param online (bool) If True, each index is replaced in a single
+        transaction, so the store can keep serving reads from the old index
+        until the new one is committed. Large indices need more memory and
+        disk space this way. If False, indices are written in batched
+        transactions and are incomplete until the rebuild is over, so the
+        store must not be used meanwhile. An interrupted offline rebuild is
+        resumed when the store is opened again.
+        @param workers (int) Maximum number of indices built in parallel. If
+        None, all the indices are built in parallel.
+        @param chunk_size (int) Number of entries sorted in memory at a time
+        and, in offline mode, written per transaction.
+        @param progress (callable) Function called with the index name, the
+        number of source records processed and the total number of source
+        records every `chunk_size` records and at the end of each index. It
+        is called from the worker threads.
+
+        @return dict Number of entries written, keyed by index.
+        '''
+        valid_keys = self._rebuildable_keys()
+        indices = valid_keys if indices is None else tuple(indices)
+        for db_key in indices:
+            if db_key not in valid_keys:
+                raise ValueError(
+                        'Index `{}` does not exist or cannot be '
+                        'rebuilt.'.format(db_key))
+        if self.is_txn_open:
+            raise RuntimeError(
+                    'Cannot rebuild indices with an open transaction.')
+        if not indices:
+            return {}
+
+        logger.info('Rebuilding indices: {}'.format(', '.join(indices)))
+        with self._write_lock:
+            # Hold the LMDB writer lock on the main data for a consistent
+            # snapshot. Nothing is written with this transaction.
+            lock_txn = self.data_env.begin(write=True)
+            try:
+                # The term hash index may be among the indices being
+                # rebuilt, so the closure predicate is looked up first.
+                closure_pk = None
+                if self.closure_predicate is not None:
+                    with self.idx_env.begin() as txn:
+                        closure_pk = txn.get(
+                                self._term_hash(self.closure_predicate),
+                                db=self.dbs['th:t'])
+                if not online:
+                    with self.idx_env.begin(write=True) as txn:
+                        for db_key in indices:
+                            txn.put(
+                                    b'rebuild:' + s2b(db_key), b'1',
+                                    db=self.dbs['md:idx'])
+
+                with TemporaryDirectory(
+                        prefix='rebuild.', dir=self.path) as tmp_dir:
+                    with ThreadPoolExecutor(
+                            workers or len(indices)) as executor:
+                        counts = executor.map(partial(
+                                self._rebuild_index, online=online,
+                                tmp_dir=tmp_dir, chunk_size=chunk_size,
+                                progress=progress, closure_pk=closure_pk),
+                                indices)
+                        ret = dict(zip(indices, counts))
+                if set(self.closure_idx_keys) <= set(indices):
+                    with self.idx_env.begin(write=True) as txn:
+                        txn.put(b'closure', b'1', db=self.dbs['md:idx'])
+            finally:
+                lock_txn.abort()
+        logger.info('Indices rebuilt.')
+
+        return ret
+
+
+    def purge_orphan_terms(self, batch_size=1000, limit=None, progress=None):
+        '''
+        Delete the terms that are not used by any triple or context.
+
+        Terms are not deleted when their last triple is removed, because
+        looking up other references at every removal would slow down writes.
+        This method scans `t:st` in key order and checks each term against the
+        lookup indices and the context list.
+
+        Terms are scanned in batches, each in its own R/W transaction, so
+        writers are never blocked for long. After each batch, the position of
+        the scan is saved, so that an interrupted or limited run is resumed
+        by the next one. A store-wide epoch is also increased after each batch
+        with deletions, so that all processes drop the keys that they have
+        cached.
+
+        The term with the highest key is never deleted, because keys of new
+        terms are assigned by incrementing it, and a key must never be
+        reused.
+
+        Deleted pages are reused by LMDB for new data but the database files
+        do not shrink.
+
+        @param batch_size (int) Number of terms scanned per transaction.
+        @param limit (int) Maximum number of terms scanned in this run. If
+        None, the scan continues to the end of `t:st`.
+        @param progress (callable) Function called after each batch with the
+        number of terms scanned so far, the number of terms deleted so far
+        and the total number of terms at the start of the run.
+
+        @return dict Number of `scanned` and `deleted` terms, `bytes` of
+        term data and hash index entries deleted, and whether the scan was
+        `complete`d.
+        '''
+        if self.is_txn_open:
+            raise RuntimeError(
+                    'Cannot purge terms with an open transaction.')
+
+        md_db = self.dbs['md:data']
+        ret = {'scanned': 0, 'deleted': 0, 'bytes': 0, 'complete': False}
+        with self.data_env.begin() as txn:
+            total = txn.stat(self.dbs['t:st'])['entries']
+        logger.info('Purging orphan terms.')
+
+        while not ret['complete']:
+            if limit is not None:
+                if ret['scanned'] >= limit:
+                    break
+                batch_size = min(batch_size, limit - ret['scanned'])
+
+            with TxnManager(self, True):
+                ckpt = self.data_txn.get(b'gc_checkpoint', db=md_db)
+                ckpt = bytes(ckpt) if ckpt else None
+                deleted = 0
+                with ExitStack() as stack:
+                    tcur = stack.enter_context(self.cur('t:st'))
+                    zcur = stack.enter_context(self.cur('t:zst'))
+                    hcur = stack.enter_context(self.cur('th:t'))
+                    # A term is in use if it is a context or appears in a
+                    # lookup index.
+                    live_curs = [
+                            stack.enter_context(self.cur(db_key))
+                            for db_key in ('c:', 's:po', 'p:so', 'o:sp')]
+                    last_key = bytes(tcur.key()) if tcur.last() else None
+
+                    if ckpt is None:
+                        valid = tcur.first()
+                    else:
+                        valid = tcur.set_range(ckpt)
+                        if valid and tcur.key() == ckpt:
+                            valid = tcur.next()
+
+                    for i in range(batch_size):
+                        if not valid:
+                            break
+                        tk = bytes(tcur.key())
+                        ckpt = tk
+                        ret['scanned'] += 1
+                        if tk == last_key or any(
+                                cur.set_key(tk) for cur in live_curs):
+                            valid = tcur.next()
+                            continue
+
+                        data = bytes(tcur.value())
+                        thash = self._hash(
+                                self._expand_term(self._term_data(tk, data)))
+                        if hcur.set_key(thash) and hcur.value() == tk:
+                            hcur.delete()
+                        if self._is_stub(data) and zcur.set_key(tk):
+                            ret['bytes'] += len(tk) + len(zcur.value())
+                            zcur.delete()
+                        # This moves the cursor to the next term.
+                        valid = tcur.delete()
+                        deleted += 1
+                        ret['bytes'] += 2 * len(tk) + len(data) + len(thash)
+
+                if valid:
+                    self.data_txn.put(b'gc_checkpoint', ckpt, db=md_db)
+                else:
+                    self.data_txn.delete(b'gc_checkpoint', db=md_db)
+                    ret['complete'] = True
+                if deleted:
+                    self.data_txn.put(
+                            b'gc_epoch', s2b(str(self._local.gc_epoch + 1)),
+                            db=md_db)
+                    ret['deleted'] += deleted
+
+            if progress:
+                progress(ret['scanned'], ret['deleted'], total)
+
+        logger.info(
+                'Scanned {} terms, deleted {} orphan terms ({} bytes).'.format(
+                    ret['scanned'], ret['deleted'], ret['bytes']))
+
+        return ret
+
+
+    def backup(self, dest, progress=None):
+        '''
+        Copy the store to another location while it is in use.
+
+        Both environments are copied with LMDB's compacting copy, which
+        writes out only the pages in use, in order, so the copies are usually
+        smaller than the originals. The copies are read from snapshots of the
+        main data and of the indices that are taken at the same time, with
+        the writer locks of both environments held, so that they match. The
+        locks are released before copying, so readers and writers are only
+        held up while a write in progress completes.
+
+        The store in the destination directory is opened like any other.
+
+        @param dest (string) Destination directory. It is created if it does
+        not exist, and it must not contain a store.
+        @param progress (callable) Function called after each environment is
+        copied with its name (`main` or `index`) and its copy report (see
+        return value).
+
+        @return dict Report of each environment copy, keyed by environment
+        name, with the `size` of the copy, the `src_size` of the original
+        file and the `time` taken in seconds.
+        '''
+        if self.is_txn_open:
+            raise RuntimeError('Cannot back up the store with an open '
+                    'transaction.')
+        envs = (('main', self.data_env), ('index', self.idx_env))
+        for name, env in envs:
+            if exists(os.path.join(dest, name)):
+                raise FileExistsError(
+                        'A store already exists in {}.'.format(dest))
+        makedirs(dest, exist_ok=True)
+
+        logger.info('Backing up store to {}.'.format(dest))
+        with ExitStack() as stack:
+            with self._write_lock, ExitStack() as lock_stack:
+                # A writer may have committed the main data but not yet the
+                # indices. Acquiring both writer locks waits for it to
+                # finish. Each transaction is set to be aborted as soon as it
+                # is open, so none is left behind if a later one fails.
+                for name, env in envs:
+                    lock_stack.callback(env.begin(write=True).abort)
+                txns = []
+                for name, env in envs:
+                    txn = env.begin()
+                    stack.callback(txn.abort)
+                    txns.append(txn)
+
+            ret = {}
+            for (name, env), txn in zip(envs, txns):
+                fpath = os.path.join(dest, name)
+                start = perf_counter()
+                env.copy(fpath, compact=True, txn=txn)
+                txn.abort()
+                ret[name] = {
+                    'size': getsize(fpath),
+                    'src_size': getsize(env.path()),
+                    'time': perf_counter() - start,
+                }
+                logger.info('Copied {} environment: {} bytes.'.format(
+                    name, ret[name]['size']))
+                if progress:
+                    progress(name, ret[name])
+
+        return ret
 
 
     ## PRIVATE METHODS ##
 
+
+    def _end_txn(self):
+        '''
+        Clear the transaction state of the current thread after a commit or
+        rollback.
+        '''
+        was_rw = self.is_txn_rw
+        self.is_txn_rw = None
+        self._local.term_key_pos = None
+        if was_rw:
+            self._write_lock.release()
+
+
     def _triple_keys(self, triple_pattern, context=None):
         '''
         Generator over matching triple keys.
@@ -754,44 +2754,39 @@ class LmdbStore(Store):
             context = None
 
         if context is not None:
-            pk_c = self._pickle(context)
             ck = self._to_key(context)
-
-            # Shortcuts
             if not ck:
                 # Context not found.
-                return iter(())
-
-            with self.cur('c:spo') as cur:
-                # s p o c
-                if all(triple_pattern):
-                    spok = self._to_key(triple_pattern)
-                    if not spok:
-                        # A term in the triple is not found.
-                        return iter(())
-                    if cur.set_key_dup(ck, spok):
-                        yield spok
-                        return
-                    else:
-                        # Triple not found.
-                        return iter(())
-
-                # ? ? ? c
-                elif not any(triple_pattern):
-                    # Get all triples from the context
-                    if cur.set_key(ck):
-                        for spok in cur.iternext_dup():
-                            yield spok
-                    else:
-                        return iter(())
-
-                # Regular lookup.
-                else:
-                    yield from (
-                            spok for spok in self._lookup(triple_pattern)
-                            if cur.set_key_dup(ck, spok))
+                return
         else:
-            yield from self._lookup(triple_pattern)
+            ck = None
+
+        key_pattern = self.to_key_pattern(triple_pattern)
+        if key_pattern is None:
+            # A term in the pattern is not found.
+            return
+
+        yield from self.triple_keys(key_pattern, ck)
+
+
+    def _triples(self, triple_pattern, context=None):
+        '''
+        Generator over matching triples, without their contexts.
+
+        This is a lighter alternative to `triples` for internal callers that
+        do not need the contexts.
+
+        @param triple_pattern (tuple) 3 RDFLib terms
+        @param context (rdflib.Graph | None) Context graph or URI, or None.
+
+        @return generator(tuple(rdflib.term.Identifier))
+        '''
+        context = self._normalize_context(context)
+        if context == RDFLIB_DEFAULT_GRAPH_URI:
+            context = None
+
+        for spok in self._triple_keys(triple_pattern, context):
+            yield self._from_key(spok)
 
 
     def _init_db_environments(self, create=True):
@@ -812,10 +2807,17 @@ class LmdbStore(Store):
             else:
                 return NO_STORE
 
+        profile = self.DURABILITY_PROFILES[self.durability]
         self.data_env = lmdb.open(path + '/main', subdir=False, create=create,
-                map_size=self.MAP_SIZE, max_dbs=4, readahead=False)
+                map_size=self.MAP_SIZE, max_dbs=len(self.data_keys),
+                readahead=False, **profile['main'])
         self.idx_env = lmdb.open(path + '/index', subdir=False, create=create,
-                map_size=self.MAP_SIZE, max_dbs=6, readahead=False)
+                map_size=self.MAP_SIZE,
+                max_dbs=len(self.idx_keys) + len(self.composite_idx_keys)
+                    + len(self.range_idx_keys)
+                    + len(self.fulltext_idx_keys)
+                    + len(self.closure_idx_keys),
+                readahead=False, **profile['index'])
 
         # Clear stale readers.
         data_stale_readers = self.data_env.reader_check()
@@ -825,23 +2827,598 @@ class LmdbStore(Store):
         logger.debug(
                 'Cleared index stale readers: {}'.format(idx_stale_readers))
 
-        # Open and optionally create main databases.
-        self.dbs = {
-            # Main databases.
-            't:st': self.data_env.open_db(b't:st', create=create),
-            'spo:c': self.data_env.open_db(
-                    b'spo:c', create=create, dupsort=True, dupfixed=True),
-            'c:': self.data_env.open_db(b'c:', create=create),
-            'pfx:ns': self.data_env.open_db(b'pfx:ns', create=create),
-            # One-off indices.
-            'ns:pfx': self.idx_env.open_db(b'ns:pfx', create=create),
-            'th:t': self.idx_env.open_db(b'th:t', create=create),
-        }
-        # Other index databases.
-        for db_key in self.idx_keys:
-            if db_key not in ('ns:pfx', 'th:t'):
-                self.dbs[db_key] = self.idx_env.open_db(s2b(db_key),
-                        dupsort=True, dupfixed=True, create=create)
+        # Open and optionally create main databases and indices.
+        self.dbs = {}
+        for env, db_keys in (
+                (self.data_env, self.data_keys),
+                (self.idx_env, self.idx_keys + self.composite_idx_keys
+                    + self.range_idx_keys + self.fulltext_idx_keys
+                    + self.closure_idx_keys)):
+            for db_key in db_keys:
+                dup = db_key in self._dupfixed_keys
+                self.dbs[db_key] = env.open_db(
+                        s2b(db_key), create=create, dupsort=dup,
+                        dupfixed=dup)
+
+        self._init_hash_algo()
+        self._init_term_format()
+        self._sync_composite_indices()
+        self._sync_optional_index(
+                'range_idx', self.range_idx_keys, self.range_index)
+        self._sync_optional_index(
+                'fulltext_idx', self.fulltext_idx_keys, self.fulltext_index)
+        self._resume_index_rebuild()
+        self._init_counts()
+        self._init_refs()
+        self._init_closure()
+
+
+    def _init_hash_algo(self):
+        '''
+        Set up the term hashing algorithm for the store.
+
+        The algorithm is recorded in the `md:idx` database. Existing stores
+        without a record use `LEGACY_HASH_ALGO`.
+
+        @raise ValueError if the configured algorithm differs from the one
+        recorded in the store.
+        '''
+        with self.idx_env.begin(write=True) as txn:
+            algo = txn.get(b'hash_algo', db=self.dbs['md:idx'])
+            if algo is None:
+                algo = s2b(
+                    self.LEGACY_HASH_ALGO
+                    if txn.stat(self.dbs['th:t'])['entries']
+                    else self._hash_algo_conf or self.KEY_HASH_ALGO)
+                txn.put(b'hash_algo', algo, db=self.dbs['md:idx'])
+        algo = b2s(algo)
+
+        if self._hash_algo_conf and self._hash_algo_conf != algo:
+            self.data_env.close()
+            self.idx_env.close()
+            raise ValueError(
+                    'The store at {} uses the `{}` hash algorithm but `{}` '
+                    'is configured. Remove the option or set it to `{}`, '
+                    'then convert the store with `lsup-admin rehash-terms '
+                    '{}`.'.format(
+                        self.path, algo, self._hash_algo_conf, algo,
+                        self._hash_algo_conf))
+        self.hash_algo = algo
+        self._hash_func = self.HASH_ALGOS[algo]
+
+
+    def _init_term_format(self):
+        '''
+        Set up the term serialization for the store.
+
+        The format is recorded in the `md:data` database. New stores use the
+        compact format; stores that hold terms but have no format record are
+        legacy stores with pickled terms.
+
+        The `md:idx` database records the format that the term hashes were
+        calculated from. If that differs from the data format, e.g. after a
+        migration, the term hash index is rebuilt.
+        '''
+        self._pickle = self.node_pickler.dumps
+        self._unpickle = self.node_pickler.loads
+        self._serializer = TermSerializer(self.node_pickler)
+        with self.data_env.begin(write=True) as txn:
+            fmt = txn.get(b'term_format', db=self.dbs['md:data'])
+            if fmt is None:
+                fmt = s2b(
+                    self.TERM_FORMAT_PICKLE
+                    if txn.stat(self.dbs['t:st'])['entries']
+                    else self.TERM_FORMAT_COMPACT)
+                txn.put(b'term_format', fmt, db=self.dbs['md:data'])
+            self._load_namespaces(txn)
+        self.term_format = b2s(fmt)
+
+        if self.term_format == self.TERM_FORMAT_COMPACT:
+            self._dump_term = self._serializer.dumps
+            self._load_term = self._load_compact_term
+            self._canonical_term = self._serializer.canonical
+            self._expand_term = self._expand_compact_term
+        else:
+            self._dump_term = self._canonical_term = self._pickle
+            self._load_term = self._unpickle
+            self._expand_term = lambda data: self._pickle(self._unpickle(data))
+
+        with self.idx_env.begin(write=True) as txn:
+            idx_fmt = txn.get(b'term_format', db=self.dbs['md:idx'])
+            if idx_fmt is None:
+                txn.put(b'term_format', fmt, db=self.dbs['md:idx'])
+        if idx_fmt is not None and idx_fmt != fmt:
+            logger.warning(
+                    'Term hashes were calculated for the `{}` term format. '
+                    'Rebuilding.'.format(b2s(idx_fmt)))
+            self._rebuild_term_hashes()
+
+
+    def _rebuild_term_hashes(self, batch_size=100000):
+        '''
+        Rebuild the `th:t` index from the stored terms.
+
+        The index is written in batches, each in its own transaction, so that
+        large stores do not exceed the dirty page limit of a LMDB
+        transaction. The index is flagged as incomplete until the end, so an
+        interrupted rebuild starts over when the store is opened again.
+
+        @param batch_size (int) Number of hashes written per transaction.
+        '''
+        with self.idx_env.begin(write=True) as wtxn:
+            # The index is flagged as incomplete until all hashes are written.
+            wtxn.put(b'term_format', b'', db=self.dbs['md:idx'])
+            wtxn.put(
+                    b'hash_algo', s2b(self.hash_algo), db=self.dbs['md:idx'])
+
+        self.rebuild_indices(('th:t',), chunk_size=batch_size)
+
+        with self.idx_env.begin(write=True) as wtxn:
+            wtxn.put(
+                    b'term_format', s2b(self.term_format),
+                    db=self.dbs['md:idx'])
+
+
+    def _load_namespaces(self, txn=None):
+        '''
+        Load the namespace ID table used for URI compression.
+
+        @param txn (lmdb.Transaction) Transaction on the main environment. If
+        None, a new read-only transaction is opened.
+        '''
+        if txn is None:
+            with self.data_env.begin() as txn:
+                return self._load_namespaces(txn)
+
+        with txn.cursor(self.dbs['ni:ns']) as cur:
+            self._serializer.load_namespaces(
+                    (int.from_bytes(nsid, 'big'), b2s(ns))
+                    for nsid, ns in cur)
+        self._ns_dirty = False
+
+
+    @staticmethod
+    def _add_namespace(cur, ns, serializer):
+        '''
+        Add a namespace to a namespace ID table if it is not there yet.
+
+        @param cur (lmdb.Cursor) Write cursor on a `ni:ns` database.
+        @param ns (str) Namespace URI.
+        @param serializer (TermSerializer) Serializer to add the namespace
+        to.
+
+        @return bool Whether the namespace was added.
+        '''
+        ns_b = s2b(ns)
+        if not ns or any(
+                bytes(v) == ns_b for v in cur.iternext(keys=False)):
+            return False
+        nsid = int.from_bytes(cur.key(), 'big') + 1 if cur.last() else 0
+        if nsid >= serializer.MAX_NS:
+            logger.warning(
+                    'Namespace table is full. {} is not registered.'.format(
+                        ns))
+            return False
+        cur.put(nsid.to_bytes(2, 'big'), ns_b)
+        serializer.add_namespace(nsid, ns)
+
+        return True
+
+
+    def _sync_composite_indices(self):
+        '''
+        Build or drop the composite indices if the configuration has changed.
+
+        Whether the composite indices exist is recorded in the `md:idx`
+        database. If they are enabled for a store which does not have them,
+        they are built from the `s:po` index; if they are disabled, they are
+        emptied so that they do not go stale.
+        '''
+        with self.idx_env.begin(write=True) as txn:
+            has_cidx = txn.get(
+                    b'composite_idx', db=self.dbs['md:idx']) == b'1'
+            if self.composite_indices == has_cidx:
+                return
+
+            for db_key in self.composite_idx_keys:
+                txn.drop(self.dbs[db_key], delete=False)
+
+            if self.composite_indices:
+                logger.info('Building composite indices.')
+                self._build_composite_indices(txn)
+
+            txn.put(
+                    b'composite_idx', b'1' if self.composite_indices else b'0',
+                    db=self.dbs['md:idx'])
+
+
+    def _sync_optional_index(self, flag, db_keys, enabled):
+        '''
+        Build or drop an optional index if the configuration has changed.
+
+        Whether the index exists is recorded in the `md:idx` database. If it
+        is enabled for a store which does not have it, it is flagged for an
+        offline rebuild, which `_resume_index_rebuild` then runs; so an
+        interrupted build is resumed the next time the store is opened. If
+        it is disabled, it is emptied so that it does not go stale.
+
+        @param flag (string) Name of the flag in `md:idx`.
+        @param db_keys (tuple(string)) Databases of the index.
+        @param enabled (bool) Whether the index is enabled.
+        '''
+        with self.idx_env.begin(write=True) as txn:
+            has_idx = txn.get(s2b(flag), db=self.dbs['md:idx']) == b'1'
+            if enabled == has_idx:
+                return
+
+            for db_key in db_keys:
+                txn.drop(self.dbs[db_key], delete=False)
+                if enabled:
+                    logger.info('Building index {}.'.format(db_key))
+                    txn.put(
+                            b'rebuild:' + s2b(db_key), b'1',
+                            db=self.dbs['md:idx'])
+
+            txn.put(
+                    s2b(flag), b'1' if enabled else b'0',
+                    db=self.dbs['md:idx'])
+
+
+    def _build_composite_indices(self, txn, chunk_size=100000):
+        '''
+        Build the composite indices from the `s:po` index.
+
+        `sp:o` can be appended in key order. The other indices are written in
+        sorted chunks.
+
+        @param txn (lmdb.Transaction) Index R/W transaction.
+        @param chunk_size (int) Number of entries buffered for each index
+        before writing.
+        '''
+        sep = self.SEP_BYTE
+        chunks = {'po:s': [], 'so:p': []}
+
+        def flush(db_key):
+            with txn.cursor(self.dbs[db_key]) as cur:
+                cur.putmulti(sorted(chunks[db_key]))
+            chunks[db_key] = []
+
+        with txn.cursor(self.dbs['s:po']) as scur, \
+                txn.cursor(self.dbs['sp:o']) as spcur:
+            for sk, pok in scur:
+                pk, ok = pok.split(sep)
+                spcur.put(sk + sep + pk, ok, append=True)
+                chunks['po:s'].append((pok, sk))
+                chunks['so:p'].append((sk + sep + ok, pk))
+                if len(chunks['po:s']) >= chunk_size:
+                    for db_key in chunks:
+                        flush(db_key)
+        for db_key in chunks:
+            flush(db_key)
+
+
+    def _rebuildable_keys(self):
+        '''
+        Indices that can be rebuilt from the main data.
+
+        @return tuple(string)
+        '''
+        db_keys = tuple(k for k in self.idx_keys if k != 'md:idx')
+        if self.composite_indices:
+            db_keys += self.composite_idx_keys
+        if self.range_index:
+            db_keys += self.range_idx_keys
+        if self.fulltext_index:
+            db_keys += self.fulltext_idx_keys
+        if self.closure_predicate is not None:
+            db_keys += self.closure_idx_keys
+
+        return db_keys
+
+
+    def _init_counts(self):
+        '''
+        Build the `cp:n` counters for stores created before they were
+        introduced.
+        '''
+        with self.idx_env.begin() as txn:
+            if txn.get(b'counts', db=self.dbs['md:idx']) == b'1':
+                return
+        logger.info('Building triple counters.')
+        self.rebuild_indices(('cp:n',))
+        with self.idx_env.begin(write=True) as txn:
+            txn.put(b'counts', b'1', db=self.dbs['md:idx'])
+
+
+    def _init_refs(self):
+        '''
+        Build the `o:cps` reverse reference index for stores created before
+        it was introduced.
+        '''
+        with self.idx_env.begin() as txn:
+            if txn.get(b'refs', db=self.dbs['md:idx']) == b'1':
+                return
+        logger.info('Building reverse reference index.')
+        self.rebuild_indices(('o:cps',))
+        with self.idx_env.begin(write=True) as txn:
+            txn.put(b'refs', b'1', db=self.dbs['md:idx'])
+
+
+    def _init_closure(self):
+        '''
+        Check whether the closure index is complete.
+
+        New stores start with a complete (empty) index. Stores created before
+        the index was introduced, or before `closure_predicate` was set, must
+        have it built with `rebuild_indices`, which is not done implicitly
+        because it blocks writes for the whole rebuild.
+        '''
+        if self.closure_predicate is None:
+            return
+        with self.idx_env.begin() as txn:
+            if txn.get(b'closure', db=self.dbs['md:idx']) == b'1':
+                return
+            is_new = not txn.stat(self.dbs['s:po'])['entries']
+        if is_new:
+            with self.idx_env.begin(write=True) as txn:
+                txn.put(b'closure', b'1', db=self.dbs['md:idx'])
+        else:
+            logger.warning(
+                    'The closure index of the store at {} is not built. Run '
+                    '`lsup-admin rebuild-index {}` while the repository is '
+                    'offline.'.format(
+                        self.path, ' '.join(self.closure_idx_keys)))
+
+
+    def _resume_index_rebuild(self):
+        '''
+        Rebuild the indices left incomplete by an interrupted offline
+        rebuild.
+        '''
+        prefix = b'rebuild:'
+        with self.idx_env.begin(write=True) as txn:
+            with txn.cursor(self.dbs['md:idx']) as cur:
+                flagged = []
+                if cur.set_range(prefix):
+                    for k in cur.iternext(values=False):
+                        if not k.startswith(prefix):
+                            break
+                        flagged.append(b2s(k[len(prefix):]))
+            # Indices that are not maintained anymore need no rebuild.
+            valid_keys = self._rebuildable_keys()
+            for db_key in flagged:
+                if db_key not in valid_keys:
+                    txn.delete(prefix + s2b(db_key), db=self.dbs['md:idx'])
+
+        indices = [k for k in flagged if k in valid_keys]
+        if indices:
+            logger.warning(
+                    'Rebuild of indices {} was interrupted. Resuming.'.format(
+                        ', '.join(indices)))
+            self.rebuild_indices(indices)
+
+
+    def _rebuild_index(
+            self, db_key, online, tmp_dir, chunk_size, progress=None,
+            closure_pk=None):
+        '''
+        Rebuild one index. See `rebuild_indices`.
+
+        @param db_key (string) Index name.
+        @param online (bool) Whether to write the index in one transaction.
+        @param tmp_dir (string) Directory for the sorted runs.
+        @param chunk_size (int) Number of entries per sorted run and per
+        batch.
+        @param progress (callable) Progress callback.
+        @param closure_pk (bytes | None) Key of the closure predicate, looked
+        up before any index is cleared.
+
+        @return int Number of entries written.
+        '''
+        sep = self.SEP_BYTE
+        with self.data_env.begin() as rtxn:
+            if db_key == 'th:t':
+                src_key = 't:st'
+            elif db_key == 'ns:pfx':
+                src_key = 'pfx:ns'
+            else:
+                src_key = 'spo:c'
+            total = rtxn.stat(self.dbs[src_key])['entries']
+
+            def source():
+                ct = 0
+                with rtxn.cursor(self.dbs[src_key]) as cur:
+                    for rec in cur:
+                        yield rec
+                        ct += 1
+                        if progress and not ct % chunk_size:
+                            progress(db_key, ct, total)
+
+            if db_key == 'th:t':
+                entries = self._sort_entries((
+                        (self._hash(self._expand_term(
+                            self._term_data(tk, data, rtxn))), tk)
+                        for tk, data in source()), tmp_dir, chunk_size)
+            elif db_key == 'ns:pfx':
+                entries = iter(sorted((ns, pfx) for pfx, ns in source()))
+            elif db_key == 'c:spo':
+                entries = self._sort_entries(
+                        ((ck, spok) for spok, ck in source()),
+                        tmp_dir, chunk_size)
+            elif db_key == 'cp:n':
+                cpks = self._sort_entries(
+                        ((ck + sep + spok.split(sep)[1], b'')
+                            for spok, ck in source()),
+                        tmp_dir, chunk_size)
+                entries = (
+                        (cpk, sum(1 for _ in grp).to_bytes(8, 'big'))
+                        for cpk, grp in groupby(cpk for cpk, _ in cpks))
+            elif db_key == 'o:cps':
+                def ref_entries():
+                    # Objects are checked once for each of their triples.
+                    last_ok = last_is_uri = None
+                    for spok, ck in source():
+                        ok = spok[-self.KEY_LENGTH:]
+                        if ok != last_ok:
+                            last_ok = ok
+                            last_is_uri = self._is_uri(ok, rtxn)
+                        if last_is_uri and self._is_ref_ck(ck, rtxn):
+                            yield self._ref_entry(spok, ck)
+
+                entries = self._sort_entries(
+                        ref_entries(), tmp_dir, chunk_size)
+            elif db_key in self.closure_idx_keys:
+                entries = self._sort_entries(
+                        self._closure_entries(
+                            source(), db_key == 'd:a', closure_pk, rtxn),
+                        tmp_dir, chunk_size)
+            elif db_key == 'pv:so':
+                def range_entries():
+                    last_spok = None
+                    for spok, ck in source():
+                        if spok == last_spok:
+                            continue
+                        last_spok = spok
+                        sk, pk, ok = spok.split(sep)
+                        val = self._range_value(ok, rtxn)
+                        if val is not None:
+                            yield (pk + sep + val, sk + sep + ok)
+
+                entries = self._sort_entries(
+                        range_entries(), tmp_dir, chunk_size)
+            elif db_key == 'tk:spo':
+                def fulltext_entries():
+                    last_spok = None
+                    for spok, ck in source():
+                        if spok == last_spok:
+                            continue
+                        last_spok = spok
+                        ok = spok.split(sep)[2]
+                        for tk in self._fulltext_tokens(ok, rtxn):
+                            yield (s2b(tk), spok)
+
+                entries = self._sort_entries(
+                        fulltext_entries(), tmp_dir, chunk_size, sep)
+            else:
+                order = self._lookup_ordering[db_key]
+                # Number of terms in the index key.
+                key_len = len(db_key.split(':')[0])
+
+                def triple_entries():
+                    last_spok = None
+                    for spok, ck in source():
+                        # A triple is found once for each of its contexts.
+                        if spok == last_spok:
+                            continue
+                        last_spok = spok
+                        terms = spok.split(sep)
+                        yield (
+                            sep.join(terms[i] for i in order[:key_len]),
+                            sep.join(terms[i] for i in order[key_len:]))
+
+                entries = triple_entries()
+                # `s:po` and `sp:o` come out of `spo:c` in order.
+                if order != (0, 1, 2):
+                    entries = self._sort_entries(
+                            entries, tmp_dir, chunk_size)
+
+            ct = self._write_index(db_key, entries, online, chunk_size)
+
+        if progress:
+            progress(db_key, total, total)
+        logger.info('Index {} rebuilt with {} entries.'.format(db_key, ct))
+
+        return ct
+
+
+    @staticmethod
+    def _sort_entries(entries, tmp_dir, chunk_size, sep=None):
+        '''
+        Sort index entries that may not fit in memory.
+
+        Entries are sorted as concatenated byte strings, therefore all the
+        keys must have the same length, and so must all the values, unless
+        `sep` is given. If the entries do not fit in one chunk, the sorted
+        chunks are written to temporary files, which are merged while the
+        result is consumed.
+
+        The input is read entirely before this method returns.
+
+        @param entries (iterable(tuple(bytes))) Key-value pairs.
+        @param tmp_dir (string) Directory for the temporary files.
+        @param chunk_size (int) Number of entries sorted in memory at a time.
+        @param sep (bytes | None) Byte lower than any byte of the keys. If
+        given, keys and values are joined with it and can have any length.
+
+        @return iterator(tuple(bytes)) Sorted key-value pairs.
+        '''
+        runs = []
+        chunk = []
+        key_len = rec_len = None
+        framed = sep is not None
+        for k, v in entries:
+            if framed:
+                chunk.append(k + sep + v)
+            else:
+                if key_len is None:
+                    key_len = len(k)
+                    rec_len = key_len + len(v)
+                chunk.append(k + v)
+            if len(chunk) >= chunk_size:
+                chunk.sort()
+                runs.append(_write_run(chunk, tmp_dir, framed))
+                chunk = []
+        chunk.sort()
+
+        if runs:
+            runs.append(_write_run(chunk, tmp_dir, framed))
+            records = heapq.merge(
+                    *(_read_run(fpath, rec_len) for fpath in runs))
+        else:
+            records = chunk
+
+        if framed:
+            return (
+                    (k, v) for k, _, v in (
+                        rec.partition(sep) for rec in records))
+
+        return ((rec[:key_len], rec[key_len:]) for rec in records)
+
+
+    def _write_index(self, db_key, entries, online, batch_size):
+        '''
+        Replace the content of an index with sorted entries.
+
+        @param db_key (string) Index name.
+        @param entries (iterator(tuple(bytes))) Sorted key-value pairs.
+        @param online (bool) If True, the index is replaced in a single
+        transaction. Otherwise, it is emptied first and then written in
+        batches, and the rebuild flag of the index is cleared at the end.
+        @param batch_size (int) Number of entries written per transaction in
+        offline mode.
+
+        @return int Number of entries written.
+        '''
+        db = self.dbs[db_key]
+        if online:
+            with self.idx_env.begin(write=True) as txn:
+                txn.drop(db, delete=False)
+                with txn.cursor(db) as cur:
+                    return cur.putmulti(entries, append=True)[1]
+
+        with self.idx_env.begin(write=True) as txn:
+            txn.drop(db, delete=False)
+        ct = 0
+        batch = list(islice(entries, batch_size))
+        while batch:
+            with self.idx_env.begin(write=True) as txn:
+                with txn.cursor(db) as cur:
+                    ct += cur.putmulti(batch, append=True)[1]
+            batch = list(islice(entries, batch_size))
+        with self.idx_env.begin(write=True) as txn:
+            txn.delete(b'rebuild:' + s2b(db_key), db=self.dbs['md:idx'])
+
+        return ct
 
 
     def _from_key(self, key):
@@ -850,12 +3427,28 @@ class LmdbStore(Store):
 
         @param key (bytes) The key to be converted. It can be a compound one
         in which case the function will return multiple terms.
+
+        Decoded terms are cached by their individual term keys, so a term
+        that appears in many triples is deserialized only once. The `t:st`
+        cursor is only opened if a term is not in the cache.
         '''
+        cache = self._term_cache
         terms = []
-        with self.cur('t:st') as cur:
+        cur = None
+        try:
             for k in bytes(key).split(self.SEP_BYTE):
-                pk_t = cur.get(k)
-                terms.append(self._unpickle(pk_t))
+                term = cache.get(k)
+                if term is None:
+                    if cur is None:
+                        cur = self.cur('t:st')
+                    term = self._load_term(self._term_data(k, cur.get(k)))
+                    # A key read within a R/W transaction may have been
+                    # allocated by that same transaction.
+                    cache.put(k, term, pending=bool(self.is_txn_rw))
+                terms.append(term)
+        finally:
+            if cur is not None:
+                cur.close()
 
         return tuple(terms)
 
@@ -864,8 +3457,10 @@ class LmdbStore(Store):
         '''
         Convert a triple, quad or term into a key.
 
-        The key is the checksum of the pickled object, therefore unique for
-        that object. The hashing algorithm is specified in `KEY_HASH_ALGO`.
+        The key is looked up by the checksum of the canonical serialization of
+        the object, therefore unique for that object. The hashing algorithm is
+        specified in `hash_algo`. Resolved keys are kept in a LRU cache so that
+        frequently used terms are not serialized and hashed over and over.
 
         @param obj (Object) Anything that can be reduced to terms stored in the
         database. Pairs of terms, as well as triples and quads, are expressed
@@ -879,22 +3474,231 @@ class LmdbStore(Store):
         if not isinstance(obj, list) and not isinstance(obj, tuple):
             obj = (obj,)
         key = []
+        cache = self._key_cache
         with self.cur('th:t') as cur:
             for term in obj:
-                tk = cur.get(self._hash(self._pickle(term)))
-                if not tk:
-                    # If any of the terms is not found, return None immediately
-                    return None
+                cache_k = self._cache_key(term)
+                tk = cache.get(cache_k)
+                if tk is None:
+                    tk = cur.get(self._term_hash(term))
+                    if not tk:
+                        # If any of the terms is not found, return None
+                        # immediately.
+                        return None
+                    # A key found within a R/W transaction may have been
+                    # added by that same transaction.
+                    cache.put(
+                            cache_k, tk, pending=bool(self.is_txn_rw),
+                            epoch=self._local.gc_epoch)
                 key.append(tk)
 
         return self.SEP_BYTE.join(key)
 
 
+    @staticmethod
+    def _cache_key(term):
+        '''
+        Key used to cache a term.
+
+        Literals compare equal regardless of the case of their language tag,
+        but they are serialized differently; so the language tag and datatype
+        are made part of the cache key.
+        '''
+        if isinstance(term, Literal):
+            return (Literal, str(term), term.language, term.datatype)
+        return term
+
+
     def _hash(self, s):
         '''
         Get the hash value of a serialized object.
         '''
-        return hashlib.new(self.KEY_HASH_ALGO, s).digest()
+        return self._hash_func(s).digest()
+
+
+    def _term_hash(self, term):
+        '''
+        Get the hash value of a term, used to look up its key in `th:t`.
+        '''
+        return self._hash(self._canonical_term(term))
+
+
+    def _load_compact_term(self, data):
+        '''
+        Deserialize a term in the compact format.
+
+        If the term references a namespace ID that is not known yet, the
+        namespace was registered by another process, and the namespace table
+        is reloaded.
+        '''
+        try:
+            return self._serializer.loads(data)
+        except KeyError:
+            self._load_namespaces(
+                    self.data_txn if self.is_txn_open else None)
+            return self._serializer.loads(data)
+
+
+    def _expand_compact_term(self, data):
+        '''
+        Get the canonical form of a term serialized in the compact format.
+        See `_load_compact_term`.
+        '''
+        try:
+            return self._serializer.expand(data)
+        except KeyError:
+            self._load_namespaces(
+                    self.data_txn if self.is_txn_open else None)
+            return self._serializer.expand(data)
+
+
+    def _object_literal(self, ok, tags, txn=None):
+        '''
+        Load an object term if it is a literal.
+
+        Most objects are not literals, and in the compact term format these
+        are told apart by their type tag without deserializing them.
+
+        @param ok (bytes) Object key.
+        @param tags (tuple(int)) `TermSerializer` type tags of the terms to
+        load. Ignored in the legacy term format.
+        @param txn (lmdb.Transaction | None) Main data transaction to read
+        the term with. If None, the term is taken from the term cache or read
+        within the current transaction.
+
+        @return rdflib.Literal | None
+        '''
+        if txn is None:
+            term = self._term_cache.get(ok)
+            if term is not None:
+                return term if isinstance(term, Literal) else None
+            txn = self.data_txn
+        data = txn.get(ok, db=self.dbs['t:st'])
+        if self.term_format == self.TERM_FORMAT_COMPACT:
+            tag = data[1] if self._is_stub(data) else data[0]
+            if tag not in tags:
+                return None
+        term = self._load_term(self._term_data(ok, data, txn))
+
+        return term if isinstance(term, Literal) else None
+
+
+    def _range_value(self, ok, txn=None):
+        '''
+        Sortable value of an object term for the range index.
+
+        @param ok (bytes) Object key.
+        @param txn (lmdb.Transaction | None) See `_object_literal`.
+
+        @return bytes | None See `sortable_value`.
+        '''
+        term = self._object_literal(ok, (TermSerializer.DT_LITERAL,), txn)
+
+        return None if term is None else sortable_value(term)
+
+
+    def _fulltext_tokens(self, ok, txn=None):
+        '''
+        Tokens of an object term for the full-text index.
+
+        Only plain, language-tagged and `xsd:string` literals are indexed.
+
+        @param ok (bytes) Object key.
+        @param txn (lmdb.Transaction | None) See `_object_literal`.
+
+        @return set(str) See `tokenize`.
+        '''
+        term = self._object_literal(ok, (
+                TermSerializer.LITERAL, TermSerializer.LANG_LITERAL,
+                TermSerializer.DT_LITERAL), txn)
+        if term is None or term.datatype not in (None, XSD.string):
+            return set()
+
+        return tokenize(term)
+
+
+    def _put_terms(self, data):
+        '''
+        Append new serialized terms to `t:st`.
+
+        In the compact format, terms larger than `large_term_size` are
+        compressed into `t:zst` and replaced with a stub in `t:st`.
+
+        This must be called within the main R/W transaction.
+
+        @param data (list(bytes)) Serialized terms.
+
+        @return list(bytes) Keys of the new terms.
+        '''
+        size = (
+                self.large_term_size
+                if self.term_format == self.TERM_FORMAT_COMPACT else 0)
+        with self.cur('t:st') as dcur:
+            keys = self._append(dcur, [
+                    bytes((TermSerializer.LARGE, d[0]))
+                    if size and len(d) > size else d
+                    for d in data], main_txn=True, append=True)
+        if size:
+            large = [
+                    (tk, zlib.compress(d))
+                    for tk, d in zip(keys, data) if len(d) > size]
+            if large:
+                with self.cur('t:zst') as zcur:
+                    zcur.putmulti(large, append=True)
+
+        return keys
+
+
+    def _is_stub(self, data):
+        '''
+        Whether the content of `t:st` for a term is a stub for a large term.
+
+        @param data (bytes | memoryview) Content of `t:st`.
+
+        @return bool
+        '''
+        return (
+                self.term_format == self.TERM_FORMAT_COMPACT
+                and data[0] == TermSerializer.LARGE)
+
+
+    def _term_data(self, tk, data, txn=None):
+        '''
+        Serialized term, decompressed from `t:zst` if it is stored out of
+        line.
+
+        @param tk (bytes) Term key.
+        @param data (bytes | memoryview) Content of `t:st` for the key.
+        @param txn (lmdb.Transaction | None) Main data transaction. If None,
+        the transaction of the current thread is used.
+
+        @return bytes | memoryview
+        '''
+        if not self._is_stub(data):
+            return data
+        if txn is None:
+            txn = self.data_txn
+
+        return zlib.decompress(txn.get(tk, db=self.dbs['t:zst']))
+
+
+    def _ctx_graph(self, uri):
+        '''
+        Get a `Graph` instance for a context URI.
+
+        Graph instances are cached, since creating them is relatively
+        expensive.
+
+        @param uri (rdflib.URIRef) Context URI.
+
+        @return rdflib.Graph
+        '''
+        gr = self._ctx_cache.get(uri)
+        if gr is None:
+            gr = Graph(identifier=uri, store=self)
+            self._ctx_cache.put(uri, gr)
+
+        return gr
 
 
     def _normalize_context(self, context):
@@ -913,20 +3717,22 @@ class LmdbStore(Store):
         return context
 
 
-    def _lookup(self, triple_pattern):
+    def _lookup(self, key_pattern):
         '''
-        Look up triples in the indices based on a triple pattern.
+        Look up triples in the indices based on a pattern of term keys.
+
+        @param key_pattern (tuple) Three term keys, or None for unbound terms.
 
         @return iterator of matching triple keys.
         '''
-        s, p, o = triple_pattern
+        s, p, o = key_pattern
 
         if s is not None:
             if p is not None:
                 # s p o
                 if o is not None:
                     with self.cur('spo:c') as cur:
-                        tkey = self._to_key(triple_pattern)
+                        tkey = self.SEP_BYTE.join(key_pattern)
                         if cur.set_key(tkey):
                             yield tkey
                             return
@@ -958,20 +3764,20 @@ class LmdbStore(Store):
                 else:
                     # Get all triples in the database.
                     with self.cur('spo:c') as cur:
-                        yield from cur.iternext_nodup()
+                        yield from map(bytes, cur.iternext_nodup())
 
 
-    def _lookup_1bound(self, label, term):
+    def _lookup_1bound(self, label, k):
         '''
         Lookup triples for a pattern with one bound term.
 
         @TODO This can be called millions of times in a larger SPARQL
         query, so it better be as efficient as it gets.
+
+        @param label (string) Position of the bound term: `s`, `p` or `o`.
+        @param k (bytes) Key of the bound term.
         '''
         #import pdb; pdb.set_trace()
-        k = self._to_key(term)
-        if not k:
-            return iter(())
         idx_name = '{}:{}'.format(label, 'spo'.replace(label, ''))
         term_order = self._lookup_ordering[idx_name]
         with self.cur(idx_name) as cur:
@@ -992,9 +3798,9 @@ class LmdbStore(Store):
         '''
         Look up triples for a pattern with two bound terms.
 
-        @param bound terms (dict) Triple labels and terms to search for,
-        in the format of, e.g. {'s': URIRef('urn:s:1'), 'o':
-        URIRef('urn:o:1')}
+        @param bound terms (dict) Triple labels and term keys to search for,
+        in the format of, e.g. {'s': b'\x02\x02\x02\x02\x03', 'o':
+        b'\x02\x02\x02\x02\x05'}
         '''
         #import pdb; pdb.set_trace()
         if len(bound_terms) != 2:
@@ -1002,97 +3808,156 @@ class LmdbStore(Store):
                     'Exactly 2 terms need to be bound. Got {}'.format(
                         len(bound_terms)))
 
-        # Establish lookup ranking.
-        luc = None
-        for k_label in self._lookup_rank:
-            if k_label in bound_terms.keys():
-                # First match is lookup term.
-                if not luc:
-                    v_label = 'spo'.replace(k_label, '')
-                    # Lookup database key (cursor) name
-                    luc = k_label + ':' + v_label
-                    term_order = self._lookup_ordering[luc]
-                    # Term to look up
-                    luk = self._to_key(bound_terms[k_label])
-                    if not luk:
-                        return iter(())
-                    # Position of key in final triple.
-                # Second match is the filter.
-                else:
-                    # Filter key (position of sub-key in lookup results)
-                    fpos = v_label.index(k_label)
-                    # Fliter term
-                    ft = self._to_key(bound_terms[k_label])
-                    if not ft:
-                        return iter(())
-                    break
+        if self.composite_indices:
+            yield from self._lookup_composite(bound_terms)
+            return
+
+        # Position a cursor on the index of each bound term. The one with
+        # fewer entries for the term is looked up and its results are filtered
+        # by the other term.
+        with ExitStack() as stack:
+            lookups = []
+            for k_label, k in bound_terms.items():
+                luc = '{}:{}'.format(k_label, 'spo'.replace(k_label, ''))
+                cur = stack.enter_context(self.cur(luc))
+                if not cur.set_key(k):
+                    return
+                lookups.append((
+                    cur.count(), self._lookup_rank.index(k_label),
+                    k_label, luc, k, cur))
+            lookups.sort(key=lambda l: l[:2])
+            (_, _, k_label, luc, luk, cur), (_, _, f_label, _, ft, _) = (
+                    lookups)
+            self._lookup_stats[luc] += 1
+
+            term_order = self._lookup_ordering[luc]
+            # Filter key (position of sub-key in lookup results)
+            fpos = 'spo'.replace(k_label, '').index(f_label)
+
+            # Iterate over matches and filter by second term.
+            for match in cur.iternext_dup():
+                subkeys = bytes(match).split(self.SEP_BYTE)
+                flt_subkey = subkeys[fpos]
+                if flt_subkey == ft:
+                    # Remainder (not filter) key used to complete the
+                    # triple.
+                    r_subkey = subkeys[1-fpos]
+
+                    # Compose result.
+                    out = [None, None, None]
+                    out[term_order[0]] = luk
+                    out[term_order[fpos+1]] = flt_subkey
+                    out[term_order[2-fpos]] = r_subkey
+
+                    yield self.SEP_BYTE.join(out)
+
+
+    def _lookup_composite(self, bound_terms):
+        '''
+        Look up triples for a pattern with two bound terms in the composite
+        indices.
+
+        @param bound terms (dict) Triple labels and term keys to search for.
+        See `_lookup_2bound`.
+        '''
+        labels = tuple(l for l in 'spo' if l in bound_terms)
+        luc = self._composite_lookup[labels]
+        term_order = self._lookup_ordering[luc]
+        k1, k2 = (bound_terms[l] for l in labels)
+        luk = k1 + self.SEP_BYTE + k2
 
-        # Look up in index.
         with self.cur(luc) as cur:
             if cur.set_key(luk):
-                # Iterate over matches and filter by second term.
-                for match in cur.iternext_dup():
-                    subkeys = bytes(match).split(self.SEP_BYTE)
-                    flt_subkey = subkeys[fpos]
-                    if flt_subkey == ft:
-                        # Remainder (not filter) key used to complete the
-                        # triple.
-                        r_subkey = subkeys[1-fpos]
+                for rk in cur.iternext_dup():
+                    # Compose result.
+                    out = [None, None, None]
+                    out[term_order[0]] = k1
+                    out[term_order[1]] = k2
+                    out[term_order[2]] = bytes(rk)
 
-                        # Compose result.
-                        out = [None, None, None]
-                        out[term_order[0]] = luk
-                        out[term_order[fpos+1]] = flt_subkey
-                        out[term_order[2-fpos]] = r_subkey
+                    yield self.SEP_BYTE.join(out)
 
-                        yield self.SEP_BYTE.join(out)
 
-    def _append(self, cur, values, **kwargs):
+    def _append(self, cur, values, main_txn=False, **kwargs):
         '''
         Append one or more values to the end of a database.
 
+        Keys are allocated after the last key in the database. Within the
+        main R/W transaction, the last key is only looked up once, and
+        subsequent allocations continue from its position kept in memory.
+        This is only valid for `t:st`, which is the only database that
+        values are appended to.
+
         @param cur (lmdb.Cursor) The write cursor to act on.
         @param data (list(bytes)) Value(s) to append.
+        @param main_txn (bool) Whether the cursor is a `t:st` cursor of the
+        main R/W transaction of the current thread.
 
-        @return list(bytes) Last key(s) inserted.
+        @return list(bytes) Key(s) inserted.
         '''
         if not isinstance(values, list) and not isinstance(values, tuple):
             raise ValueError('Input must be a list or tuple.')
-        data = []
-        lastkey = cur.key() if cur.last() else None
-        for v in values:
-            lastkey = self._key_seq.next(lastkey)
-            data.append((lastkey, v))
+        pos = self._local.term_key_pos if main_txn else None
+        if pos is None:
+            # As with `LexicalSequence.next()`, the first key is not used.
+            pos = self._key_seq.to_int(cur.key()) if cur.last() else 0
+        keys = self._key_seq.range(pos + 1, len(values))
 
-        cur.putmulti(data, **kwargs)
+        cur.putmulti(list(zip(keys, values)), **kwargs)
+        if main_txn:
+            self._local.term_key_pos = pos + len(values)
 
-        return [d[0] for d in data]
+        return keys
 
 
-    def _index_triple(self, action, spok):
+    def _index_entries(self, spok):
         '''
-        Update index for a triple and context (add or remove).
+        Build the lookup index entries for a triple key.
 
-        @param action (string) 'add' or 'remove'.
         @param spok (bytes) Triple key.
-        indexed. Context MUST be specified for 'add'.
+
+        @return list(tuple) Pairs of index label and (key, value) tuple. The
+        full-text index may have several entries for a triple.
         '''
         # Split and rearrange-join keys for association and indices.
-        triple = bytes(spok).split(self.SEP_BYTE)
-        sk, pk, ok = triple
-        spk = self.SEP_BYTE.join(triple[:2])
-        sok = bytes(triple[0]) + self.SEP_BYTE + bytes(triple[2])
-        pok = self.SEP_BYTE.join(triple[1:3])
+        spok = bytes(spok)
+        sk, pk, ok = spok.split(self.SEP_BYTE)
 
         # Associate cursor labels with k/v pairs.
-        curs = {
-            's:po': (sk, pok),
-            'p:so': (pk, sok),
-            'o:sp': (ok, spk),
-        }
+        entries = [
+            ('s:po', (sk, pk + self.SEP_BYTE + ok)),
+            ('p:so', (pk, sk + self.SEP_BYTE + ok)),
+            ('o:sp', (ok, sk + self.SEP_BYTE + pk)),
+        ]
+        if self.composite_indices:
+            entries.extend([
+                ('sp:o', (sk + self.SEP_BYTE + pk, ok)),
+                ('po:s', (pk + self.SEP_BYTE + ok, sk)),
+                ('so:p', (sk + self.SEP_BYTE + ok, pk)),
+            ])
+        if self.range_index:
+            val = self._range_value(ok)
+            if val is not None:
+                entries.append(('pv:so', (
+                        pk + self.SEP_BYTE + val, sk + self.SEP_BYTE + ok)))
+        if self.fulltext_index:
+            entries.extend(
+                    ('tk:spo', (s2b(tk), spok))
+                    for tk in self._fulltext_tokens(ok))
+
+        return entries
+
+
+    def _index_triple(self, action, spok):
+        '''
+        Update index for a triple and context (add or remove).
 
+        @param action (string) 'add' or 'remove'.
+        @param spok (bytes) Triple key.
+        indexed. Context MUST be specified for 'add'.
+        '''
         # Add or remove triple lookups.
-        for clabel, terms in curs.items():
+        for clabel, terms in self._index_entries(spok):
             with self.cur(clabel) as icur:
                 if action == 'remove':
                     if icur.set_key_dup(*terms):
@@ -1104,6 +3969,240 @@ class LmdbStore(Store):
                         'Index action \'{}\' is not supported.'.format(action))
 
 
+    def _index_triples(self, spoks):
+        '''
+        Add lookup index entries for multiple triples.
+
+        Entries are grouped by index and each index is written with a single
+        sorted `putmulti` call.
+
+        @param spoks (iterable(bytes)) Triple keys.
+        '''
+        entries = {}
+        for spok in spoks:
+            for clabel, terms in self._index_entries(spok):
+                entries.setdefault(clabel, []).append(terms)
+
+        for clabel, items in entries.items():
+            with self.cur(clabel) as icur:
+                icur.putmulti(sorted(items))
+
+
+    def _update_counts(self, spocs, delta):
+        '''
+        Update the `cp:n` counters for added or removed triple:context
+        associations.
+
+        @param spocs (iterable(tuple(bytes))) Triple and context key pairs.
+        @param delta (int) 1 for added associations, -1 for removed ones.
+        '''
+        deltas = {}
+        for spok, ck in spocs:
+            cpk = ck + self.SEP_BYTE + spok.split(self.SEP_BYTE)[1]
+            deltas[cpk] = deltas.get(cpk, 0) + delta
+
+        with self.cur('cp:n') as cur:
+            for cpk, d in sorted(deltas.items()):
+                ct = cur.get(cpk)
+                ct = (int.from_bytes(ct, 'big') if ct else 0) + d
+                if ct > 0:
+                    cur.put(cpk, ct.to_bytes(8, 'big'))
+                elif cur.key() == cpk:
+                    cur.delete()
+
+
+    def _update_refs(self, spocs, add):
+        '''
+        Update the `o:cps` reverse reference index for added or removed
+        triple:context associations.
+
+        @param spocs (iterable(tuple(bytes))) Triple and context key pairs.
+        Only the triples with a URI object must be given when adding. When
+        removing, entries that are not in the index are skipped.
+        @param add (bool) Whether the associations were added or removed.
+        '''
+        entries = sorted(self._ref_entry(spok, ck) for spok, ck in spocs)
+        if not entries:
+            return
+        with self.cur('o:cps') as cur:
+            if add:
+                cur.putmulti(entries)
+            else:
+                for ok, cpsk in entries:
+                    if cur.set_key_dup(ok, cpsk):
+                        cur.delete()
+
+
+    def _ref_entry(self, spok, ck):
+        '''
+        Entry of the `o:cps` index for a triple:context association.
+
+        @param spok (bytes) Triple key.
+        @param ck (bytes) Context key.
+
+        @return tuple(bytes) Object key and joined context, predicate and
+        subject keys.
+        '''
+        sk, pk, ok = spok.split(self.SEP_BYTE)
+
+        return ok, self.SEP_BYTE.join((ck, pk, sk))
+
+
+    def _is_ref_ck(self, ck, txn=None):
+        '''
+        Whether the references from a context are kept in the `o:cps` index,
+        by context key.
+
+        @param ck (bytes) Context key.
+        @param txn (lmdb.Transaction | None) See `_object_literal`.
+
+        @return bool
+        '''
+        if self.ref_context_filter is None:
+            return True
+        if txn is None:
+            txn = self.data_txn
+
+        return self._is_ref_context(self._load_term(self._term_data(
+                ck, txn.get(ck, db=self.dbs['t:st']), txn)))
+
+
+    def _update_closure(self, spocs, add):
+        '''
+        Update the `a:d` and `d:a` closure indices for added or removed
+        triple:context associations.
+
+        For each added or removed relationship, the object and the terms
+        reachable from it are linked to, or unlinked from, the subject and
+        the terms leading to it. Relationships are applied one at a time,
+        since each one may depend on the previous ones.
+
+        @param spocs (iterable(tuple(bytes))) Triple and context key pairs.
+        Only the associations with contexts accepted by `ref_context_filter`
+        must be given when adding. When removing, a relationship is only
+        unlinked if no other accepted context holds it.
+        @param add (bool) Whether the associations were added or removed.
+        '''
+        if self.closure_predicate is None:
+            return
+        pk = self._to_key(self.closure_predicate)
+        if pk is None:
+            return
+        sep = self.SEP_BYTE
+
+        rels = []
+        for spok, ck in spocs:
+            sk, tpk, ok = spok.split(sep)
+            if tpk != pk:
+                continue
+            if not add:
+                if not self._is_ref_ck(ck):
+                    continue
+                with self.cur('spo:c') as cur:
+                    if cur.set_key(spok) and any(
+                            self._is_ref_ck(bytes(tck))
+                            for tck in cur.iternext_dup()):
+                        continue
+            rels.append((sk, ok))
+        if not rels:
+            return
+
+        with self.cur('a:d') as ad_cur, self.cur('d:a') as da_cur:
+            for sk, ok in rels:
+                ancestors = [sk]
+                if da_cur.set_key(sk):
+                    ancestors.extend(map(bytes, da_cur.iternext_dup()))
+                descendants = [ok]
+                if ad_cur.set_key(ok):
+                    descendants.extend(map(bytes, ad_cur.iternext_dup()))
+                if add:
+                    ad_cur.putmulti(
+                            sorted((ak, dk) for ak in ancestors
+                                for dk in descendants), dupdata=False)
+                    da_cur.putmulti(
+                            sorted((dk, ak) for ak in ancestors
+                                for dk in descendants), dupdata=False)
+                else:
+                    for ak in ancestors:
+                        for dk in descendants:
+                            if ad_cur.set_key_dup(ak, dk):
+                                ad_cur.delete()
+                            if da_cur.set_key_dup(dk, ak):
+                                da_cur.delete()
+
+
+    def _closure_entries(self, spocs, reverse, pk, txn):
+        '''
+        Entries of the closure indices, built from all the triples of the
+        store.
+
+        The relationships of the closure predicate are gathered in memory,
+        then walked down from the terms that have no parent.
+
+        @param spocs (iterable(tuple(bytes))) Triple and context key pairs.
+        @param reverse (bool) Whether to build `d:a` entries rather than
+        `a:d` ones.
+        @param pk (bytes | None) Key of the closure predicate. If None, no
+        entries are built.
+        @param txn (lmdb.Transaction) Main data transaction.
+
+        @return generator(tuple(bytes))
+        '''
+        if pk is None:
+            return
+        sep = self.SEP_BYTE
+        children = defaultdict(set)
+        for spok, ck in spocs:
+            sk, tpk, ok = spok.split(sep)
+            if tpk == pk and self._is_ref_ck(ck, txn):
+                children[sk].add(ok)
+
+        has_parent = set(chain.from_iterable(children.values()))
+        stack = [(sk, ()) for sk in children if sk not in has_parent]
+        while stack:
+            k, ancestors = stack.pop()
+            ancestors += (k,)
+            for ck in children.get(k, ()):
+                for ak in ancestors:
+                    yield (ck, ak) if reverse else (ak, ck)
+                stack.append((ck, ancestors))
+
+
+    def _is_ref_context(self, ctx_uri):
+        '''
+        Whether the references from a context are kept in the `o:cps` index.
+
+        @param ctx_uri (rdflib.URIRef) Context URI.
+
+        @return bool
+        '''
+        return (
+                self.ref_context_filter is None
+                or bool(self.ref_context_filter(ctx_uri)))
+
+
+    def _is_uri(self, tk, txn=None):
+        '''
+        Whether a term is a URI.
+
+        In the compact term format, this is told by the type tag of the term
+        without deserializing it.
+
+        @param tk (bytes) Term key.
+        @param txn (lmdb.Transaction | None) See `_object_literal`.
+
+        @return bool
+        '''
+        if txn is None:
+            txn = self.data_txn
+        data = txn.get(tk, db=self.dbs['t:st'])
+        if self.term_format == self.TERM_FORMAT_COMPACT:
+            tag = data[1] if self._is_stub(data) else data[0]
+            return tag in (TermSerializer.URI, TermSerializer.NS_URI)
+
+        return isinstance(self._load_term(data), URIRef)
+
+
     ## Convenience methods—not necessary for functioning but useful for
     ## debugging.
 
@@ -1134,6 +4233,6 @@ class LmdbStore(Store):
         with self.cur('spo:c') as cur:
             if cur.set_key(tkey):
                 ctx = cur.iternext_dup()
-                return {self._unpickle(c) for c in ctx}
+                return {self._from_key(c)[0] for c in ctx}
             else:
                 return set()
@@ -1,11 +1,11 @@
 import logging
 
 from collections import defaultdict
-from itertools import chain
+from itertools import chain, islice
 
 from rdflib import Dataset, Graph, Literal, URIRef, plugin
 from rdflib.namespace import RDF
-from rdflib.query import ResultException
+from rdflib.plugins.sparql import CUSTOM_EVALS
 from rdflib.resource import Resource
 from rdflib.store import Store
 
@@ -13,10 +13,12 @@ from lakesuperior.dictionaries.namespaces import ns_collection as nsc
 from lakesuperior.dictionaries.namespaces import ns_mgr as nsm
 from lakesuperior.dictionaries.srv_mgd_terms import  srv_mgd_subjects, \
         srv_mgd_predicates, srv_mgd_types
-from lakesuperior.exceptions import (InvalidResourceError,
-        ResourceNotExistsError, TombstoneError, PathSegmentError)
+from lakesuperior.exceptions import (InvalidPageError,
+        InvalidResourceError, ResourceNotExistsError, TombstoneError,
+        PathSegmentError)
 from lakesuperior.env import env
-from lakesuperior.store.ldp_rs.lmdb_store import TxnManager
+from lakesuperior.store.ldp_rs.lmdb_store import TxnManager, sortable_value
+from lakesuperior.store.ldp_rs.sparql_eval import eval_bgp
 
 
 META_GR_URI = nsc['fcsystem']['meta']
@@ -26,6 +28,8 @@ VERS_CONT_LABEL = 'fcr:versions'
 
 Lmdb = plugin.register('Lmdb', Store,
         'lakesuperior.store.ldp_rs.lmdb_store', 'LmdbStore')
+# Basic graph patterns over the LMDB store are evaluated natively.
+CUSTOM_EVALS['lmdb_bgp'] = eval_bgp
 logger = logging.getLogger(__name__)
 
 
@@ -122,7 +126,12 @@ class RsrcCentricLayout:
         which is currently the reference implementation.
         '''
         self.config = config
-        self.store = plugin.get('Lmdb', Store)(config['location'])
+        # Only the references and the containment relationships of live
+        # resources are indexed.
+        self.store = plugin.get('Lmdb', Store)(
+                config['location'], ref_context_filter=self._is_live_graph,
+                closure_predicate=nsc['ldp'].contains,
+                **config.get('lmdb', {}))
         self.ds = Dataset(self.store, default_union=True)
         self.ds.namespace_manager = nsm
 
@@ -177,6 +186,9 @@ class RsrcCentricLayout:
         logger.info('Initializing the graph store with system data.')
         store.open()
         with TxnManager(store, True):
+            # Registers the namespaces for compressing stored URIs.
+            for pfx, ns in nsm.namespaces():
+                store.bind(pfx, ns)
             with open('data/bootstrap/rsrc_centric_layout.sparql', 'r') as f:
                 self.ds.update(f.read())
 
@@ -200,14 +212,17 @@ class RsrcCentricLayout:
         '''
         Return a count of first-class resources, subdivided in "live" and
         historic snapshots.
+
+        Each resource graph has exactly one `foaf:primaryTopic` statement in
+        the metadata graph, so the counts are read from the store counters
+        without scanning the graphs.
         '''
-        with TxnManager(self.ds.store) as txn:
-            main = set(
-                    self.ds.graph(META_GR_URI)[ : nsc['foaf'].primaryTopic : ])
-            hist = set(
-                    self.ds.graph(HIST_GR_URI)[ : nsc['foaf'].primaryTopic : ])
+        store = self.ds.store
+        with TxnManager(store) as txn:
+            main = store.count_context(META_GR_URI, nsc['foaf'].primaryTopic)
+            hist = store.count_context(HIST_GR_URI, nsc['foaf'].primaryTopic)
 
-        return {'main': len(main), 'hist': len(hist)}
+        return {'main': main, 'hist': hist}
 
 
     def raw_query(self, qry_str):
@@ -232,13 +247,16 @@ class RsrcCentricLayout:
         if not incl_children:
             graphs.remove(nsc['fcstruct'][uid])
 
-        rsrc_graphs = [
-                self.ds.graph(gr)
-                for gr in graphs]
-        resultset = set(chain.from_iterable(rsrc_graphs))
-
+        # Read the triples of all the resource graphs straight from the
+        # context index and add them to the in-memory store of the result,
+        # without building intermediate graphs.
+        cks = [ck for ck in map(self.store.to_key, graphs) if ck]
         gr = Graph()
-        gr += resultset
+        add = gr.store.add
+        for trp in self.store.from_triple_keys(chain.from_iterable(
+                self.store.triple_keys((None, None, None), ck)
+                for ck in cks)):
+            add(trp, gr)
 
         # Include inbound relationships.
         if incl_inbound and len(gr):
@@ -255,14 +273,63 @@ class RsrcCentricLayout:
         return rsrc
 
 
+    def get_struct_page(self, uid, page_size, page=None, ver_uid=None):
+        '''
+        Get a page of the structure triples of a resource, e.g. its
+        `ldp:contains` triples.
+
+        Pages are read in the order of the structure graph index, each one
+        starting after the last triple of the previous one, so the other
+        triples of the graph are not read.
+
+        @param uid (string) Resource UID.
+        @param page_size (int) Maximum number of triples in the page.
+        @param page (string | None) Token of the page, as returned for the
+        previous page. If None, the first page is returned.
+        @param ver_uid (string | None) Version UID.
+
+        @return tuple(list(tuple), string | None) Triples of the page and
+        token of the next page, or None if this is the last page.
+
+        @raise InvalidPageError If the page token is malformed.
+        '''
+        if ver_uid:
+            uid = self.snapshot_uid(uid, ver_uid)
+        start = None
+        if page:
+            try:
+                start = bytes.fromhex(page)
+            except ValueError:
+                start = None
+            if start is None or len(start) != 3 * self.store.KEY_LENGTH + 2:
+                raise InvalidPageError(page)
+
+        ck = self.store.to_key(nsc['fcstruct'][uid])
+        if ck is None:
+            return [], None
+        spoks = list(islice(
+                self.store.context_triple_keys(ck, start), page_size + 1))
+        next_page = (
+                spoks[page_size - 1].hex() if len(spoks) > page_size
+                else None)
+
+        return (
+                list(self.store.from_triple_keys(spoks[:page_size])),
+                next_page)
+
+
     def ask_rsrc_exists(self, uid):
         '''
         See base_rdf_layout.ask_rsrc_exists.
         '''
         logger.debug('Checking if resource exists: {}'.format(uid))
-        meta_gr = self.ds.graph(nsc['fcadmin'][uid])
-        return bool(
-                meta_gr[nsc['fcres'][uid] : RDF.type : nsc['fcrepo'].Resource])
+        ck = self.store.to_key(nsc['fcadmin'][uid])
+        key_pattern = self.store.to_key_pattern(
+                (nsc['fcres'][uid], RDF.type, nsc['fcrepo'].Resource))
+        if ck is None or key_pattern is None:
+            return False
+
+        return self.store.exists(key_pattern, ck)
 
 
     def get_metadata(self, uid, ver_uid=None, strict=True):
@@ -285,34 +352,46 @@ class RsrcCentricLayout:
     def get_version_info(self, uid, strict=True):
         '''
         Get all metadata about a resource's versions.
+
+        The versions are looked up by key in the admin graph of the resource,
+        and the metadata of each version in the historic metadata graph.
+        All the triples are decoded at once.
         '''
         # @NOTE This pretty much bends the ontology—it replaces the graph URI
         # with the subject URI. But the concepts of data and metadata in Fedora
         # are quite fluid anyways...
-        # WIP—Is it worth to replace SPARQL here?
-        #versions = self.ds.graph(nsc['fcadmin'][uid]).triples(
-        #        (nsc['fcres'][uid], nsc['fcrepo'].hasVersion, None))
-        #for version in versions:
-        #    version_meta = self.ds.graph(HIST_GRAPH_URI).triples(
-        qry = '''
-        CONSTRUCT {
-          ?s fcrepo:hasVersion ?v .
-          ?v ?p ?o .
-        } {
-          GRAPH ?ag {
-            ?s fcrepo:hasVersion ?v .
-          }
-          GRAPH ?hg {
-            ?vm foaf:primaryTopic ?v .
-            ?vm  ?p ?o .
-            FILTER (?o != ?v)
-          }
-        }'''
-        gr = self._parse_construct(qry, init_bindings={
-            'ag': nsc['fcadmin'][uid],
-            'hg': HIST_GR_URI,
-            's': nsc['fcres'][uid]})
-        rsrc = Resource(gr, nsc['fcres'][uid])
+        store = self.store
+        sep = store.SEP_BYTE
+        uri = nsc['fcres'][uid]
+        sk, hv_k, ptopic_k, ag_ck, hist_ck = map(store.to_key, (
+                uri, nsc['fcrepo'].hasVersion, nsc['foaf'].primaryTopic,
+                nsc['fcadmin'][uid], HIST_GR_URI))
+
+        trp_keys = []
+        if None not in (sk, hv_k, ptopic_k, ag_ck, hist_ck):
+            for spok in store.triple_keys((sk, hv_k, None), ag_ck):
+                vk = spok.split(sep)[2]
+                # The metadata of each graph of the version become properties
+                # of the version itself.
+                ver_keys = []
+                for vm_spok in store.triple_keys(
+                        (None, ptopic_k, vk), hist_ck):
+                    vmk = vm_spok.split(sep)[0]
+                    for meta_spok in store.triple_keys(
+                            (vmk, None, None), hist_ck):
+                        _, pk, ok = meta_spok.split(sep)
+                        if ok != vk:
+                            ver_keys.append(sep.join((vk, pk, ok)))
+                # Versions without metadata are left out.
+                if ver_keys:
+                    trp_keys.append(spok)
+                    trp_keys.extend(ver_keys)
+
+        gr = Graph()
+        add = gr.store.add
+        for trp in store.from_triple_keys(trp_keys):
+            add(trp, gr)
+        rsrc = Resource(gr, uri)
         # @TODO Should return a graph.
         if strict:
             self._check_rsrc_status(rsrc)
@@ -334,29 +413,201 @@ class RsrcCentricLayout:
         @return iterator(tuple(rdflib.term.Identifier) | rdflib.URIRef)
         Inbound triples or subjects.
         '''
-        # Only return non-historic graphs.
-        meta_gr = self.ds.graph(META_GR_URI)
-        ptopic_uri = nsc['foaf'].primaryTopic
+        store = self.store
+        ok = store.to_key(subj_uri)
+        if ok is None:
+            return
+
+        # The reverse reference index only holds the references from the
+        # graphs of live resources (see `_is_live_graph`), so this is a
+        # single range read. The keys are read before any term is decoded; a
+        # triple found in more than one graph is returned once.
+        spoks = list(dict.fromkeys(spok for ck, spok in store.ref_keys(ok)))
+        if full_triple:
+            yield from store.from_triple_keys(spoks)
+        else:
+            for spok in spoks:
+                yield store.from_key(spok[:store.KEY_LENGTH])[0]
+
+
+    def _is_live_graph(self, gr_uri):
+        '''
+        Whether a graph holds data of a current (non-historic) resource.
+
+        This is the filter of the store reverse reference index.
+
+        @param gr_uri (rdflib.URIRef) Graph URI.
+
+        @return boolean
+        '''
+        gr_uri = str(gr_uri)
+        for pfx in self.graph_ns_types:
+            if gr_uri.startswith(pfx):
+                return VERS_CONT_LABEL not in gr_uri[len(pfx):]
+
+        return False
+
+
+    def term_search(self, pred, cmp, term, limit=None, offset=0):
+        '''
+        Find the resources with a property matching a term.
+
+        Historic version snapshots are excluded.
+
+        Literals that can be compared by value (see
+        `lmdb_store.sortable_value`) are looked up in the range index of the
+        store if it is enabled, so that e.g. `"1.0"^^xsd:decimal` equals
+        `"1"^^xsd:integer`. Other terms are compared by identity.
+
+        @param pred (rdflib.URIRef) Property. Ignored for the `a` operator.
+        @param cmp (string) Comparison operator: `=`, `>`, `<`, `<>`, or
+        `a` to match the RDF type. `>` and `<` require the range index.
+        @param term (rdflib.term.Identifier) Term to compare to.
+        @param limit (int | None) Maximum number of results. If None, all
+        results are returned.
+        @param offset (int) Number of results to skip.
+
+        @return list(rdflib.URIRef) Resource URIs. Results of range lookups
+        are ordered by value.
+
+        @raise ValueError If the operator is not supported or the term
+        cannot be compared with it.
+        @raise RuntimeError If a range lookup is needed and the range index is
+        not enabled.
+        '''
+        store = self.store
+        sep = store.SEP_BYTE
+        if cmp == 'a':
+            pred, cmp = RDF.type, '='
+        if cmp not in ('=', '>', '<', '<>'):
+            raise ValueError(
+                    'Comparison operator `{}` is not supported.'.format(cmp))
+        ranged = store.range_index and sortable_value(term) is not None
 
-        yield from (
-            (match[:3] if full_triple else match[0])
-            for match in self.ds.quads((None, None, subj_uri, None))
-            if set(meta_gr[ : ptopic_uri : match[0]])
-        )
+        pk = store.to_key(pred)
+        if pk is None:
+            return []
+
+        if cmp == '>':
+            spoks = store.range_triple_keys(pk, start=term, incl_start=False)
+        elif cmp == '<':
+            spoks = store.range_triple_keys(pk, end=term, incl_end=False)
+        elif ranged:
+            if cmp == '=':
+                spoks = store.range_triple_keys(pk, term, term)
+            else:
+                spoks = chain(
+                        store.range_triple_keys(pk, end=term, incl_end=False),
+                        store.range_triple_keys(
+                            pk, start=term, incl_start=False))
+        else:
+            ok = store.to_key(term)
+            if cmp == '=':
+                spoks = (
+                        () if ok is None
+                        else store.triple_keys((None, pk, ok)))
+            else:
+                spoks = (
+                        spok for spok in store.triple_keys((None, pk, None))
+                        if spok.split(sep)[2] != ok)
+
+        return self._live_page(
+                (spok.split(sep)[0] for spok in spoks), limit, offset)
+
+
+    def fulltext_search(self, text, pred=None, limit=None, offset=0):
+        '''
+        Find the resources with string literals containing the words of a
+        text, ranked by relevance.
+
+        Historic version snapshots are excluded. See
+        `LmdbStore.fulltext_search` for the ranking.
+
+        @param text (str) Search text.
+        @param pred (rdflib.URIRef | None) Property. If given, only the
+        literals of this property are searched.
+        @param limit (int | None) Maximum number of results. If None, all
+        results are returned.
+        @param offset (int) Number of results to skip.
+
+        @return list(rdflib.URIRef) Resource URIs, most relevant first.
+
+        @raise RuntimeError If the full-text index is not enabled.
+        '''
+        store = self.store
+        if pred is None:
+            pk = None
+        else:
+            pk = store.to_key(pred)
+            if pk is None:
+                return []
+
+        return self._live_page(
+                (sk for sk, score in store.fulltext_search(text, pk)),
+                limit, offset)
 
 
     def get_descendants(self, uid, recurse=True):
         '''
         Get descendants (recursive children) of a resource.
 
+        The recursive descendants are read from the store closure index of
+        `ldp:contains`. All the keys are read at once, so the result is not
+        affected by changes made while it is being iterated; the terms are
+        decoded as the result is iterated. Until the index is built for a
+        repository created with an earlier version, the containment
+        hierarchy is walked instead.
+
         @param uid (string) Resource UID.
-        result set.
+        @param recurse (bool) Whether to get all descendants or only the
+        direct children.
 
         @return iterator(rdflib.URIRef) Subjects of descendant resources.
         '''
         ds = self.ds
         subj_uri = nsc['fcres'][uid]
         ctx_uri = nsc['fcstruct'][uid]
+        if not recurse:
+            return ds.graph(ctx_uri)[subj_uri : nsc['ldp'].contains : ]
+
+        store = self.store
+        if not store.closure_ready:
+            return self._walk_descendants(uid)
+        sk = store.to_key(subj_uri)
+        dks = list(store.closure_keys(sk)) if sk else []
+
+        return (store.from_key(dk)[0] for dk in dks)
+
+
+    def count_descendants(self, uid):
+        '''
+        Count the descendants (recursive children) of a resource.
+
+        This is read from the store closure index, without scanning the
+        descendants.
+
+        @param uid (string) Resource UID.
+
+        @return int
+        '''
+        store = self.store
+        if not store.closure_ready:
+            return len(self._walk_descendants(uid))
+        sk = store.to_key(nsc['fcres'][uid])
+
+        return store.count_closure(sk) if sk else 0
+
+
+    def _walk_descendants(self, uid):
+        '''
+        Get the descendants of a resource by walking down the structure
+        graphs.
+
+        @param uid (string) Resource UID.
+
+        @return set(rdflib.URIRef)
+        '''
+        ds = self.ds
         def _recurse(dset, s, p, c):
             new_dset = set(ds.graph(c)[s : p])
             for ss in new_dset:
@@ -366,10 +617,9 @@ class RsrcCentricLayout:
                     _recurse(dset, ss, p, cc)
             return dset
 
-        return (
-            _recurse(set(), subj_uri, nsc['ldp'].contains, ctx_uri)
-            if recurse
-            else ds.graph(ctx_uri)[subj_uri : nsc['ldp'].contains : ])
+        return _recurse(
+                set(), nsc['fcres'][uid], nsc['ldp'].contains,
+                nsc['fcstruct'][uid])
 
 
     def patch_rsrc(self, uid, qry):
@@ -558,17 +808,36 @@ class RsrcCentricLayout:
                         rsrc.value(nsc['fcrepo'].created))
 
 
-    def _parse_construct(self, qry, init_bindings={}):
+    def _live_page(self, sks, limit=None, offset=0):
         '''
-        Parse a CONSTRUCT query and return a Graph.
+        Select a page of distinct subject keys of live resources, i.e. not
+        historic snapshots, and convert them to URIs.
+
+        @param sks (iterable(bytes)) Subject keys.
+        @param limit (int | None) Maximum number of results.
+        @param offset (int) Number of results to skip.
+
+        @return list(rdflib.URIRef)
         '''
-        try:
-            qres = self.ds.query(qry, initBindings=init_bindings)
-        except ResultException:
-            # RDFlib bug: https://github.com/RDFLib/rdflib/issues/775
-            return Graph()
-        else:
-            return qres.graph
+        store = self.store
+        meta_ck = store.to_key(META_GR_URI)
+        ptopic_k = store.to_key(nsc['foaf'].primaryTopic)
+        if meta_ck is None or ptopic_k is None:
+            return []
+
+        def live_subjects():
+            seen = set()
+            for sk in sks:
+                if sk not in seen:
+                    seen.add(sk)
+                    if store.exists((None, ptopic_k, sk), meta_ck):
+                        yield sk
+
+        stop = None if limit is None else offset + limit
+
+        return [
+                store.from_key(sk)[0]
+                for sk in islice(live_subjects(), offset, stop)]
 
 
     def _map_graph_uri(self, t, uid):
@@ -0,0 +1,271 @@
+import logging
+
+from itertools import groupby
+
+from rdflib import BNode, ConjunctiveGraph, Variable
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID as RDFLIB_DEFAULT_GRAPH_URI
+from rdflib.plugins.sparql.sparql import FrozenBindings
+
+from lakesuperior.store.ldp_rs.lmdb_store import LmdbStore
+
+
+logger = logging.getLogger(__name__)
+
+'''
+Estimated cost of looking up a triple pattern for one partial solution,
+relative to the cost of scanning one index entry. A pattern is joined by
+looking it up for each partial solution if that is estimated to be cheaper
+than scanning all its matches and merging them with the partial solutions.
+'''
+LOOKUP_COST = 4
+
+
+def eval_bgp(ctx, part):
+    '''
+    Evaluate a basic graph pattern (BGP) natively in an `LmdbStore`.
+
+    This is meant to be registered in `rdflib.plugins.sparql.CUSTOM_EVALS`.
+    Triple patterns are evaluated in order of the number of index entries
+    for their bound terms, and joined on term keys by sorting and merging
+    the matches, or by looking up each partial solution if there are few of
+    them. Terms are only deserialized for the final solutions, and, if the
+    BGP is directly projected by a SELECT query, only for the projected
+    variables.
+
+    @param ctx (rdflib.plugins.sparql.sparql.QueryContext) Query context.
+    @param part (rdflib.plugins.sparql.parserutils.CompValue) Algebra
+    expression.
+
+    @return generator(rdflib.plugins.sparql.sparql.FrozenBindings)
+
+    @raise NotImplementedError If the expression is not a BGP, or a
+    projection of a BGP, or the graph is not stored in a `LmdbStore`. RDFLib
+    then evaluates the expression with its own implementation.
+    '''
+    if part.name == 'Project' and part.p.name == 'BGP':
+        project = part.PV
+        part = part.p
+    elif part.name == 'BGP':
+        project = None
+    else:
+        raise NotImplementedError()
+    graph = ctx.graph
+    store = getattr(graph, 'store', None)
+    if not isinstance(store, LmdbStore):
+        raise NotImplementedError()
+
+    # Like in `LmdbStore.triples()`, the default graph is the union of all
+    # graphs.
+    if (isinstance(graph, ConjunctiveGraph)
+            or graph.identifier == RDFLIB_DEFAULT_GRAPH_URI):
+        context = None
+    else:
+        context = graph.identifier
+
+    return _eval_bgp(ctx, part.triples, store, context, project)
+
+
+def _eval_bgp(ctx, triples, store, context, project=None):
+    '''
+    Evaluate a BGP. See `eval_bgp`.
+
+    @param ctx (rdflib.plugins.sparql.sparql.QueryContext) Query context.
+    @param triples (list(tuple)) Triple patterns.
+    @param store (LmdbStore) Store.
+    @param context (rdflib.URIRef | None) Context URI, or None for all
+    contexts.
+    @param project (list(rdflib.Variable) | None) Projected variables. If
+    None, all variables are bound in the solutions.
+    '''
+    if context is None:
+        ck = None
+    else:
+        ck = store.to_key(context)
+        if ck is None:
+            return
+
+    # Replace bound terms with their keys.
+    patterns = []
+    for trp in triples:
+        pattern = []
+        for term in trp:
+            if isinstance(term, (Variable, BNode)):
+                val = ctx[term]
+                if val is None:
+                    pattern.append(term)
+                    continue
+                term = val
+            k = store.to_key(term)
+            if k is None:
+                # No triple can match.
+                return
+            pattern.append(k)
+        patterns.append(pattern)
+
+    solutions = _join(store, patterns, ck)
+
+    base = ctx.solution()
+    if project is not None:
+        base = base.project(project)
+        project = set(project)
+    terms = {}
+    for sol in solutions:
+        bindings = list(base.items())
+        for var, k in sol.items():
+            if project is not None and var not in project:
+                continue
+            term = terms.get(k)
+            if term is None:
+                term = terms[k] = store.from_key(k)[0]
+            bindings.append((var, term))
+        yield FrozenBindings(ctx, bindings)
+
+
+def _join(store, patterns, ck):
+    '''
+    Join the matches of a list of triple patterns.
+
+    The pattern with the fewest estimated matches is evaluated first. Each
+    following pattern is chosen among the ones that share a variable with
+    the patterns evaluated so far, again by the fewest matches.
+
+    @param store (LmdbStore) Store.
+    @param patterns (list(list)) Triple patterns, in which bound terms are
+    keys and unbound terms are variables.
+    @param ck (bytes | None) Context key.
+
+    @return list(dict) Solutions, as mappings of variables to term keys.
+    '''
+    remaining = [(_estimate(store, pattern), pattern) for pattern in patterns]
+    solutions = [{}]
+    bound_vars = set()
+    while remaining:
+        candidates = [
+                i for i, (est, pattern) in enumerate(remaining)
+                if bound_vars.intersection(_vars(pattern))]
+        if not candidates:
+            candidates = range(len(remaining))
+        est, pattern = remaining.pop(
+                min(candidates, key=lambda i: remaining[i][0]))
+        shared = [v for v in _vars(pattern) if v in bound_vars]
+
+        if not shared:
+            matches = list(_scan(store, pattern, ck))
+            solutions = [
+                    _merge(sol, match)
+                    for sol in solutions for match in matches]
+        elif len(solutions) * LOOKUP_COST < est:
+            solutions = [
+                    _merge(sol, match) for sol in solutions
+                    for match in _scan(store, [
+                        sol.get(term, term) for term in pattern], ck)]
+        else:
+            solutions = _merge_join(
+                    solutions, list(_scan(store, pattern, ck)), shared)
+        logger.debug('Solutions after joining {}: {}'.format(
+                pattern, len(solutions)))
+
+        if not solutions:
+            break
+        bound_vars.update(_vars(pattern))
+
+    return solutions
+
+
+def _vars(pattern):
+    '''
+    Unbound terms of a pattern.
+
+    @return list(rdflib.Variable | rdflib.BNode)
+    '''
+    return [term for term in pattern if not isinstance(term, bytes)]
+
+
+def _estimate(store, pattern):
+    '''
+    Estimate the number of matches of a pattern.
+
+    The estimate is the smallest number of index entries for any of the
+    bound terms, which can be read without scanning the entries.
+
+    @return int
+    '''
+    keys = [term if isinstance(term, bytes) else None for term in pattern]
+    if all(keys):
+        return 1
+    counts = [
+            store.count([k if j == i else None for j in range(3)])
+            for i, k in enumerate(keys) if k is not None]
+
+    return min(counts) if counts else store.count((None, None, None))
+
+
+def _scan(store, pattern, ck):
+    '''
+    Generator over the matches of a pattern.
+
+    @return generator(dict) Mappings of the unbound terms to term keys.
+    '''
+    key_pattern = [
+            term if isinstance(term, bytes) else None for term in pattern]
+    var_pos = [
+            (i, term) for i, term in enumerate(pattern)
+            if not isinstance(term, bytes)]
+    for spok in store.triple_keys(key_pattern, ck):
+        tkeys = spok.split(store.SEP_BYTE)
+        match = {}
+        for i, var in var_pos:
+            # A variable occurring more than once must match the same term.
+            if match.setdefault(var, tkeys[i]) != tkeys[i]:
+                break
+        else:
+            yield match
+
+
+def _merge(sol, match):
+    '''
+    Merge two compatible solutions into a new one.
+    '''
+    out = sol.copy()
+    out.update(match)
+
+    return out
+
+
+def _merge_join(left, right, shared):
+    '''
+    Join two lists of solutions by sorting and merging them.
+
+    @param left (list(dict)) Solutions.
+    @param right (list(dict)) Solutions.
+    @param shared (list(rdflib.Variable)) Variables bound in both lists.
+
+    @return list(dict)
+    '''
+    def join_key(sol):
+        return tuple(sol[var] for var in shared)
+
+    left.sort(key=join_key)
+    right.sort(key=join_key)
+    out = []
+    lgroups = groupby(left, join_key)
+    rgroups = groupby(right, join_key)
+    try:
+        lk, lgroup = next(lgroups)
+        rk, rgroup = next(rgroups)
+        while True:
+            if lk < rk:
+                lk, lgroup = next(lgroups)
+            elif lk > rk:
+                rk, rgroup = next(rgroups)
+            else:
+                rgroup = list(rgroup)
+                out.extend(
+                        _merge(lsol, rsol)
+                        for lsol in lgroup for rsol in rgroup)
+                lk, lgroup = next(lgroups)
+                rk, rgroup = next(rgroups)
+    except StopIteration:
+        pass
+
+    return out
@@ -119,6 +119,59 @@ class TestLdp:
                 URIRef(g.webroot + '/' + uuid1 + '/e') ]
 
 
+    def test_get_paged(self):
+        '''
+        Retrieve the children of a container in pages.
+        '''
+        path = '/ldp/test_paging'
+        self.client.put(path)
+        for i in range(5):
+            self.client.put('{}/child{}'.format(path, i))
+        uri = URIRef(g.webroot + '/test_paging')
+
+        children = set()
+        next_url = path + '?page_size=2'
+        pages = 0
+        while next_url:
+            resp = self.client.get(next_url)
+            assert resp.status_code == 200
+            links = resp.headers.getlist('Link')
+            assert '<{}>;rel="type"'.format(nsc['ldp'].Page) in links
+            gr = Graph().parse(data=resp.data, format='turtle')
+            assert gr[uri : RDF.type : nsc['ldp'].Container]
+            page_children = set(gr[uri : nsc['ldp'].contains])
+            assert len(page_children) <= 2
+            assert not children & page_children
+            children |= page_children
+            pages += 1
+            next_url = None
+            for link in links:
+                if link.endswith('rel="next"'):
+                    next_url = link[1:link.index('>')].replace(
+                            g.webroot, '/ldp')
+        assert pages == 3
+        assert children == {
+                URIRef('{}/child{}'.format(uri, i)) for i in range(5)}
+
+        resp = self.client.get(path, headers={
+            'prefer' : 'return=representation; max-member-count="3"'})
+        gr = Graph().parse(data=resp.data, format='turtle')
+        assert len(set(gr[uri : nsc['ldp'].contains])) == 3
+
+        assert self.client.get(path + '?page_size=0').status_code == 400
+        assert self.client.get(
+                path + '?page_size=2&page=bogus').status_code == 400
+
+        # Paging links are not carried over to other responses.
+        resp = self.client.get(path + '?page_size=2')
+        assert resp.status_code == 200
+        links = self.client.post(
+                path, data=b'', content_type='text/turtle'
+                ).headers.getlist('Link')
+        assert not any(link.endswith('rel="next"') for link in links)
+        assert '<{}>;rel="type"'.format(nsc['ldp'].Page) not in links
+
+
     def test_put_ldp_rs(self, client):
         '''
         PUT a resource with RDF payload and verify.
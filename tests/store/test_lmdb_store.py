@@ -1,12 +1,18 @@
 import pytest
 
+from os.path import getsize
 from shutil import rmtree
+from threading import Event, Thread
 
-from rdflib import Namespace, URIRef
+from rdflib import BNode, Dataset, Literal, Namespace, URIRef
 from rdflib.graph import DATASET_DEFAULT_GRAPH_ID as RDFLIB_DEFAULT_GRAPH_URI
-from rdflib.namespace import RDF, RDFS
+from rdflib.namespace import RDF, RDFS, XSD
+from rdflib.plugins.sparql import CUSTOM_EVALS
 
-from lakesuperior.store.ldp_rs.lmdb_store import LmdbStore, TxnManager
+from lakesuperior.store.ldp_rs.lmdb_store import (
+        LexicalSequence, LmdbStore, TermSerializer, TxnManager,
+        sortable_value, tokenize)
+from lakesuperior.store.ldp_rs.sparql_eval import eval_bgp
 
 
 @pytest.fixture(scope='class')
@@ -17,6 +23,31 @@ def store():
     rmtree('/tmp/test_lmdbstore')
 
 
+@pytest.fixture
+def open_store(tmpdir):
+    '''
+    Function opening a store in a temporary directory for a single test.
+
+    Keyword arguments are passed to the store, e.g.
+    `open_store(composite_indices=True)`. Calling it again opens the same
+    store, unless a different `path` is given. All the stores opened are
+    closed, and the directory removed, after the test, even if it fails.
+    '''
+    default_path = str(tmpdir.join('store'))
+    stores = []
+
+    def _open(path=default_path, **kwargs):
+        store = LmdbStore(path, **kwargs)
+        stores.append(store)
+        return store
+
+    yield _open
+    for store in stores:
+        if store.is_open:
+            store.close()
+    rmtree(str(tmpdir), ignore_errors=True)
+
+
 def _clean(res):
     return {r[0] for r in res}
 
@@ -178,6 +209,634 @@ class TestBasicOps:
             assert len(res2) == 0
 
 
+class TestLexicalSequence:
+    '''
+    Tests for the key sequence.
+    '''
+    def test_range(self):
+        '''
+        Test that key ranges match the sequence built key by key.
+        '''
+        seq = LexicalSequence(2, 3)
+        keys = []
+        key = None
+        for i in range(70000):
+            key = seq.next(key)
+            keys.append(key)
+        assert seq.range(1, 70000) == keys
+        assert seq.range(600, 3) + seq.range(603, 300) == keys[599:902]
+        assert seq.to_int(keys[-1]) == 70000
+        assert seq.from_int(70000) == keys[-1]
+        with pytest.raises(RuntimeError):
+            seq.range(254 ** 3 - 1, 2)
+
+
+    def test_append_in_txn(self, store):
+        '''
+        Test allocating term keys across calls in one transaction.
+        '''
+        store.begin(True)
+        with store.cur('t:st') as cur:
+            k1 = store._append(cur, [b'\x04a', b'\x04b'], main_txn=True)
+            k2 = store._append(cur, [b'\x04c'], main_txn=True)
+        assert store._key_seq.to_int(k2[0]) == \
+                store._key_seq.to_int(k1[1]) + 1
+        store.rollback()
+
+        # The allocated keys are released on rollback.
+        store.begin(True)
+        with store.cur('t:st') as cur:
+            assert store._append(cur, [b'\x04a'], main_txn=True) == k1[:1]
+        store.rollback()
+
+
+
+@pytest.mark.usefixtures('store')
+class TestBulkOps:
+    '''
+    Tests for bulk operations.
+    '''
+    def test_addN(self, store):
+        '''
+        Test adding quads in bulk.
+        '''
+        gr_uri = URIRef('urn:bulk:g1')
+        gr2_uri = URIRef('urn:bulk:g2')
+        quads = [
+            (URIRef('urn:bulk:s'), URIRef('urn:bulk:p{}'.format(i % 5)),
+                URIRef('urn:bulk:o{}'.format(i)), gr_uri)
+            for i in range(50)]
+        # Duplicates and existing terms.
+        quads += quads[:10]
+        quads.append((
+            URIRef('urn:bulk:s'), URIRef('urn:bulk:p0'),
+            URIRef('urn:bulk:o0'), gr2_uri))
+
+        with TxnManager(store, True) as txn:
+            store.addN(quads)
+
+        with TxnManager(store) as txn:
+            assert store.__len__(gr_uri) == 50
+            assert store.__len__(gr2_uri) == 1
+            res = _clean(store.triples(
+                (URIRef('urn:bulk:s'), URIRef('urn:bulk:p1'), None)))
+            assert len(res) == 10
+            assert (
+                URIRef('urn:bulk:s'), URIRef('urn:bulk:p1'),
+                URIRef('urn:bulk:o1')) in res
+            assert {gr.identifier for gr in store.contexts()} >= {
+                    gr_uri, gr2_uri}
+            assert len(set(store.triples(
+                    (None, None, URIRef('urn:bulk:o0')), gr2_uri))) == 1
+
+        with TxnManager(store, True) as txn:
+            store.remove((URIRef('urn:bulk:s'), None, None))
+        with TxnManager(store) as txn:
+            assert store.__len__(gr_uri) == 0
+
+
+class TestCompositeIdx:
+    '''
+    Tests for the optional composite indices.
+    '''
+    @pytest.fixture
+    def trp(self):
+        return [
+            (URIRef('urn:cidx:s1'), URIRef('urn:cidx:p1'),
+                URIRef('urn:cidx:o1')),
+            (URIRef('urn:cidx:s1'), URIRef('urn:cidx:p1'),
+                URIRef('urn:cidx:o2')),
+            (URIRef('urn:cidx:s1'), URIRef('urn:cidx:p2'),
+                URIRef('urn:cidx:o1')),
+            (URIRef('urn:cidx:s2'), URIRef('urn:cidx:p1'),
+                URIRef('urn:cidx:o1')),
+        ]
+
+
+    def _check_lookups(self, store, trp):
+        with TxnManager(store) as txn:
+            for pattern in (
+                    (trp[0][0], trp[0][1], None),
+                    (None, trp[0][1], trp[0][2]),
+                    (trp[0][0], None, trp[0][2])):
+                assert _clean(store.triples(pattern)) == {
+                    t for t in trp if all(
+                        pattern[i] in (None, t[i]) for i in range(3))}
+
+
+    def test_build_existing(self, open_store, trp):
+        '''
+        Test building composite indices for an existing store.
+        '''
+        store = open_store()
+        with TxnManager(store, True) as txn:
+            store.addN((*t, None) for t in trp)
+        store.close()
+
+        store = open_store(composite_indices=True)
+        with TxnManager(store) as txn:
+            assert store.stats()['idx_db_stats']['sp:o']['entries'] == 4
+        self._check_lookups(store, trp)
+
+
+    def test_add_remove(self, open_store, trp):
+        '''
+        Test maintaining composite indices on add and remove.
+        '''
+        store = open_store(composite_indices=True)
+        new_trp = (
+            URIRef('urn:cidx:s2'), URIRef('urn:cidx:p1'),
+            URIRef('urn:cidx:o2'))
+        with TxnManager(store, True) as txn:
+            store.addN((*t, None) for t in trp)
+            store.add(new_trp)
+        self._check_lookups(store, trp + [new_trp])
+        with TxnManager(store, True) as txn:
+            store.remove(new_trp)
+        self._check_lookups(store, trp)
+
+
+    def test_drop(self, open_store, trp):
+        '''
+        Test dropping composite indices.
+        '''
+        store = open_store(composite_indices=True)
+        with TxnManager(store, True) as txn:
+            store.addN((*t, None) for t in trp)
+        store.close()
+
+        store = open_store(composite_indices=False)
+        with TxnManager(store) as txn:
+            assert store.idx_txn.stat(store.dbs['sp:o'])['entries'] == 0
+        self._check_lookups(store, trp)
+
+
+
+class TestRangeIdx:
+    '''
+    Tests for the optional range index.
+    '''
+    ns = Namespace('urn:ridx:')
+
+    def test_sortable_value(self):
+        '''
+        Test that encoded values sort like the values.
+        '''
+        vals = [
+            Literal('-1e10', datatype=XSD.double), Literal(-3),
+            Literal('-2.5', datatype=XSD.decimal), Literal(0),
+            Literal('0.001', datatype=XSD.float), Literal(2), Literal(2 ** 40),
+        ]
+        enc = [sortable_value(v) for v in vals]
+        assert enc == sorted(enc)
+        assert sortable_value(Literal('1.0', datatype=XSD.decimal)) == \
+                sortable_value(Literal(1))
+        dates = [
+            Literal('1900-01-01', datatype=XSD.date),
+            Literal('2017-12-31T23:00:00', datatype=XSD.dateTime),
+            Literal('2018-01-01', datatype=XSD.date),
+            Literal('2018-01-01T02:30:00+02:00', datatype=XSD.dateTime),
+        ]
+        enc = [sortable_value(v) for v in dates]
+        assert enc == sorted(enc)
+        for term in (
+                Literal('a'), Literal('x', datatype=XSD.integer),
+                URIRef('urn:ridx:1'), Literal(True)):
+            assert sortable_value(term) is None
+
+
+    def _range(self, store, pred, *args, **kwargs):
+        with TxnManager(store) as txn:
+            return [
+                store.from_key(spok)[0]
+                for spok in store.range_triple_keys(
+                    store.to_key(pred), *args, **kwargs)]
+
+
+    def _add_values(self, store):
+        ns = self.ns
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (ns['s{}'.format(i)], ns.val, Literal(i), ns.g)
+                for i in range(-5, 5))
+            store.add((ns.s0, ns.val, Literal('zero')), ns.g)
+            store.add((ns.s0, ns.val, ns.zero), ns.g)
+
+
+    def test_build_existing(self, open_store):
+        '''
+        Test building the range index for an existing store.
+        '''
+        ns = self.ns
+        store = open_store()
+        self._add_values(store)
+        with pytest.raises(RuntimeError):
+            self._range(store, ns.val, Literal(0))
+        store.close()
+
+        store = open_store(range_index=True)
+        with TxnManager(store) as txn:
+            assert store.stats()['idx_db_stats']['pv:so']['entries'] == 10
+        assert self._range(store, ns.val, Literal(-2), Literal(1)) == [
+                ns['s{}'.format(i)] for i in range(-2, 2)]
+        assert self._range(
+                store, ns.val, Literal(-2), Literal(1), incl_start=False,
+                incl_end=False) == [ns['s-1'], ns.s0]
+        assert self._range(store, ns.val, start=Literal('2.5',
+                datatype=XSD.decimal)) == [ns.s3, ns.s4]
+        assert self._range(store, ns.val, end=Literal(-4)) == [
+                ns['s-5'], ns['s-4']]
+        with pytest.raises(ValueError):
+            self._range(store, ns.val, Literal('zero'))
+        with pytest.raises(ValueError):
+            self._range(
+                    store, ns.val, Literal(0),
+                    Literal('2018-01-01', datatype=XSD.date))
+
+
+    def test_add_remove(self, open_store):
+        '''
+        Test maintaining the range index on add and remove.
+        '''
+        ns = self.ns
+        store = open_store(range_index=True)
+        self._add_values(store)
+        d1 = Literal('2018-01-01', datatype=XSD.date)
+        d2 = Literal('2018-02-01T12:00:00Z', datatype=XSD.dateTime)
+        with TxnManager(store, True) as txn:
+            store.add((ns.d1, ns.date, d1), ns.g)
+            store.add((ns.d2, ns.date, d2), ns.g)
+            store.add((ns.d2, ns.date, d2), ns.g2)
+        assert self._range(store, ns.date, d1) == [ns.d1, ns.d2]
+        assert self._range(store, ns.val, d1) == []
+        with TxnManager(store, True) as txn:
+            store.remove((ns.d2, ns.date, d2), ns.g)
+        # The triple is still in another context.
+        assert self._range(store, ns.date, d1) == [ns.d1, ns.d2]
+        with TxnManager(store, True) as txn:
+            store.remove((ns.d2, ns.date, d2), ns.g2)
+            store.remove((ns.s0, ns.val, Literal(0)))
+        assert self._range(store, ns.date, d1) == [ns.d1]
+        assert self._range(store, ns.val, Literal(0), Literal(0)) == []
+
+
+    def test_drop(self, open_store):
+        '''
+        Test dropping the range index.
+        '''
+        store = open_store(range_index=True)
+        self._add_values(store)
+        store.close()
+
+        store = open_store(range_index=False)
+        with TxnManager(store) as txn:
+            assert store.idx_txn.stat(store.dbs['pv:so'])['entries'] == 0
+
+
+
+class TestFulltextIdx:
+    '''
+    Tests for the optional full-text index.
+    '''
+    ns = Namespace('urn:ftidx:')
+
+    def test_tokenize(self):
+        '''
+        Test splitting a text into tokens.
+        '''
+        assert tokenize('Straße, STRASSE & ﬁne_print 42!') == {
+                'strasse', 'fine_print', '42'}
+        assert tokenize(' ;') == set()
+
+
+    def _search(self, store, text, pred=None):
+        with TxnManager(store) as txn:
+            pk = None if pred is None else store.to_key(pred)
+            return [
+                store.from_key(sk)[0]
+                for sk, score in store.fulltext_search(text, pk)]
+
+
+    def _add_texts(self, store):
+        ns = self.ns
+        with TxnManager(store, True) as txn:
+            store.add((ns.s1, ns.title, Literal('The Red Fox')), ns.g)
+            store.add((ns.s1, ns.title, Literal('The Red Fox')), ns.g2)
+            store.add((ns.s2, ns.title, Literal('A red herring', lang='en')),
+                    ns.g)
+            store.add((ns.s2, ns.note, Literal(
+                    'fox', datatype=XSD.string)), ns.g)
+            store.add((ns.s3, ns.note, Literal('The end')), ns.g)
+            store.add((ns.s3, ns.size, Literal(42)), ns.g)
+
+
+    def test_build_existing(self, open_store):
+        '''
+        Test building the full-text index for an existing store.
+        '''
+        ns = self.ns
+        store = open_store()
+        self._add_texts(store)
+        with pytest.raises(RuntimeError):
+            self._search(store, 'fox')
+        store.close()
+
+        store = open_store(fulltext_index=True)
+        with TxnManager(store) as txn:
+            assert store.stats()['idx_db_stats']['tk:spo']['entries'] == 9
+        # Rarer words weigh more.
+        assert self._search(store, 'red fox herring') == [ns.s2, ns.s1]
+        assert set(self._search(store, 'FOX')) == {ns.s1, ns.s2}
+        assert self._search(store, 'fox', ns.title) == [ns.s1]
+        assert set(self._search(store, 'the fox', ns.note)) == {
+                ns.s2, ns.s3}
+        assert self._search(store, '42') == []
+        assert self._search(store, 'wolf') == []
+
+
+    def test_add_remove(self, open_store):
+        '''
+        Test maintaining the full-text index on add and remove.
+        '''
+        ns = self.ns
+        store = open_store(fulltext_index=True)
+        self._add_texts(store)
+        with TxnManager(store, True) as txn:
+            store.add((ns.s4, ns.title, Literal('Wolf and fox')), ns.g)
+        assert set(self._search(store, 'wolf fox')) == {ns.s1, ns.s2, ns.s4}
+        assert self._search(store, 'wolf fox')[0] == ns.s4
+        with TxnManager(store, True) as txn:
+            store.remove((ns.s1, ns.title, None), ns.g)
+        # The triple is still in another context.
+        assert ns.s1 in self._search(store, 'fox')
+        with TxnManager(store, True) as txn:
+            store.remove((ns.s1, ns.title, None))
+            store.remove((ns.s4, None, None))
+        assert self._search(store, 'fox') == [ns.s2]
+        assert self._search(store, 'wolf') == []
+
+
+    def test_rebuild(self, open_store):
+        '''
+        Test rebuilding the full-text index with spilled sort runs, then
+        dropping it.
+        '''
+        store = open_store(fulltext_index=True)
+        self._add_texts(store)
+        with store.idx_env.begin() as txn:
+            orig = list(txn.cursor(store.dbs['tk:spo']))
+        assert store.rebuild_indices(('tk:spo',), chunk_size=2) == {
+                'tk:spo': len(orig)}
+        with store.idx_env.begin() as txn:
+            assert list(txn.cursor(store.dbs['tk:spo'])) == orig
+        store.close()
+
+        store = open_store(fulltext_index=False)
+        with TxnManager(store) as txn:
+            assert store.idx_txn.stat(store.dbs['tk:spo'])['entries'] == 0
+
+
+
+class TestLargeTerms:
+    '''
+    Tests for terms stored out of line.
+    '''
+    ns = Namespace('urn:large:')
+    text = Literal('All work and no play makes Jack a dull boy. ' * 200)
+
+    def _add(self, store):
+        ns = self.ns
+        with TxnManager(store, True) as txn:
+            store.add((ns.s1, ns.descr, self.text), ns.g)
+            store.add((ns.s2, ns.descr, self.text), ns.g)
+            store.add((ns.s2, ns.title, Literal('Short')), ns.g)
+
+
+    def test_add(self, open_store):
+        '''
+        Test storing a large term out of line.
+        '''
+        ns = self.ns
+        store = open_store(large_term_size=1024)
+        self._add(store)
+        with TxnManager(store) as txn:
+            ok = store.to_key(self.text)
+            assert bytes(store.data_txn.get(ok, db=store.dbs['t:st'])) == (
+                    bytes((TermSerializer.LARGE, TermSerializer.LITERAL)))
+            zdata = store.data_txn.get(ok, db=store.dbs['t:zst'])
+            assert len(zdata) < len(self.text) / 10
+            assert store.stats()['data_db_stats']['t:zst']['entries'] == 1
+        store.close()
+
+        store = open_store(large_term_size=1024)
+        with TxnManager(store) as txn:
+            assert {
+                trp for trp, ctx in store.triples((None, ns.descr, None))
+            } == {
+                (ns.s1, ns.descr, self.text),
+                (ns.s2, ns.descr, self.text),
+            }
+            assert store.to_key(self.text) == ok
+            assert store.stats()['data_db_stats']['t:zst']['entries'] == 1
+
+
+    def test_rebuild(self, open_store):
+        '''
+        Test rebuilding the indices of large terms.
+        '''
+        ns = self.ns
+        store = open_store(large_term_size=1024, fulltext_index=True)
+        self._add(store)
+        with store.idx_env.begin() as txn:
+            orig = list(txn.cursor(store.dbs['th:t']))
+        store.rebuild_indices(('th:t',))
+        with store.idx_env.begin() as txn:
+            assert list(txn.cursor(store.dbs['th:t'])) == orig
+        with TxnManager(store) as txn:
+            assert [
+                store.from_key(sk)[0]
+                for sk, score in store.fulltext_search('jack')
+            ] == [ns.s1, ns.s2]
+
+
+    def test_purge(self, open_store):
+        '''
+        Test purging an orphan large term.
+        '''
+        ns = self.ns
+        store = open_store(large_term_size=1024)
+        self._add(store)
+        with TxnManager(store, True) as txn:
+            store.remove((None, ns.descr, None))
+        store.purge_orphan_terms()
+        with TxnManager(store) as txn:
+            assert store.stats()['data_db_stats']['t:zst']['entries'] == 0
+
+
+
+class TestRefIdx:
+    '''
+    Tests for the reverse reference index.
+    '''
+    ns = Namespace('urn:refidx:')
+
+    def _refs(self, store, o):
+        with TxnManager(store) as txn:
+            return {
+                (store.from_key(ck)[0], store.from_key(spok))
+                for ck, spok in store.ref_keys(store.to_key(o))}
+
+    def test_add_remove(self, open_store):
+        '''
+        Test maintaining the reverse reference index.
+        '''
+        ns = self.ns
+        store = open_store()
+        with TxnManager(store, True) as txn:
+            store.add((ns.s1, ns.ref, ns.auth), ns.g1)
+            store.add((ns.s1, ns.ref, ns.auth), ns.g2)
+            store.add((ns.s2, ns.ref, ns.auth), ns.g1)
+            store.add((ns.s2, ns.label, Literal('auth')), ns.g1)
+            store.add((ns.auth, ns.label, Literal('Authority')), ns.g1)
+        assert self._refs(store, ns.auth) == {
+            (ns.g1, (ns.s1, ns.ref, ns.auth)),
+            (ns.g2, (ns.s1, ns.ref, ns.auth)),
+            (ns.g1, (ns.s2, ns.ref, ns.auth)),
+        }
+        with TxnManager(store) as txn:
+            assert store.idx_txn.stat(store.dbs['o:cps'])['entries'] == 3
+
+        with TxnManager(store, True) as txn:
+            store.remove((ns.s1, None, None), ns.g2)
+            store.remove((ns.s2, None, None))
+        assert self._refs(store, ns.auth) == {
+                (ns.g1, (ns.s1, ns.ref, ns.auth))}
+        with TxnManager(store, True) as txn:
+            store.remove_graph(ns.g1)
+        assert self._refs(store, ns.auth) == set()
+
+
+    def test_build_existing(self, open_store):
+        '''
+        Test building the index for a store created without it.
+        '''
+        ns = self.ns
+        store = open_store()
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (ns['s{}'.format(i)], ns.ref, ns['o{}'.format(i % 3)], ns.g)
+                for i in range(10))
+            store.add((ns.s1, ns.label, Literal('s1')), ns.g)
+        with store.idx_env.begin() as txn:
+            orig = list(txn.cursor(store.dbs['o:cps']))
+        assert len(orig) == 10
+        with store.idx_env.begin(write=True) as txn:
+            txn.drop(store.dbs['o:cps'], delete=False)
+            txn.delete(b'refs', db=store.dbs['md:idx'])
+        store.close()
+
+        store = open_store()
+        with store.idx_env.begin() as txn:
+            assert list(txn.cursor(store.dbs['o:cps'])) == orig
+
+
+    def test_context_filter(self, open_store):
+        '''
+        Test leaving contexts out of the index.
+        '''
+        ns = self.ns
+        store = open_store(ref_context_filter=lambda c: c != ns.hist)
+        with TxnManager(store, True) as txn:
+            store.add((ns.s1, ns.ref, ns.auth), ns.g1)
+            store.add((ns.s2, ns.ref, ns.auth), ns.hist)
+        assert self._refs(store, ns.auth) == {
+                (ns.g1, (ns.s1, ns.ref, ns.auth))}
+
+        store.rebuild_indices(('o:cps',))
+        assert self._refs(store, ns.auth) == {
+                (ns.g1, (ns.s1, ns.ref, ns.auth))}
+        with TxnManager(store, True) as txn:
+            store.remove((None, None, ns.auth))
+        assert self._refs(store, ns.auth) == set()
+
+
+
+class TestClosureIdx:
+    '''
+    Tests for the transitive closure index.
+    '''
+    ns = Namespace('urn:closureidx:')
+
+    def _desc(self, store, s):
+        with TxnManager(store) as txn:
+            sk = store.to_key(s)
+            desc = {store.from_key(dk)[0] for dk in store.closure_keys(sk)}
+            assert store.count_closure(sk) == len(desc)
+        return desc
+
+    def test_add_remove(self, open_store):
+        '''
+        Test maintaining the closure index.
+        '''
+        ns = self.ns
+        store = open_store(
+                ref_context_filter=lambda c: c != ns.hist,
+                closure_predicate=ns.contains)
+        assert store.closure_ready
+        with TxnManager(store, True) as txn:
+            store.add((ns.a, ns.contains, ns.b), ns.g1)
+            store.add((ns.c, ns.contains, ns.d), ns.g1)
+            # Linking two subtrees.
+            store.add((ns.b, ns.contains, ns.c), ns.g1)
+            store.add((ns.b, ns.contains, ns.c), ns.g2)
+            store.add((ns.a, ns.label, Literal('a')), ns.g1)
+            store.add((ns.d, ns.contains, ns.e), ns.hist)
+        assert self._desc(store, ns.a) == {ns.b, ns.c, ns.d}
+        assert self._desc(store, ns.c) == {ns.d}
+        assert self._desc(store, ns.d) == set()
+
+        # Still held by another context.
+        with TxnManager(store, True) as txn:
+            store.remove((ns.b, ns.contains, ns.c), ns.g1)
+            store.remove((ns.d, None, None), ns.hist)
+        assert self._desc(store, ns.a) == {ns.b, ns.c, ns.d}
+
+        with TxnManager(store, True) as txn:
+            store.remove_graph(ns.g2)
+        assert self._desc(store, ns.a) == {ns.b}
+        assert self._desc(store, ns.c) == {ns.d}
+
+
+    def test_rebuild(self, open_store):
+        '''
+        Test building the index for a store created without it.
+        '''
+        ns = self.ns
+        store = open_store()
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (ns['n{}'.format(i // 2)], ns.contains, ns['n{}'.format(i)],
+                    ns.g)
+                for i in range(1, 16))
+            store.add((ns.n0, ns.contains, ns.n0), ns.hist)
+        store.close()
+
+        store = open_store(
+                ref_context_filter=lambda c: c != ns.hist,
+                closure_predicate=ns.contains)
+        assert not store.closure_ready
+
+        store.rebuild_indices(('a:d', 'd:a'))
+        assert store.closure_ready
+        assert self._desc(store, ns.n0) == {
+                ns['n{}'.format(i)] for i in range(1, 16)}
+        assert self._desc(store, ns.n2) == {
+                ns.n4, ns.n5, ns.n8, ns.n9, ns.n10, ns.n11}
+        with TxnManager(store) as txn:
+            assert set(store.closure_keys(store.to_key(ns.n14))) == set()
+
+
+
 @pytest.mark.usefixtures('store')
 class TestBindings:
     '''
@@ -255,6 +914,8 @@ class TestContext:
             assert gr_uri in {gr.identifier for gr in store.contexts()}
             store.remove_graph(gr_uri)
             assert gr_uri not in {gr.identifier for gr in store.contexts()}
+            # Removing a graph that was never stored is a no-op.
+            store.remove_graph(URIRef('urn:bogus:empty#never'))
 
 
     def test_add_trp_to_ctx(self, store):
@@ -291,23 +952,702 @@ class TestContext:
                     RDFLIB_DEFAULT_GRAPH_URI))
 
 
-    #def test_delete_from_ctx(self, store):
-    #    '''
-    #    Delete triples from a named graph and from the default graph.
-    #    '''
-    #    gr_uri = URIRef('urn:bogus:graph#a')
-    #    gr2_uri = URIRef('urn:bogus:graph#b')
+    def test_triple_contexts(self, store):
+        '''
+        Test looking up the contexts of matched triples.
+        '''
+        gr_uri = URIRef('urn:bogus:graph#a')
+        gr2_uri = URIRef('urn:bogus:graph#b')
+        trp3 = (URIRef('urn:s:3'), URIRef('urn:p:3'), URIRef('urn:o:3'))
+
+        with TxnManager(store) as txn:
+            res = dict(store.triples((None, None, None)))
+            assert set(res[trp3].uris()) == {
+                    gr2_uri, RDFLIB_DEFAULT_GRAPH_URI}
+            # Graph instances are reused.
+            ctx1 = {gr.identifier: gr for gr in res[trp3]}
+            ctx2 = {gr.identifier: gr for gr in res[trp3]}
+            assert ctx1[gr2_uri] is ctx2[gr2_uri]
+            assert ctx1[gr2_uri].store is store
+
+            res = list(store.triples((None, None, None), gr_uri))
+            assert len(res) == 2
+            assert [gr.identifier for gr in res[0][1]] == [gr_uri]
+
+            assert set(store._triples((None, None, None), gr_uri)) == {
+                    trp for trp, ctx in res}
+
+
+    def test_delete_from_ctx(self, store):
+        '''
+        Delete triples from a named graph and from the default graph.
+        '''
+        gr_uri = URIRef('urn:bogus:graph#a')
+        gr2_uri = URIRef('urn:bogus:graph#b')
+        trp3 = (URIRef('urn:s:3'), URIRef('urn:p:3'), URIRef('urn:o:3'))
+
+        with TxnManager(store, True) as txn:
+            store.remove((None, None, None), gr2_uri)
+            assert len(set(store.triples((None, None, None), gr2_uri))) == 0
+            assert len(set(store.triples((None, None, None), gr_uri))) == 2
+            # The triple is still in the default graph and can be looked up.
+            assert trp3 in _clean(store.triples((trp3[0], None, None)))
+
+        with TxnManager(store, True) as txn:
+            store.remove((None, None, None))
+            assert len(set(store.triples((None, None, None)))) == 0
+            assert len(set(store.triples((None, None, None), gr_uri))) == 0
+            assert len(store) == 0
+
+
+    def test_count_ctx(self, store):
+        '''
+        Test the per-context and per-predicate triple counts.
+        '''
+        gr_uri = URIRef('urn:bogus:graph#c')
+        p1 = URIRef('urn:p:1')
+        p2 = URIRef('urn:p:2')
+
+        with TxnManager(store, True) as txn:
+            store.addN((URIRef('urn:s:{}'.format(i)), p1 if i % 3 else p2,
+                    Literal(i), gr_uri) for i in range(10))
+            # Adding an existing triple does not change the counts.
+            store.add((URIRef('urn:s:1'), p1, Literal(1)), gr_uri)
+            assert store.__len__(gr_uri) == 10
+            assert store.count_context(gr_uri, p1) == 6
+            assert store.count_context(gr_uri, p2) == 4
+            assert store.count_context(gr_uri, URIRef('urn:p:3')) == 0
+
+        with TxnManager(store, True) as txn:
+            store.remove((None, p2, None), gr_uri)
+            assert store.__len__(gr_uri) == 6
+            assert store.count_context(gr_uri, p2) == 0
+            store.remove((URIRef('urn:s:1'), None, None))
+            assert store.count_context(gr_uri, p1) == 5
+            store.remove_graph(gr_uri)
+            assert store.count_context(gr_uri) == 0
+            assert store.count_context(gr_uri, p1) == 0
+
+
+@pytest.mark.usefixtures('store')
+class TestKeyCache:
+    '''
+    Tests for the term-to-key cache.
+    '''
+    def test_cache_across_txn(self, store):
+        '''
+        Test that committed keys are cached across transactions.
+        '''
+        trp = (
+            URIRef('urn:cache:s'), URIRef('urn:cache:p'),
+            URIRef('urn:cache:o'))
+        with TxnManager(store, True) as txn:
+            store.add(trp)
+            tkey = store._to_key(trp)
+
+        assert store._key_cache.get(URIRef('urn:cache:p')) is not None
+        with TxnManager(store) as txn:
+            assert store._to_key(trp) == tkey
+            assert _clean(store.triples(trp)) == {trp}
+
+
+    def test_cache_rollback(self, store):
+        '''
+        Test that keys allocated in a rolled back transaction are discarded.
+        '''
+        term1 = URIRef('urn:cache:rollback')
+        term2 = URIRef('urn:cache:after_rollback')
+        try:
+            with TxnManager(store, True) as txn:
+                store.add((term1, RDF.type, URIRef('urn:cache:o')))
+                assert store._to_key(term1) is not None
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        assert store._key_cache.get(term1) is None
+        with TxnManager(store, True) as txn:
+            # This term may get the same key that term1 had.
+            store.add((term2, RDF.type, URIRef('urn:cache:o')))
+        with TxnManager(store) as txn:
+            assert store._to_key(term1) is None
+            assert store._from_key(store._to_key(term2)) == (term2,)
+
+
+@pytest.mark.usefixtures('store')
+class TestTermCache:
+    '''
+    Tests for the key-to-term cache.
+    '''
+    def test_term_cache_hits(self, store):
+        '''
+        Test that repeated terms are decoded from the cache.
+        '''
+        s = URIRef('urn:tcache:s')
+        with TxnManager(store, True) as txn:
+            for i in range(10):
+                store.add((s, RDF.type, URIRef('urn:tcache:o{}'.format(i))))
+
+        store._term_cache.clear()
+        hits = store._term_cache.hits
+        with TxnManager(store) as txn:
+            res = _clean(store.triples((s, None, None)))
+        assert len(res) == 10
+        # Subject and predicate are decoded once and cached after that.
+        assert store._term_cache.hits - hits >= 18
+        with TxnManager(store) as txn:
+            stats = store.stats()['cache_stats']['term_cache']
+        assert stats['hits'] == store._term_cache.hits
+        assert stats['size'] <= stats['max_size']
+
+
+
+class TestTermFormat:
+    '''
+    Tests for the term serialization.
+    '''
+    @pytest.fixture
+    def terms(self):
+        return [
+            URIRef('urn:tfmt:s'),
+            URIRef('http://ex.org/ns#name'),
+            BNode(),
+            Literal('plain'),
+            Literal('chat', lang='fr'),
+            Literal(12, datatype=XSD.integer),
+            Literal('2018-01-01', datatype=URIRef('http://ex.org/ns#date')),
+        ]
+
+
+    def test_roundtrip(self, open_store, terms):
+        '''
+        Test serializing and deserializing terms.
+        '''
+        store = open_store()
+        assert store.term_format == 'compact'
+        store.bind('ex', Namespace('http://ex.org/ns#'))
+        for term in terms:
+            data = store._dump_term(term)
+            assert data[0] != TermSerializer.PICKLE
+            assert store._load_term(data) == term
+            assert store._expand_term(data) == store._canonical_term(term)
+        # Namespace URIs are compressed but hashed in full.
+        uri = terms[1]
+        assert len(store._dump_term(uri)) < len(store._canonical_term(uri))
+
+
+    def test_ns_rollback(self, open_store):
+        '''
+        Test that a namespace registered in a rolled back transaction is
+        discarded.
+        '''
+        store = open_store()
+        uri = URIRef('http://ex.org/rb#a')
+        with TxnManager(store, True) as txn:
+            store.bind('rb', Namespace('http://ex.org/rb#'))
+            assert store._dump_term(uri)[0] == TermSerializer.NS_URI
+            store.rollback()
+        assert store._dump_term(uri)[0] == TermSerializer.URI
+
+
+    def test_migrate(self, open_store, terms):
+        '''
+        Test converting a legacy store with pickled terms.
+        '''
+        store = open_store()
+        # Mark the empty store as a legacy one.
+        with store.data_env.begin(write=True) as wtxn:
+            wtxn.put(b'term_format', b'pickle', db=store.dbs['md:data'])
+        with store.idx_env.begin(write=True) as wtxn:
+            wtxn.put(b'term_format', b'pickle', db=store.dbs['md:idx'])
+        store.close()
+
+        store = open_store()
+        assert store.term_format == 'pickle'
+        store.bind('ex', Namespace('http://ex.org/ns#'))
+        trp = {(terms[0], terms[1], o) for o in terms[2:]}
+        with TxnManager(store, True) as txn:
+            for t in trp:
+                store.add(t, URIRef('urn:tfmt:g'))
+
+        assert store.migrate_term_format() == len(terms) + 1
+        assert store.term_format == 'compact'
+        with TxnManager(store) as txn:
+            assert _clean(store.triples((terms[0], None, None))) == trp
+            assert store.__len__(URIRef('urn:tfmt:g')) == len(trp)
+            assert store.namespace('ex') == Namespace('http://ex.org/ns#')
+            with store.cur('t:st') as cur:
+                assert all(
+                    v[0] != TermSerializer.PICKLE
+                    for v in cur.iternext(keys=False))
+
+
+@pytest.mark.usefixtures('store')
+class TestLookupOrder:
+    '''
+    Tests for choosing the index for two-bound lookups.
+    '''
+    def test_most_selective(self, store):
+        '''
+        Test that the term with fewer entries is looked up.
+        '''
+        ctr = URIRef('urn:lkorder:Container')
+        s = URIRef('urn:lkorder:s0')
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (URIRef('urn:lkorder:s{}'.format(i)), RDF.type, ctr, None)
+                for i in range(20))
+            store.addN(
+                (URIRef('urn:lkorder:s{}'.format(i)), RDF.type,
+                    URIRef('urn:lkorder:Other'), None)
+                for i in range(20, 30))
+            store.add((s, RDFS.label, Literal('s0')))
+
+        stats = dict(store._lookup_stats)
+        with TxnManager(store) as txn:
+            assert _clean(store.triples((s, None, ctr))) == {
+                    (s, RDF.type, ctr)}
+            assert store._lookup_stats['s:po'] == stats['s:po'] + 1
+            assert len(set(store.triples((None, RDF.type, ctr)))) == 20
+            assert store._lookup_stats['o:sp'] == stats['o:sp'] + 1
+            assert _clean(store.triples((s, RDF.type, None))) == {
+                    (s, RDF.type, ctr)}
+            assert store._lookup_stats['s:po'] == stats['s:po'] + 2
+            assert store.stats()['lookup_stats'] == store._lookup_stats
+            assert not set(store.triples((s, RDFS.label, ctr)))
+
+
+
+@pytest.mark.usefixtures('store')
+class TestKeyApi:
+    '''
+    Tests for the key-level query API.
+    '''
+    def test_key_api(self, store):
+        '''
+        Test looking up, counting and joining triples by key.
+        '''
+        gr = URIRef('urn:keyapi:g')
+        ctr = URIRef('urn:keyapi:Container')
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (URIRef('urn:keyapi:s{}'.format(i)), RDF.type, ctr,
+                    gr if i % 2 else None)
+                for i in range(10))
+
+        with TxnManager(store) as txn:
+            ck = store.to_key(gr)
+            typek, ctrk = store.to_key_pattern((None, RDF.type, ctr))[1:]
+            assert store.from_key(ctrk) == (ctr,)
+            assert store.to_key_pattern(
+                    (None, RDF.type, URIRef('urn:keyapi:x'))) is None
+
+            spoks = set(store.triple_keys((None, typek, ctrk)))
+            assert len(spoks) == 10
+            assert {store.from_key(spok) for spok in spoks} == _clean(
+                    store.triples((None, RDF.type, ctr)))
+            assert list(store.from_triple_keys(spoks)) == [
+                    store.from_key(spok) for spok in spoks]
+            assert set(store.from_triple_keys(
+                    store.triple_keys((None, None, None), ck))) == {
+                (URIRef('urn:keyapi:s{}'.format(i)), RDF.type, ctr)
+                for i in range(1, 10, 2)}
+
+            ctx_spoks = list(store.context_triple_keys(ck))
+            assert ctx_spoks == sorted(ctx_spoks)
+            assert len(ctx_spoks) == 5
+            assert list(store.context_triple_keys(
+                    ck, ctx_spoks[1])) == ctx_spoks[2:]
+            assert list(store.context_triple_keys(ck, ctx_spoks[-1])) == []
+            assert store.count((None, None, ctrk)) == 10
+            assert store.count((None, typek, ctrk), ck) == 5
+            assert store.count((None, None, None), ck) == 5
+
+            sk0 = store.to_key(URIRef('urn:keyapi:s0'))
+            sk1 = store.to_key(URIRef('urn:keyapi:s1'))
+            assert store.exists((sk1, typek, ctrk), ck)
+            assert not store.exists((sk0, typek, ctrk), ck)
+            assert store.exists((sk0, None, None))
+            assert list(store.intersect(
+                    (sk0, sk1), (None, typek, ctrk), 0, ck)) == [sk1]
+
+
+
+@pytest.mark.usefixtures('store')
+class TestBgpEval:
+    '''
+    Tests for the native evaluation of basic graph patterns.
+    '''
+    @pytest.fixture
+    def ds(self, store):
+        ns = Namespace('urn:bgp:')
+        with TxnManager(store, True) as txn:
+            store.addN(
+                (ns['s{}'.format(i)], RDF.type,
+                    ns.Even if i % 2 == 0 else ns.Odd, ns.g1)
+                for i in range(40))
+            store.addN(
+                (ns['s{}'.format(i)], ns.next, ns['s{}'.format(i + 1)],
+                    ns.g2)
+                for i in range(40))
+            store.addN(
+                (ns['s{}'.format(i)], RDFS.label, Literal(i), ns.g2)
+                for i in range(0, 40, 3))
+            store.add((ns.s7, ns.next, ns.s7), ns.g2)
+
+        return Dataset(store, default_union=True)
+
+
+    @pytest.mark.parametrize('qry', (
+        'SELECT ?s ?o WHERE { ?s a bgp:Even ; bgp:next ?o }',
+        'SELECT ?s ?l WHERE { ?s a bgp:Odd ; bgp:next ?n . ?n rdfs:label ?l }',
+        'SELECT ?s WHERE { ?s bgp:next ?s }',
+        'SELECT ?s ?t WHERE { ?s rdfs:label ?l . ?t a bgp:Odd }',
+        'SELECT ?s WHERE { GRAPH bgp:g1 { ?s a bgp:Even ; bgp:next ?o } }',
+        'SELECT ?g ?s WHERE { GRAPH ?g { ?s a bgp:Even } }',
+        'SELECT ?s ?n WHERE { ?s a bgp:Odd . OPTIONAL { ?s rdfs:label ?n } '
+        'FILTER(?s != bgp:s1) }',
+        'ASK { bgp:s2 a bgp:Even ; bgp:next bgp:s3 }',
+        'ASK { bgp:s2 a bgp:Odd }',
+        'SELECT ?s WHERE { ?s a bgp:Nonexisting }',
+    ))
+    def test_eval(self, store, ds, qry):
+        '''
+        Test that the results are the same as RDFLib's.
+        '''
+        init_ns = {'bgp': Namespace('urn:bgp:'), 'rdfs': RDFS}
+        with TxnManager(store) as txn:
+            CUSTOM_EVALS['lmdb_bgp'] = eval_bgp
+            try:
+                res = ds.query(qry, initNs=init_ns)
+                native = (
+                        res.askAnswer if res.type == 'ASK' else set(res))
+            finally:
+                del CUSTOM_EVALS['lmdb_bgp']
+            res = ds.query(qry, initNs=init_ns)
+            assert native == (
+                    res.askAnswer if res.type == 'ASK' else set(res))
+
+
+    def test_init_bindings(self, store, ds):
+        '''
+        Test evaluating a pattern with initial bindings.
+        '''
+        ns = Namespace('urn:bgp:')
+        qry = 'SELECT ?o WHERE { ?s a ?type ; bgp:next ?o }'
+        with TxnManager(store) as txn:
+            CUSTOM_EVALS['lmdb_bgp'] = eval_bgp
+            try:
+                res = {row[0] for row in ds.query(
+                        qry, initNs={'bgp': ns},
+                        initBindings={'s': ns.s4, 'type': ns.Even})}
+            finally:
+                del CUSTOM_EVALS['lmdb_bgp']
+        assert res == {ns.s5}
+
+
+
+@pytest.mark.usefixtures('store')
+class TestThreads:
+    '''
+    Tests for transactions in concurrent threads.
+    '''
+    def test_txn_per_thread(self, store):
+        '''
+        Test that a thread does not see another thread's transaction.
+        '''
+        trp = (
+            URIRef('urn:thread:s'), URIRef('urn:thread:p'),
+            URIRef('urn:thread:o'))
+        written = Event()
+        checked = Event()
+        res = {}
+
+        def write():
+            with TxnManager(store, True) as txn:
+                store.add(trp)
+                written.set()
+                checked.wait(5)
+
+        def read():
+            written.wait(5)
+            res['is_txn_rw'] = store.is_txn_rw
+            with TxnManager(store) as txn:
+                res['found'] = trp in _clean(
+                        store.triples((trp[0], None, None)))
+            checked.set()
+
+        threads = [Thread(target=write), Thread(target=read)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert res == {'is_txn_rw': None, 'found': False}
+        assert not store.is_txn_open
+        with TxnManager(store) as txn:
+            assert trp in _clean(store.triples((trp[0], None, None)))
+
+
+    def test_concurrent_writes(self, store):
+        '''
+        Test that concurrent write transactions are serialized.
+        '''
+        def write(i):
+            with TxnManager(store, True) as txn:
+                store.addN(
+                    (URIRef('urn:thread:s{}'.format(i)), RDF.type,
+                        URIRef('urn:thread:o{}'.format(j)), None)
+                    for j in range(25))
+
+        threads = [Thread(target=write, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        with TxnManager(store) as txn:
+            assert len(set(store.triples((None, RDF.type, None)))) == 100
+            for i in range(4):
+                assert len(set(store.triples(
+                    (URIRef('urn:thread:s{}'.format(i)), None, None)))) == 25
+
+
+
+class TestDurability:
+    '''
+    Tests for the durability profiles.
+    '''
+    def test_switch(self, open_store):
+        '''
+        Test switching profiles.
+        '''
+        with pytest.raises(ValueError):
+            open_store(durability='reckless')
+
+        trp = (URIRef('urn:dur:s'), URIRef('urn:dur:p'), URIRef('urn:dur:o'))
+        store = open_store(durability='bulk-load')
+        assert store.data_env.flags()['sync'] is False
+        with TxnManager(store, True) as txn:
+            store.add(trp)
+
+        store.set_durability('fast-index')
+        assert store.data_env.flags()['sync'] is True
+        assert store.idx_env.flags()['sync'] is False
+        with TxnManager(store) as txn:
+            assert trp in _clean(store.triples((None, None, None)))
+            assert store.stats()['durability'] == 'fast-index'
+
+        with TxnManager(store) as txn:
+            with pytest.raises(RuntimeError):
+                store.set_durability('safe')
+
+
+
+class TestHashAlgo:
+    '''
+    Tests for the term hashing algorithm.
+    '''
+    def test_rehash(self, open_store):
+        '''
+        Test recording the algorithm, refusing a mismatch and rehashing.
+        '''
+        trp = (URIRef('urn:hash:s'), URIRef('urn:hash:p'), Literal('o'))
+        store = open_store(hash_algo='sha1')
+        with TxnManager(store, True) as txn:
+            store.add(trp)
+        store.close()
+
+        with pytest.raises(ValueError):
+            open_store(hash_algo='blake2b-128')
+
+        store = open_store()
+        assert store.hash_algo == 'sha1'
+        assert store.rehash_terms('blake2b-128') == 4
+        store.close()
+
+        store = open_store(hash_algo='blake2b-128')
+        with TxnManager(store) as txn:
+            assert len(store._to_key(trp[0])) == 5
+            assert _clean(store.triples((None, None, trp[2]))) == {trp}
+            assert store.stats()['hash_algo'] == 'blake2b-128'
+
+
+
+class TestRebuildIndex:
+    '''
+    Tests for rebuilding the indices from the main data.
+    '''
+    def _dump(self, store):
+        '''
+        Dump the content of all rebuildable indices.
+        '''
+        with store.idx_env.begin() as txn:
+            return {
+                db_key: list(txn.cursor(store.dbs[db_key]))
+                for db_key in store._rebuildable_keys()}
+
+    def test_rebuild(self, open_store):
+        '''
+        Test rebuilding offline with spilled sort runs, and online.
+        '''
+        store = open_store(composite_indices=True)
+        gr1 = URIRef('urn:rebuild:g1')
+        gr2 = URIRef('urn:rebuild:g2')
+        with TxnManager(store, True) as txn:
+            store.bind('rb', Namespace('urn:rebuild:'))
+            store.addN(
+                (URIRef('urn:rebuild:s{}'.format(i % 7)),
+                URIRef('urn:rebuild:p{}'.format(i % 3)),
+                Literal(i), gr1 if i % 2 else gr2) for i in range(50))
+            store.add(
+                (URIRef('urn:rebuild:s1'), URIRef('urn:rebuild:p1'),
+                Literal(1)), gr2)
+        orig = self._dump(store)
+
+        with store.idx_env.begin(write=True) as txn:
+            for db_key in ('th:t', 'p:so', 'c:spo', 'cp:n', 'ns:pfx'):
+                txn.drop(store.dbs[db_key], delete=False)
+        progress = []
+        ct = store.rebuild_indices(
+                chunk_size=8, progress=lambda *args: progress.append(args))
+        assert self._dump(store) == orig
+        assert ct['s:po'] == 50
+        assert ct['c:spo'] == 51
+        assert ('o:sp', 51, 51) in progress
+
+        store.rebuild_indices(('o:sp', 'so:p'), online=True)
+        assert self._dump(store) == orig
+        with pytest.raises(ValueError):
+            store.rebuild_indices(('t:st',))
+
+    def test_resume(self, open_store):
+        '''
+        Test resuming an interrupted offline rebuild on open.
+        '''
+        trp = (URIRef('urn:rebuild:s'), URIRef('urn:rebuild:p'), Literal('o'))
+        store = open_store()
+        with TxnManager(store, True) as txn:
+            store.add(trp)
+        with store.idx_env.begin(write=True) as txn:
+            txn.drop(store.dbs['o:sp'], delete=False)
+            txn.put(b'rebuild:o:sp', b'1', db=store.dbs['md:idx'])
+        store.close()
+
+        store = open_store()
+        with TxnManager(store) as txn:
+            assert _clean(store.triples((None, None, trp[2]))) == {trp}
+            assert store.idx_txn.get(
+                    b'rebuild:o:sp', db=store.dbs['md:idx']) is None
+
+
+
+class TestPurgeTerms:
+    '''
+    Tests for purging orphan terms.
+    '''
+    def test_purge(self, open_store):
+        '''
+        Test purging in limited runs and reusing purged terms.
+        '''
+        store = open_store()
+        s = URIRef('urn:purge:s')
+        p = URIRef('urn:purge:p')
+        with TxnManager(store, True) as txn:
+            store.addN((s, p, Literal(i), None) for i in range(20))
+        with TxnManager(store, True) as txn:
+            store.remove((s, p, None))
+            store.add((s, p, Literal('keep')))
+        # Warm up the key cache with a term that is about to be purged.
+        with TxnManager(store) as txn:
+            assert store._to_key(Literal(3))
+        with store.data_env.begin() as txn:
+            num_terms = txn.stat(store.dbs['t:st'])['entries']
+
+        ret = store.purge_orphan_terms(batch_size=4, limit=10)
+        assert ret['scanned'] == 10
+        assert not ret['complete']
+        ret2 = store.purge_orphan_terms(batch_size=4)
+        assert ret2['complete']
+        assert ret['scanned'] + ret2['scanned'] == num_terms
+        assert ret['deleted'] + ret2['deleted'] == 20
+
+        with TxnManager(store) as txn:
+            assert store._to_key(Literal(3)) is None
+            assert store.idx_txn.stat(store.dbs['th:t'])['entries'] == \
+                    num_terms - 20
+
+        with TxnManager(store, True) as txn:
+            store.add((s, p, Literal(3)))
+        with TxnManager(store) as txn:
+            assert _clean(store.triples((None, None, Literal(3)))) == {
+                    (s, p, Literal(3))}
+            assert _clean(store.triples((s, p, None))) == {
+                    (s, p, Literal(3)), (s, p, Literal('keep'))}
+
+        # The last key is never deleted.
+        with TxnManager(store, True) as txn:
+            store.remove((s, p, None))
+        assert store.purge_orphan_terms()['deleted'] == 3
+        with TxnManager(store) as txn:
+            assert store._to_key(Literal(3))
+            assert store._to_key(s) is None
+
+
+
+class TestBackup:
+    '''
+    Tests for hot backups.
+    '''
+    def test_backup(self, open_store, tmpdir):
+        '''
+        Test copying a store that is being written to.
+        '''
+        dest = str(tmpdir.join('copy'))
+        store = open_store()
+        s = URIRef('urn:backup:s')
+        p = URIRef('urn:backup:p')
+        with TxnManager(store, True) as txn:
+            store.addN((s, p, Literal(i), None) for i in range(1000))
+        with TxnManager(store, True) as txn:
+            store.remove((s, p, None))
+            store.addN((s, p, Literal(i), None) for i in range(10))
+
+        started = Event()
+        resume = Event()
+        def write():
+            with TxnManager(store, True) as txn:
+                store.add((s, p, Literal('pending')))
+                started.set()
+                resume.wait()
+
+        writer = Thread(target=write)
+        writer.start()
+        started.wait()
+        # The backup waits for the write in progress.
+        backup = Thread(target=store.backup, args=(dest,))
+        backup.start()
+        backup.join(.2)
+        assert backup.is_alive()
+        resume.set()
+        writer.join()
+        backup.join()
+
+        with TxnManager(store, True) as txn:
+            store.add((s, p, Literal('later')))
+        with pytest.raises(FileExistsError):
+            store.backup(dest)
+        src_size = getsize(store.path + '/main')
+        store.close()
 
-    #    with TxnManager(store, True) as txn:
-    #        store.remove((None, None, None), gr2_uri)
-    #        assert len(set(store.triples((None, None, None), gr2_uri))) == 0
-    #        assert len(set(store.triples((None, None, None), gr_uri))) == 2
+        assert getsize(dest + '/main') < src_size
+        copy = open_store(dest)
+        with TxnManager(copy) as txn:
+            assert _clean(copy.triples((s, p, None))) == {
+                (s, p, o) for o in
+                [Literal(i) for i in range(10)] + [Literal('pending')]}
+            assert len(copy) == 11
 
-    #    with TxnManager(store, True) as txn:
-    #        store.remove((None, None, None))
-    #        assert len(set(store.triples((None, None, None)))) == 0
-    #        assert len(set(store.triples((None, None, None), gr_uri))) == 0
-    #        assert len(store) == 0
 
 
 @pytest.mark.usefixtures('store')
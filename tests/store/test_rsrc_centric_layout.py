@@ -0,0 +1,105 @@
+import pytest
+
+from lakesuperior.api import resource as rsrc_api
+from lakesuperior.dictionaries.namespaces import ns_collection as nsc
+from lakesuperior.env import env
+from lakesuperior.exceptions import ResourceNotExistsError, TombstoneError
+from lakesuperior.model.ldp_factory import LdpFactory
+from lakesuperior.store.ldp_rs.lmdb_store import TxnManager
+
+
+@pytest.mark.usefixtures('db')
+class TestContainmentClosure:
+    '''
+    Tests for the descendants of a resource, read from the containment
+    closure index.
+    '''
+    def _descendants(self, uid):
+        rdfly = env.app_globals.rdfly
+        with TxnManager(rdfly.store):
+            desc = {rdfly.uri_to_uid(uri) for uri in rdfly.get_descendants(uid)}
+            # The closure index must agree with the structure graphs.
+            assert desc == {
+                    rdfly.uri_to_uid(uri)
+                    for uri in rdfly._walk_descendants(uid)}
+            assert rdfly.count_descendants(uid) == len(desc)
+
+        return desc
+
+
+    def _status(self, uid):
+        with TxnManager(env.app_globals.rdf_store):
+            try:
+                LdpFactory.from_stored(uid)
+            except ResourceNotExistsError:
+                return 404
+            except TombstoneError:
+                return 410
+        return 200
+
+
+    def test_create(self):
+        '''
+        Test the descendants of resources created with their intermediate
+        containers.
+        '''
+        rsrc_api.create_or_replace('/test_closure01/a/b/c/d', mimetype=None)
+        rsrc_api.create_or_replace('/test_closure01/a/e', mimetype=None)
+
+        assert self._descendants('/test_closure01') == {
+            '/test_closure01/a', '/test_closure01/a/b',
+            '/test_closure01/a/b/c', '/test_closure01/a/b/c/d',
+            '/test_closure01/a/e'}
+        assert self._descendants('/test_closure01/a/b') == {
+            '/test_closure01/a/b/c', '/test_closure01/a/b/c/d'}
+        assert self._descendants('/test_closure01/a/b/c/d') == set()
+        assert '/test_closure01/a/b/c/d' in self._descendants('/')
+
+
+    def test_soft_delete(self):
+        '''
+        Test that a buried resource is still listed as a descendant of the
+        resources that contain it.
+        '''
+        rsrc_api.delete('/test_closure01/a/b/c')
+
+        assert self._status('/test_closure01/a/b/c') == 410
+        assert self._status('/test_closure01/a/b/c/d') == 410
+        for uid in ('/', '/test_closure01', '/test_closure01/a',
+                '/test_closure01/a/b'):
+            assert '/test_closure01/a/b/c' in self._descendants(uid)
+
+
+    def test_hard_delete_ancestor(self):
+        '''
+        Test that deleting an ancestor of a buried resource without a
+        tombstone deletes all the descendants.
+        '''
+        rsrc_api.delete('/test_closure01/a', False)
+
+        for uid in ('/test_closure01/a', '/test_closure01/a/b',
+                '/test_closure01/a/b/c', '/test_closure01/a/b/c/d',
+                '/test_closure01/a/e'):
+            assert self._status(uid) == 404
+        assert self._descendants('/test_closure01') == set()
+        assert not any(
+                uid.startswith('/test_closure01/')
+                for uid in self._descendants('/'))
+
+
+    def test_forget_cascade(self):
+        '''
+        Test forgetting a resource with its children and inbound
+        relationships directly in the layout.
+        '''
+        rdfly = env.app_globals.rdfly
+        rsrc_api.create_or_replace('/test_closure02/a/b/c', mimetype=None)
+
+        with TxnManager(rdfly.store, True):
+            rdfly.forget_rsrc('/test_closure02/a')
+
+        assert self._descendants('/test_closure02') == set()
+        assert self._descendants('/test_closure02/a/b') == set()
+        assert not any(
+                uid.startswith('/test_closure02/a')
+                for uid in self._descendants('/'))
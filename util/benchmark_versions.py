@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import sys
+sys.path.append('.')
+
+import arrow
+import requests
+
+
+default_n = 1000
+n_reads = 10
+webroot = 'http://localhost:8000/ldp'
+#webroot = 'http://localhost:8080/rest'
+rsrc_uri = webroot + '/pomegranate_versions'
+
+sys.stdout.write('How many versions? [{}] >'.format(default_n))
+choice = input().lower()
+n = int(choice) if choice else default_n
+
+# Create a resource with `n` versions, then read its version metadata.
+
+requests.delete(rsrc_uri, headers={'prefer': 'no-tombstone'})
+requests.put(rsrc_uri).raise_for_status()
+
+
+start = arrow.utcnow()
+ckpt = start
+
+print('Creating {} versions.'.format(n))
+
+try:
+    for i in range(1, n + 1):
+        # Each version creation also reads the existing version metadata.
+        rsp = requests.post(rsrc_uri + '/fcr:versions')
+        rsp.raise_for_status()
+        if i % 100 == 0:
+            now = arrow.utcnow()
+            tdelta = now - ckpt
+            ckpt = now
+            print('Version: {}\tTime elapsed: {}'.format(i, tdelta))
+except KeyboardInterrupt:
+    print('Interruped after {} iterations.'.format(i))
+
+tdelta = arrow.utcnow() - start
+print('Total elapsed time: {}'.format(tdelta))
+print('Average time per version: {}'.format(tdelta.total_seconds()/i))
+
+print('Reading version metadata {} times.'.format(n_reads))
+start = arrow.utcnow()
+for i in range(n_reads):
+    rsp = requests.get(
+            rsrc_uri + '/fcr:versions', headers={'accept': 'text/turtle'})
+    rsp.raise_for_status()
+
+tdelta = arrow.utcnow() - start
+print('Average time per read: {}'.format(tdelta.total_seconds()/n_reads))